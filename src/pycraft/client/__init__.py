@@ -1,8 +1,9 @@
 # -*- coding: utf8 -*-
 
-from .analyzer import PacketAnalyzer
+from .analyzer import PacketAnalyzer, CaptureAnalyzer
 
 
 __all__ = [
     'PacketAnalyzer',
+    'CaptureAnalyzer',
     ]
\ No newline at end of file
@@ -1,15 +1,19 @@
 # -*- coding: utf8 -*-
 
 import io
+import mmap
+import multiprocessing
+import os
 import re
 import sys
 from binascii import hexlify as hex
-from collections import defaultdict
+from collections import defaultdict, Counter
 from pycraft.network import packet_classes
 from pycraft.network.container import SplitPacketContainer
-from pycraft.network import protocol
+from pycraft.network import capture, protocol
 from pycraft.network.packet.base import StreamRaw
 from pycraft.network.packet.data import EncapsulatedPacket as EncapPacket
+from pycraft.network.packet.data import DataPacket
 from pycraft.service.whole.handler.packet.both import Batch
 from pycraft.service.whole.handler.protocol import Protocol
 from pycraft.service.part.item.base import Item
@@ -20,6 +24,9 @@ from pycraft.service.primitive.values import MetaData
 protocol_serv = Protocol(
     38, '0.13.1', packet_classes(packet.both, packet.recv, packet.send))
 
+_JOB_SIZE = 50000  # records (1つのジョブで復号化する記録数の目安)
+_INOUT = {capture.RECV : '>', capture.SEND : '<'}
+
 
 class DecodeException(Exception):
     
@@ -252,6 +259,183 @@ class Formatter:
             yield indent + str(value)
 
 
+class CaptureSummary:
+    """binary capture を集計した結果
+
+    packets : Counter((方向, パケットのクラス名) -> 数)
+    sessions : dict(addr -> [受信数, 受信バイト数, 送信数, 送信バイト数])
+
+    >>> a, b = CaptureSummary(), CaptureSummary()
+    >>> a.packets['>', 'Ack'] += 2
+    >>> a.sessions[('127.0.0.1', 1)] = [2, 20, 0, 0]
+    >>> b.packets['>', 'Ack'] += 1
+    >>> b.sessions[('127.0.0.1', 2)] = [1, 10, 1, 30]
+    >>> a.update(b)
+    >>> a.packets
+    Counter({('>', 'Ack'): 3})
+    >>> sorted(a.sessions.items())
+    [(('127.0.0.1', 1), [2, 20, 0, 0]), (('127.0.0.1', 2), [1, 10, 1, 30])]
+    """
+
+    def __init__(self):
+        self.records = 0
+        self.errors = 0
+        self.packets = Counter()
+        self.sessions = {}
+
+    def update(self, other):
+        """別の集計結果を合わせる"""
+        self.records += other.records
+        self.errors += other.errors
+        self.packets.update(other.packets)
+        for addr, counts in other.sessions.items():
+            if addr in self.sessions:
+                self.sessions[addr] = [
+                    a + b for a, b in zip(self.sessions[addr], counts)]
+            else:
+                self.sessions[addr] = list(counts)
+
+    def report(self):
+        """集計結果を表示する行を返す"""
+        yield 'records: {0} sessions: {1} errors: {2}'.format(
+            self.records, len(self.sessions), self.errors)
+        yield 'packets:'
+        for (inout, name), n in self.packets.most_common():
+            yield '    {0} {1:<32}{2:>12}'.format(inout, name, n)
+        yield 'sessions: (> received, bytes / < sent, bytes)'
+        sessions = sorted(
+            self.sessions.items(), key=lambda i: i[1][1] + i[1][3],
+            reverse=True)
+        for addr, (rn, rb, sn, sb) in sessions:
+            yield '    {0:<24}> {1:>10}{2:>14} < {3:>10}{4:>14}'.format(
+                '{0}:{1}'.format(*addr), rn, rb, sn, sb)
+
+
+class _CaptureSession:
+    """1つの Session の記録を順に復号化して集計する"""
+
+    def __init__(self, summary, addr):
+        self._packets = summary.packets
+        self._counts = summary.sessions.setdefault(addr, [0, 0, 0, 0])
+        self._split_packets = {
+            '>' : SplitPacketContainer(),
+            '<' : SplitPacketContainer()}
+
+    def count(self, direction, buffer):
+        inout = _INOUT[direction]
+        i = 0 if direction == capture.RECV else 2
+        self._counts[i] += 1
+        self._counts[i+1] += len(buffer)
+        packet = protocol.net.packet(buffer)
+        self._count(inout, packet)
+        if not isinstance(packet, DataPacket):
+            return
+        packet.decode()
+        for pk in packet.packets:
+            if pk.split:
+                pk = self._split_packets[inout].concat(pk)
+                if pk == None:
+                    continue
+            self._count_application(inout, pk.buffer)
+
+    def _count_application(self, inout, buffer):
+        packet = protocol.app.packet(buffer)
+        if not isinstance(packet, StreamRaw):
+            self._count(inout, packet)
+            return
+        packet = protocol_serv.packet(buffer)
+        self._count(inout, packet)
+        if isinstance(packet, Batch):
+            packet.decode()
+            for payload in packet.payloads:
+                self._count(inout, protocol_serv.packet(payload))
+
+    def _count(self, inout, packet):
+        name = packet.__class__.__name__
+        if isinstance(packet, StreamRaw):
+            name = '{0}(0x{1:02x})'.format(name, packet.buffer()[0])
+        self._packets[inout, name] += 1
+
+
+def _analyze_job(args):
+    """ワーカープロセスで Session 毎に記録を復号化して集計する
+
+    args : (ファイル名, list((addr, array(記録の offset))))
+    """
+    path, sessions = args
+    summary = CaptureSummary()
+    with io.open(path, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        for addr, offsets in sessions:
+            session = _CaptureSession(summary, addr)
+            for offset in offsets:
+                _, _, direction, view = capture.read_record(buf, offset)
+                with view:
+                    buffer = bytes(view)
+                summary.records += 1
+                try:
+                    session.count(direction, buffer)
+                except Exception:
+                    summary.errors += 1
+    return summary
+
+
+class CaptureAnalyzer:
+    """binary capture 形式のファイルを集計する
+
+    ファイルを memory map して Session (クライアントの addr) 毎に記録を分け、
+    Session をまとめたジョブを複数のワーカープロセスで並列に復号化する。
+    集計途中の結果はジョブが終わる度に返す。
+
+    $ analyzer.py [capture_file] [num_of_workers]
+    """
+
+    def __init__(self, path, num_of_workers=None):
+        self._path = path
+        self._num_of_workers = num_of_workers or os.cpu_count()
+
+    def run(self):
+        summary = CaptureSummary()
+        for summary in self.analyze():
+            print(
+                '{0} records {1} sessions'.format(
+                    summary.records, len(summary.sessions)),
+                file=sys.stderr)
+        for l in summary.report():
+            print(l)
+
+    def analyze(self):
+        """ジョブが終わる度に、それまでの集計結果 (CaptureSummary) を返す"""
+        with io.open(self._path, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            index = capture.index_records(buf)
+        jobs = ((self._path, job) for job in self._jobs(index))
+        summary = CaptureSummary()
+        with multiprocessing.Pool(self._num_of_workers) as pool:
+            for result in pool.imap_unordered(_analyze_job, jobs):
+                summary.update(result)
+                yield summary
+
+    @staticmethod
+    def _jobs(index):
+        """記録の多い Session から順に _JOB_SIZE 程度ずつジョブにまとめる"""
+        job = []
+        size = 0
+        for addr, offsets in sorted(
+                index.items(), key=lambda i: len(i[1]), reverse=True):
+            job.append((addr, offsets))
+            size += len(offsets)
+            if size >= _JOB_SIZE:
+                yield job
+                job, size = [], 0
+        if len(job) > 0:
+            yield job
+
+
 if __name__ == '__main__':
-    analyzer = PacketAnalyzer()
-    analyzer.run()
\ No newline at end of file
+    if len(sys.argv) > 1:
+        num_of_workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+        CaptureAnalyzer(sys.argv[1], num_of_workers).run()
+    else:
+        analyzer = PacketAnalyzer()
+        analyzer.run()
\ No newline at end of file
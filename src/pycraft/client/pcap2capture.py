@@ -0,0 +1,117 @@
+# -*- coding: utf8 -*-
+
+import io
+import mmap
+import socket
+import struct
+import sys
+from pycraft.network import capture
+
+
+# pcap のリンク層の種類 -> IPv4 ヘッダまでのバイト数
+_LINK_HEADER_SIZE = {
+    0 : 4,  # NULL (loopback)
+    1 : 14,  # Ethernet
+    101 : 0,  # RAW
+    113 : 16,  # Linux cooked capture
+    228 : 0,  # IPv4
+    276 : 20,  # Linux cooked capture v2
+    }
+_ETHERNET = 1
+_ETHERTYPE_VLAN = 0x8100
+_IPPROTO_UDP = 17
+
+
+def read_pcap(buffer):
+    """pcap 形式のバイト列から IPv4 の UDP datagram を読み出す
+
+    (時刻, 送信元 addr, 送信先 addr, bytes) を返す。
+    分割された IP パケットは読み飛ばす。
+
+    >>> ip = struct.pack(
+    ...     '!BBHHHBBH4s4s', 0x45, 0, 20 + 8 + 3, 0, 0, 64, 17, 0,
+    ...     socket.inet_aton('10.0.0.2'), socket.inet_aton('10.0.0.1'))
+    >>> frame = ip + struct.pack('!HHHH', 5000, 19132, 8 + 3, 0) + b'abc'
+    >>> pcap = struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, 101)
+    >>> pcap += struct.pack('<IIII', 10, 500000, len(frame), len(frame))
+    >>> for t, src, dst, data in read_pcap(pcap + frame):
+    ...     print(t, src, dst, bytes(data))
+    10.5 ('10.0.0.2', 5000) ('10.0.0.1', 19132) b'abc'
+    """
+    view = memoryview(buffer)
+    magic = bytes(view[:4])
+    if magic in (b'\xd4\xc3\xb2\xa1', b'\x4d\x3c\xb2\xa1'):
+        endian = '<'
+    elif magic in (b'\xa1\xb2\xc3\xd4', b'\xa1\xb2\x3c\x4d'):
+        endian = '>'
+    else:
+        raise ValueError('not a pcap file (pcapng is not supported)')
+    # 時刻の端数の単位 (ナノ秒の pcap もある)
+    unit = 1e-9 if magic in (b'\x4d\x3c\xb2\xa1', b'\xa1\xb2\x3c\x4d') \
+        else 1e-6
+    link_type = struct.unpack_from(endian + 'I', view, 20)[0]
+    if link_type not in _LINK_HEADER_SIZE:
+        raise ValueError('unsupported link type {0}'.format(link_type))
+    record = struct.Struct(endian + 'IIII')
+    ip_header = struct.Struct('!BxxxxxHxB')
+    pos = 24
+    while pos + record.size <= len(view):
+        sec, frac, incl_len, _ = record.unpack_from(view, pos)
+        pos += record.size
+        frame = view[pos:pos+incl_len]
+        pos += incl_len
+        offset = _LINK_HEADER_SIZE[link_type]
+        if link_type == _ETHERNET \
+                and struct.unpack_from('!H', frame, 12)[0] == _ETHERTYPE_VLAN:
+            offset += 4
+        if len(frame) < offset + 28:
+            continue
+        version_ihl, flags_fragment, protocol = \
+            ip_header.unpack_from(frame, offset)
+        if version_ihl >> 4 != 4 or protocol != _IPPROTO_UDP \
+                or flags_fragment & 0x3fff != 0:
+            continue
+        ip_len = (version_ihl & 0x0f) * 4
+        src = socket.inet_ntoa(frame[offset+12:offset+16])
+        dst = socket.inet_ntoa(frame[offset+16:offset+20])
+        offset += ip_len
+        src_port, dst_port, udp_len = \
+            struct.unpack_from('!HHH', frame, offset)
+        data = frame[offset+8:offset+udp_len]
+        yield sec + frac * unit, (src, src_port), (dst, dst_port), data
+
+
+class Pcap2Capture:
+    """tcpdump などで保存した pcap ファイルを binary capture 形式に変換する
+
+    $ tcpdump -i [interface] -w [name].pcap udp port 19132
+    $ pcap2capture.py [name].pcap [name].cap host_ip [port]
+    """
+
+    def __init__(self, host_ip, port=19132):
+        self._server_addr = (host_ip, port)
+
+    def records(self, buffer):
+        """サーバーが送受信した datagram を capture の記録にして返す"""
+        for t, src, dst, data in read_pcap(buffer):
+            if dst == self._server_addr:
+                yield t, src, capture.RECV, data
+            elif src == self._server_addr:
+                yield t, dst, capture.SEND, data
+
+    def convert(self, pcap_path, capture_path):
+        with io.open(pcap_path, 'rb') as fin, \
+                mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as buf, \
+                io.open(capture_path, 'wb') as fout:
+            capture.write_header(fout)
+            capture.write_records(fout, self.records(buf))
+
+
+if __name__ == '__main__':
+    import os
+    if len(sys.argv) <= 3:
+        print('Usage: {0} pcap_file capture_file host_ip [port]'.format(
+            os.path.basename(sys.argv[0])))
+    else:
+        port = int(sys.argv[4]) if len(sys.argv) > 4 else 19132
+        Pcap2Capture(sys.argv[3], port).convert(sys.argv[1], sys.argv[2])
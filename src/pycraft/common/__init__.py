@@ -3,7 +3,7 @@
 from .buffer import Endian, ByteBuffer
 from .immutable import ImmutableMeta
 from .pqueue import PriorityQueue
-from .log import Logger
+from .log import Logger, Hex
 from .module import filter_classes
 
 
@@ -13,5 +13,6 @@ __all__ = [
     'ImmutableMeta',
     'PriorityQueue',
     'Logger',
+    'Hex',
     'filter_classes',
     ]
\ No newline at end of file
@@ -4,9 +4,22 @@ import struct
 from pycraft.common.immutable import ImmutableMeta
 
 
+# (byte_order, format) -> struct.Struct
+_STRUCTS = {}
+
+
+def _struct(byte_order, fmt):
+    """コンパイル済みの struct.Struct を返す"""
+    key = (byte_order, fmt)
+    st = _STRUCTS.get(key)
+    if st == None:
+        st = _STRUCTS[key] = struct.Struct(byte_order + fmt)
+    return st
+
+
 class Endian:
     """LittleEndian, BigEndian を扱う
-    
+
     >>> from binascii import hexlify as hex
     >>> hex(Endian.LITTLE.pack('h', 1))
     b'0100'
@@ -16,14 +29,31 @@ class Endian:
     1
     >>> Endian.BIG.unpack('h', bytearray.fromhex('0001'))
     1
+    >>> Endian.BIG.struct('ff').size
+    8
     """
 
     class Converter(metaclass=ImmutableMeta):
 
-        properties = 'byte_order slice_pack slice_unpack'
+        properties = '''byte_order slice_pack slice_unpack name
+            short uint int long float'''
+
+        @classmethod
+        def new(cls, byte_order, slice_pack, slice_unpack, name):
+            return (
+                byte_order, slice_pack, slice_unpack, name,
+                _struct(byte_order, 'H'),
+                _struct(byte_order, 'I'),
+                _struct(byte_order, 'i'),
+                _struct(byte_order, 'Q'),
+                _struct(byte_order, 'f'))
+
+        def struct(self, fmt):
+            """format に対応するコンパイル済みの struct.Struct を返す"""
+            return _struct(self.byte_order, fmt)
 
         def pack(self, type_char, value, byte=None):
-            array = struct.pack(self.byte_order + type_char, value)
+            array = _struct(self.byte_order, type_char).pack(value)
             if byte != None:
                 array = array[self.slice_pack(len(array), byte)]
             return array
@@ -31,20 +61,23 @@ class Endian:
         def unpack(self, type_char, buffer, fill_byte=None):
             if fill_byte != None:
                 buffer[self.slice_unpack(len(buffer))] = b'\x00' * fill_byte
-            return struct.unpack(self.byte_order + type_char, buffer)[0]
+            return _struct(self.byte_order, type_char).unpack(buffer)[0]
 
     __slots = ['LITTLE', 'BIG']
 
     LITTLE = Converter(
-        '<', lambda l,n: slice(None, n), lambda n: slice(n+1,n+1))
+        '<', lambda l,n: slice(None, n), lambda n: slice(n+1,n+1), 'little')
 
     BIG = Converter(
-        '>', lambda l,n: slice(l-n, None), lambda n: slice(0,0))
+        '>', lambda l,n: slice(l-n, None), lambda n: slice(0,0), 'big')
 
 
 class ByteBuffer:
     """bytearray を操作する
-    
+
+    読み込みは memoryview を介してコピーせずに行い、
+    書き込みは予め確保した領域に struct.Struct.pack_into で行う。
+
     >>> from binascii import hexlify as hex
     >>> buf = ByteBuffer()
     >>> buf.put_str('abcde')
@@ -69,21 +102,64 @@ class ByteBuffer:
     4.0
     >>> buf.next_addr()
     ('192.168.0.1', 80)
+    >>> buf.has_next()
+    False
+    >>> buf.next_byte()
+    Traceback (most recent call last):
+        ...
+    struct.error: unpack requires a buffer of 1 bytes
+    >>> buf = ByteBuffer(b'\\x01\\x02')
+    >>> buf.next_byte()
+    1
+    >>> buf.put_values(Endian.BIG.struct('Hf'), 3, 0.5)
+    >>> hex(buf.bytes())
+    b'0200033f000000'
+    >>> buf.next_byte(), buf.next_values(Endian.BIG.struct('Hf'))
+    (2, (3, 0.5))
+    >>> buf = ByteBuffer(b'\\x00\\x01\\x00\\x02')
+    >>> list(buf.iter_values(Endian.BIG.struct('H'), 2))
+    [(1,), (2,)]
+    >>> import copy
+    >>> buf = ByteBuffer(b'\\x01\\x02')
+    >>> buf.next_byte()
+    1
+    >>> c = copy.deepcopy(buf)
+    >>> c.put_byte(3)
+    >>> hex(c.bytes()), hex(buf.bytes())
+    (b'0203', b'02')
     """
-    
-    __slots__ = ['_buffer', '_offset']
+
+    __slots__ = ['_view', '_offset', '_length']
+
+    _MIN_CAPACITY = 64  # bytes
 
     def __init__(self, buffer=b''):
-        self._buffer = bytearray(buffer)
+        if not isinstance(buffer, bytes):
+            buffer = bytes(buffer)
+        # 読み込み専用の間は buffer を参照し、書き込み時に領域を確保する
+        self._view = memoryview(buffer)
         self._offset = 0
+        self._length = len(buffer)
+
+    def __getstate__(self):
+        # memoryview は pickle できないので、使用中の領域を bytes にする
+        return (self._view[:self._length].tobytes(), self._offset)
+
+    def __setstate__(self, state):
+        buffer, self._offset = state
+        self._view = memoryview(buffer)
+        self._length = len(buffer)
 
     def bytes(self):
         """オフセット以降のバイト列を返す"""
-        return bytes(self._buffer[self._offset:])
+        view = self._view
+        if self._offset == 0 and self._length == len(view) and view.readonly:
+            return view.obj
+        return view[self._offset:self._length].tobytes()
 
     def trim(self):
         """オフセット以降のバイト列を捨てる"""
-        del self._buffer[self._offset:]
+        self._length = self._offset
 
     def is_reading(self):
         """バイト列から取得途中ならば True を返す"""
@@ -91,10 +167,29 @@ class ByteBuffer:
 
     def has_next(self):
         """取得されていないバイト列が残っていれば True を返す"""
-        return self._offset < len(self._buffer)
+        return self._offset < self._length
+
+    def _reserve(self, byte):
+        """書き込む領域を確保して、書き込む位置を返す"""
+        pos = self._length
+        end = pos + byte
+        view = self._view
+        if view.readonly or end > len(view):
+            capacity = max(end, len(view) * 2, self._MIN_CAPACITY)
+            buffer = bytearray(capacity)
+            buffer[:pos] = view[:pos]
+            self._view = memoryview(buffer)
+        self._length = end
+        return pos
 
     def put(self, v):
-        self._buffer += v
+        pos = self._reserve(len(v))
+        self._view[pos:self._length] = v
+
+    def put_values(self, st, *values):
+        """struct.Struct で符号化した値を書き込む"""
+        pos = self._reserve(st.size)
+        st.pack_into(self._view, pos, *values)
 
     def put_str(self, v, endian=Endian.BIG, encoding='utf8'):
         v = bytes(v, encoding)
@@ -106,23 +201,32 @@ class ByteBuffer:
         self.put(v)
 
     def put_byte(self, v):
-        self.put(bytes([v]))
+        pos = self._reserve(1)
+        self._view[pos] = v
 
     def put_short(self, v, endian=Endian.BIG):
-        self.put(endian.pack('H', v))
+        st = endian.short
+        pos = self._reserve(2)
+        st.pack_into(self._view, pos, v)
 
     def put_triad(self, v, endian=Endian.LITTLE):
-        self.put(endian.pack('I', v, 3))
+        self.put((v & 0xFFFFFF).to_bytes(3, endian.name))
 
     def put_int(self, v, endian=Endian.BIG, unsigned=True):
-        self.put(endian.pack('I' if unsigned else 'i', v))
+        st = endian.uint if unsigned else endian.int
+        pos = self._reserve(4)
+        st.pack_into(self._view, pos, v)
 
     def put_long(self, v, endian=Endian.BIG):
-        self.put(endian.pack('Q', v))
+        st = endian.long
+        pos = self._reserve(8)
+        st.pack_into(self._view, pos, v)
 
     def put_float(self, v, endian=Endian.BIG):
-        self.put(endian.pack('f', v))
-    
+        st = endian.float
+        pos = self._reserve(4)
+        st.pack_into(self._view, pos, v)
+
     def put_addr(self, addr):
         ipaddr, port = addr
         self.put_byte(4)  # version
@@ -131,45 +235,76 @@ class ByteBuffer:
         self.put_short(port)
 
     def _next(self, byte=None):
+        offset = self._offset
         if byte == None:
-            buf = self._buffer[self._offset:]
+            end = self._length
         else:
-            buf = self._buffer[self._offset:self._offset+byte]
-        self._offset += len(buf)
-        return buf
-    
+            end = min(offset + byte, self._length)
+        self._offset = end
+        return self._view[offset:end]
+
+    def _next_struct(self, st):
+        offset = self._offset
+        end = offset + st.size
+        if end > self._length:
+            raise struct.error(
+                'unpack requires a buffer of {0} bytes'.format(st.size))
+        self._offset = end
+        return st.unpack_from(self._view, offset)
+
+    def next_values(self, st):
+        """struct.Struct で復号化した値を返す"""
+        return self._next_struct(st)
+
+    def iter_values(self, st, count):
+        """struct.Struct で復号化した count 個の値を順に返す"""
+        offset = self._offset
+        end = offset + st.size * count
+        if end > self._length:
+            raise struct.error(
+                'unpack requires a buffer of {0} bytes'.format(end - offset))
+        self._offset = end
+        return st.iter_unpack(self._view[offset:end])
+
     def next(self, byte=None):
-        return bytes(self._next(byte))
+        return self._next(byte).tobytes()
 
     def next_str(self, endian=Endian.BIG, encoding='utf8'):
         return str(self._next(self.next_short(endian)), encoding)
-    
+
     def next_bytes(self, endian=Endian.BIG):
-        return bytes(self._next(self.next_short(endian)))
+        return self._next(self.next_short(endian)).tobytes()
 
     def next_byte(self):
-        return ord(self._next(1))
+        offset = self._offset
+        if offset >= self._length:
+            raise struct.error('unpack requires a buffer of 1 bytes')
+        self._offset = offset + 1
+        return self._view[offset]
 
     def next_short(self, endian=Endian.BIG):
-        return endian.unpack('H', self._next(2))
+        return self._next_struct(endian.short)[0]
 
     def next_triad(self, endian=Endian.LITTLE):
-        return endian.unpack('I', self._next(3), 1)
-    
+        buf = self._next(3)
+        if len(buf) != 3:
+            raise struct.error('unpack requires a buffer of 3 bytes')
+        return int.from_bytes(buf, endian.name)
+
     def next_int(self, endian=Endian.BIG, unsigned=True):
-        return endian.unpack('I' if unsigned else 'i', self._next(4))
+        return self._next_struct(endian.uint if unsigned else endian.int)[0]
 
     def next_long(self, endian=Endian.BIG):
-        return endian.unpack('Q', self._next(8))
+        return self._next_struct(endian.long)[0]
 
     def next_float(self, endian=Endian.BIG):
-        return endian.unpack('f', self._next(4))
+        return self._next_struct(endian.float)[0]
 
     def next_addr(self):
         version = self.next_byte()
         if version == 4:
             ipaddr = '.'.join(str(~self.next_byte() & 0xFF) for _ in range(4))
-            port = self.next_short() 
+            port = self.next_short()
             return (ipaddr, port)
         else:
             raise NotImplementedError(version)
@@ -177,4 +312,4 @@ class ByteBuffer:
 
 if __name__ == '__main__':
     import doctest
-    doctest.testmod()
\ No newline at end of file
+    doctest.testmod()
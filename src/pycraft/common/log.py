@@ -1,10 +1,45 @@
 # -*- coding: utf8 -*-
 
 import logging
+from binascii import hexlify
+
+
+class _Message:
+    """Handler が出力する時に初めて文字列にするログメッセージ"""
+
+    __slots__ = ['_msg', '_kwargs']
+
+    def __init__(self, msg, kwargs):
+        self._msg = msg
+        self._kwargs = kwargs
+
+    def __str__(self):
+        return self._msg.format_map(self._kwargs)
+
+
+class Hex:
+    """ログメッセージに書式化する時に初めて16進数にするバイト列
+
+    >>> '{0}'.format(Hex(b'\\x01\\xab'))
+    "b'01ab'"
+    """
+
+    __slots__ = ['_buffer']
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+
+    def __format__(self, spec):
+        return format(hexlify(self._buffer), spec)
 
 
 class Logger:
-    
+    """str.format の書式でメッセージを出力する Logger
+
+    出力しないレベルのメッセージは書式化しない。
+    書式化は Handler が出力する時まで遅延する。
+    """
+
     __slots__ = ['_logger']
 
     def __init__(self, name):
@@ -12,20 +47,25 @@ class Logger:
 
     def debug(self, msg, **kwargs):
         if self._logger.isEnabledFor(logging.DEBUG):
-            self._logger.debug(msg.format_map(kwargs))
+            self._logger.debug(_Message(msg, kwargs))
 
     def info(self, msg, **kwargs):
         if self._logger.isEnabledFor(logging.INFO):
-            self._logger.info(msg.format_map(kwargs))
+            self._logger.info(_Message(msg, kwargs))
 
     def warning(self, msg, **kwargs):
         if self._logger.isEnabledFor(logging.WARNING):
-            self._logger.warning(msg.format_map(kwargs))
-    
+            self._logger.warning(_Message(msg, kwargs))
+
     def error(self, msg, **kwargs):
         if self._logger.isEnabledFor(logging.ERROR):
-            self._logger.error(msg.format_map(kwargs))
-    
+            self._logger.error(_Message(msg, kwargs))
+
     def critical(self, msg, **kwargs):
         if self._logger.isEnabledFor(logging.CRITICAL):
-            self._logger.critical(msg.format_map(kwargs))
\ No newline at end of file
+            self._logger.critical(_Message(msg, kwargs))
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -11,7 +11,7 @@ def init_logger(root):
     server_log_file = os.path.join(root, 'server.log')
     packet_log_file = os.path.join(root, 'packet.log')
 
-    logging.basicConfig(level=logging.DEBUG)
+    logging.basicConfig(level=getattr(logging, service.config.log_level))
 
     logger = logging.getLogger(network.LogName.SERVER)
     logger.propagate = False
@@ -21,6 +21,11 @@ def init_logger(root):
 
     logger = logging.getLogger(network.LogName.PACKET)
     logger.propagate = False
+    if not service.config.packet_log:
+        # 16進数のテキストにする処理が重いので、必要な時だけ出力する
+        logger.setLevel(logging.WARNING)
+        return
+    logger.setLevel(logging.DEBUG)
     h = logging.FileHandler(packet_log_file)
     h.setFormatter(logging.Formatter('%(message)s'))
     logger.addHandler(h)
@@ -49,7 +54,17 @@ def main():
     init_store(database)
     store = service.DataStore(database)
     clock = service.Clock()
-    server = network.Server((host, port), service.Handler(store, clock))
+    handler = service.Handler(store, clock)
+    if service.config.network_workers > 0:
+        server = network.MultiProcessServer(
+            (host, port), handler, service.config.network_workers)
+    elif service.config.use_asyncio:
+        server = network.AsyncServer((host, port), handler)
+    else:
+        server = network.Server((host, port), handler)
+    if service.config.packet_capture != None:
+        server.set_capture(network.PacketCapture(
+            path=os.path.join(root, service.config.packet_capture)))
     console = Console(server)
     server.run(console.start)
     print('Server terminated.')
@@ -1,8 +1,11 @@
 # -*- coding: utf8 -*-
 
-from .interface import Reliability, Session, Handler
+from .interface import Reliability, Priority, Session, Handler
 from .logger import LogName
 from .server import Server
+from .asyncserver import AsyncServer
+from .frontend import MultiProcessServer
+from .capture import PacketCapture
 from .protocol import Protocol, packet_classes
 from .packet import ApplicationPacket
 from .portscanner import PortScanner
@@ -10,10 +13,14 @@ from .portscanner import PortScanner
 
 __all__ = [
     'Reliability',
+    'Priority',
     'Session',
     'Handler',
     'LogName',
     'Server',
+    'AsyncServer',
+    'MultiProcessServer',
+    'PacketCapture',
     'Protocol',
     'ApplicationPacket',
     'PortScanner',
@@ -0,0 +1,138 @@
+# -*- coding: utf8 -*-
+
+import os
+import time
+import asyncio
+from operator import attrgetter
+from . import logger, protocol
+from .server import Server
+
+
+class AsyncServer(Server):
+    """asyncio のイベントループでUDPパケットの送受信を行うサーバー
+
+    Server と同じ Session, Handler を使用する。
+    パケットの受信はイベントループのコールバックで処理し、
+    Session の更新はタイマーで、Handler の更新は周期的なタスクで行う。
+    他の通信(管理用のエンドポイントなど)と同じイベントループを共有できる。
+    """
+
+    loop = property(attrgetter('_loop'))
+
+    def __init__(self, server_addr, handler, loop=None):
+        super().__init__(server_addr, handler)
+        self._loop = loop
+        self._transport = None
+        # ACK,NACK を送信するセッション (Session.addr -> Session)
+        self._recv_sessions = {}
+        # Session の更新を予約したタイマー
+        self._update_handle = None
+        self._is_update_scheduled = False
+
+    def terminate(self):
+        self._terminated = True
+        if self._loop != None:
+            self._loop.call_soon_threadsafe(lambda: None)
+
+    def run(self, started_callback=lambda: None):
+        logger.server.info(
+            'start {name}(pid={pid})',
+            name=self.__class__.__name__, pid=os.getpid())
+        if self._loop == None:
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+        self._handler.start()
+        self._transport, _ = self._loop.run_until_complete(
+            self._loop.create_datagram_endpoint(
+                lambda: _DatagramProtocol(self),
+                local_addr=self._server_addr))
+        self._init_recv_buffer(self._transport.get_extra_info('socket'))
+        if self._capture != None:
+            self._capture.start()
+        started_callback()
+        try:
+            self._loop.run_until_complete(self._tick())
+        finally:
+            if self._update_handle != None:
+                self._update_handle.cancel()
+            self._handler.terminate()
+            if self._capture != None:
+                self._capture.terminate()
+            self._transport.close()
+        logger.server.info('terminate {name}', name=self.__class__.__name__)
+
+    async def _tick(self):
+        """Handler を Scheduler のフレーム毎に更新する"""
+        scheduler = self._handler.scheduler
+        while not self._terminated:
+            scheduler.start()
+            self._handler.update()
+            self._schedule_update()
+            await asyncio.sleep(scheduler.wait_time())
+
+    def _schedule_update(self):
+        """Session の更新を予約する (同じループ内の予約はまとめる)"""
+        if not self._is_update_scheduled:
+            self._is_update_scheduled = True
+            self._loop.call_soon(self._update_sessions)
+
+    def _update_sessions(self):
+        self._is_update_scheduled = False
+        if self._update_handle != None:
+            self._update_handle.cancel()
+            self._update_handle = None
+        super()._update_sessions()
+        # 次に更新が必要な時刻にタイマーを設定する
+        t = self._timers.next_time()
+        if t != None:
+            self._update_handle = self._loop.call_later(
+                max(0, t - time.monotonic()), self._schedule_update)
+
+    def datagram_received(self, buffer, addr):
+        """受信したパケットを処理する
+
+        ACK,NACK は同じループ内で受信したパケットをまとめて送信する。
+        """
+        packet = self._decode_packet(buffer, addr)
+        session = self._session(addr)
+        session.received()
+        protocol.net.handle(session, packet)
+        if len(self._recv_sessions) == 0:
+            self._loop.call_soon(self._send_acknowledge)
+        self._recv_sessions[addr] = session
+
+    def _send_acknowledge(self):
+        recv_sessions = self._recv_sessions
+        self._recv_sessions = {}
+        for session in recv_sessions.values():
+            session.send_acknowledge()
+            self.touch_session(session)
+        self._schedule_update()
+
+    def ready_to_send(self, session):
+        """Session に積まれた datagram の送信を予約する (同じループ内はまとめる)"""
+        if len(self._send_sessions) == 0:
+            self._loop.call_soon(self._flush_sessions)
+        super().ready_to_send(session)
+
+    def _send_datagrams(self, addr, datagrams):
+        """符号化済みの datagram を送信する
+
+        送信バッファが一杯の場合は Transport がバッファリングする。
+        """
+        sendto = self._transport.sendto
+        while len(datagrams) > 0:
+            sendto(datagrams.popleft(), addr)
+        return True
+
+
+class _DatagramProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, server):
+        self._server = server
+
+    def datagram_received(self, data, addr):
+        self._server.datagram_received(data, addr)
+
+    def error_received(self, exc):
+        logger.server.warning('receive error ({error})', error=exc)
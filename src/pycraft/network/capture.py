@@ -0,0 +1,192 @@
+# -*- coding: utf8 -*-
+
+import io
+import socket
+import struct
+import threading
+import time
+from array import array
+from collections import deque
+from . import logger
+
+
+RECV = 0  # クライアントから受信した datagram
+SEND = 1  # クライアントへ送信した datagram
+
+_RING_SIZE = 65536  # records
+_WRITE_INTERVAL = 0.5  # sec (ファイルに書き出す間隔)
+
+# ファイルの先頭に書く識別子と版
+_MAGIC = b'PYCRAFT-CAPTURE\x01'
+# 時刻 (UNIX 時間), 方向, IPv4 アドレス, ポート, バイト数
+_RECORD = struct.Struct('<dB4sHI')
+# 記録の先頭からバイト数までの位置
+_LENGTH_OFFSET = 15
+_LENGTH = struct.Struct('<I')
+
+
+def write_header(f):
+    """binary capture 形式のファイルの先頭を書き込む"""
+    f.write(_MAGIC)
+
+
+def write_records(f, records):
+    """記録を binary capture 形式で書き込む
+
+    records : iterable((時刻, addr, 方向, bytes))
+    """
+    pack = _RECORD.pack
+    inet_aton = socket.inet_aton
+    for t, addr, direction, buffer in records:
+        f.write(pack(t, direction, inet_aton(addr[0]), addr[1], len(buffer)))
+        f.write(buffer)
+
+
+def read_records(buffer):
+    """binary capture 形式のバイト列から記録を読み出す
+
+    buffer : bytes-like (先頭は _MAGIC)
+    記録の datagram は buffer の memoryview で返す。
+
+    >>> f = io.BytesIO()
+    >>> write_header(f)
+    >>> write_records(f, [
+    ...     (1.5, ('127.0.0.1', 19132), RECV, b'\\x01\\x02'),
+    ...     (2.0, ('10.0.0.1', 4000), SEND, b'')])
+    >>> for t, addr, direction, data in read_records(f.getvalue()):
+    ...     print(t, addr, direction, bytes(data))
+    1.5 ('127.0.0.1', 19132) 0 b'\\x01\\x02'
+    2.0 ('10.0.0.1', 4000) 1 b''
+    """
+    view = memoryview(buffer)
+    for offset in _offsets(view):
+        yield read_record(view, offset)
+
+
+def read_record(buffer, offset):
+    """offset から始まる記録を (時刻, addr, 方向, memoryview) で返す"""
+    t, direction, host, port, length = _RECORD.unpack_from(buffer, offset)
+    pos = offset + _RECORD.size
+    view = memoryview(buffer)[pos:pos+length]
+    return t, (socket.inet_ntoa(host), port), direction, view
+
+
+def index_records(buffer):
+    """記録の位置を addr 毎に集める
+
+    返り値 : dict(addr -> array(記録の offset)) (offset は記録の順)
+
+    >>> f = io.BytesIO()
+    >>> write_header(f)
+    >>> write_records(f, [
+    ...     (1.0, ('127.0.0.1', 1), RECV, b'a'),
+    ...     (2.0, ('127.0.0.1', 2), RECV, b'bb'),
+    ...     (3.0, ('127.0.0.1', 1), SEND, b'ccc')])
+    >>> index = index_records(f.getvalue())
+    >>> sorted((addr, list(offsets)) for addr, offsets in index.items())
+    [(('127.0.0.1', 1), [16, 57]), (('127.0.0.1', 2), [36])]
+    """
+    view = memoryview(buffer)
+    # (host, port) のバイト列 -> offset (文字列にするのは最後に1度だけ)
+    index = {}
+    for offset in _offsets(view):
+        key = bytes(view[offset+9:offset+15])
+        offsets = index.get(key)
+        if offsets == None:
+            offsets = index[key] = array('Q')
+        offsets.append(offset)
+    return dict(
+        ((socket.inet_ntoa(key[:4]), struct.unpack('<H', key[4:])[0]), v)
+            for key, v in index.items())
+
+
+def _offsets(view):
+    """記録の先頭の位置を順に返す"""
+    if bytes(view[:len(_MAGIC)]) != _MAGIC:
+        raise ValueError('not a pycraft capture')
+    unpack_from = _LENGTH.unpack_from
+    pos = len(_MAGIC)
+    end = len(view)
+    while pos + _RECORD.size <= end:
+        yield pos
+        pos += _RECORD.size + unpack_from(view, pos + _LENGTH_OFFSET)[0]
+
+
+class PacketCapture:
+    """送受信した datagram をメモリ上のリングバッファに記録する
+
+    記録は (時刻, addr, 方向, bytes) とし、size 個を超えたら古いものを捨てる。
+    path を指定すると、start から terminate までの間、
+    別スレッドで記録を binary capture 形式のファイルに書き出す。
+
+    >>> capture = PacketCapture(size=2)
+    >>> for i in range(3):
+    ...     capture.record(RECV, ('127.0.0.1', 19132), bytes([i]))
+    >>> [buffer for _, _, _, buffer in capture.records()]
+    [b'\\x01', b'\\x02']
+    """
+
+    __slots__ = ['_size', '_path', '_ring', '_thread', '_stopped']
+
+    def __init__(self, size=_RING_SIZE, path=None):
+        self._size = size
+        self._path = path
+        # (時刻, addr, 方向, bytes)
+        self._ring = deque(maxlen=size)
+        self._thread = None
+        self._stopped = threading.Event()
+
+    path = property(lambda self: self._path)
+
+    def clone(self, path=None):
+        """同じ大きさで記録のない PacketCapture を返す"""
+        return self.__class__(self._size, path)
+
+    def record(self, direction, addr, buffer):
+        """datagram を記録する (別スレッドから書き出していても呼び出せる)"""
+        self._ring.append((time.time(), addr, direction, buffer))
+
+    def records(self):
+        """記録の複製を古い順に返す"""
+        return list(self._ring)
+
+    def dump(self, path):
+        """記録をファイルに書き出す"""
+        with io.open(path, 'wb') as f:
+            write_header(f)
+            write_records(f, self.records())
+
+    def start(self):
+        if self._path == None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._write, args=(self._path,), daemon=True)
+        self._thread.start()
+        logger.server.info('capture packets to {path}', path=self._path)
+
+    def terminate(self):
+        if self._thread == None:
+            return
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+
+    def _write(self, path):
+        """記録を定期的にリングバッファから取り出して書き出す"""
+        ring = self._ring
+        def records():
+            # 取り出している間も record で追加される
+            for _ in range(len(ring)):
+                yield ring.popleft()
+        with io.open(path, 'wb') as f:
+            write_header(f)
+            while not self._stopped.wait(_WRITE_INTERVAL):
+                write_records(f, records())
+                f.flush()
+            write_records(f, records())
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
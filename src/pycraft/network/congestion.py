@@ -0,0 +1,186 @@
+# -*- coding: utf8 -*-
+
+import time
+
+
+class RttEstimator:
+    """ACK が届くまでの時間 (RTT) から再送までの時間 (RTO) を求める
+
+    RFC 6298 と同じ計算を行う。
+
+    >>> rtt = RttEstimator()
+    >>> rtt.rto
+    1.0
+    >>> rtt.sample(0.1)
+    >>> round(rtt.srtt, 3), round(rtt.rto, 3)
+    (0.1, 0.3)
+    >>> rtt.sample(0.1)
+    >>> round(rtt.srtt, 3), round(rtt.rto, 3)
+    (0.1, 0.25)
+    >>> rtt.back_off()
+    >>> round(rtt.rto, 3)
+    0.5
+    """
+
+    __slots__ = ['_srtt', '_rttvar', '_rto']
+
+    INITIAL_RTO = 1.0  # sec
+    MIN_RTO = 0.2  # sec
+    MAX_RTO = 4.0  # sec
+
+    _ALPHA = 1 / 8
+    _BETA = 1 / 4
+
+    def __init__(self):
+        # 平滑化した RTT (計測していなければ None)
+        self._srtt = None
+        # RTT の変動
+        self._rttvar = None
+        self._rto = self.INITIAL_RTO
+
+    srtt = property(lambda self: self._srtt)
+    rto = property(lambda self: self._rto)
+
+    def sample(self, rtt):
+        """計測した RTT を反映する"""
+        if self._srtt == None:
+            self._srtt = rtt
+            self._rttvar = rtt / 2
+        else:
+            self._rttvar += self._BETA * (abs(self._srtt - rtt) - self._rttvar)
+            self._srtt += self._ALPHA * (rtt - self._srtt)
+        self._set_rto(self._srtt + 4 * self._rttvar)
+
+    def back_off(self):
+        """再送が発生したので RTO を倍にする"""
+        self._set_rto(self._rto * 2)
+
+    def _set_rto(self, rto):
+        self._rto = min(max(rto, self.MIN_RTO), self.MAX_RTO)
+
+
+class CongestionWindow:
+    """ACK を待つ DataPacket の数 (送信中の数) を制限する
+
+    ACK を受け取る度に広げ (スロースタート、輻輳回避)、
+    パケットの損失を検出したら狭める。
+
+    >>> cwnd = CongestionWindow()
+    >>> cwnd.size, cwnd.can_send(15), cwnd.can_send(16)
+    (16, True, False)
+    >>> cwnd.acked(4)
+    >>> cwnd.size
+    20
+    >>> cwnd.lost(10, 20)
+    >>> cwnd.size
+    10
+    >>> cwnd.lost(15, 20)  # 同じ損失 (狭めた後に送信したものではない)
+    >>> cwnd.size
+    10
+    >>> cwnd.acked(11)  # 輻輳回避では 1 RTT 毎に約 1 広がる
+    >>> cwnd.size
+    11
+    >>> cwnd.timeout(30)
+    >>> cwnd.size
+    4
+    """
+
+    __slots__ = ['_size', '_threshold', '_recovery_seq_num']
+
+    INITIAL_SIZE = 16  # packets
+    MIN_SIZE = 4  # packets
+    MAX_SIZE = 1024  # packets
+
+    def __init__(self):
+        self._size = float(self.INITIAL_SIZE)
+        # スロースタートから輻輳回避に切り替える大きさ
+        self._threshold = float(self.MAX_SIZE)
+        # この番号より前に送信したパケットの損失では狭めない
+        self._recovery_seq_num = -1
+
+    size = property(lambda self: int(self._size))
+
+    def can_send(self, num_of_in_flight):
+        """送信中のパケットが num_of_in_flight 個の時に送信できるか？"""
+        return num_of_in_flight < int(self._size)
+
+    def acked(self, num):
+        """num 個のパケットの ACK を受け取った"""
+        for _ in range(num):
+            if self._size < self._threshold:
+                self._size += 1
+            else:
+                self._size += 1 / self._size
+        self._size = min(self._size, self.MAX_SIZE)
+
+    def lost(self, seq_num, next_seq_num):
+        """seq_num のパケットの損失 (NACK) を検出した
+
+        next_seq_num : 次に送信するパケットの番号
+        """
+        if seq_num < self._recovery_seq_num:
+            return
+        self._recovery_seq_num = next_seq_num
+        self._threshold = max(self._size / 2, self.MIN_SIZE)
+        self._size = self._threshold
+
+    def timeout(self, next_seq_num):
+        """ACK が届かずに再送した
+
+        next_seq_num : 次に送信するパケットの番号
+        """
+        self._recovery_seq_num = next_seq_num
+        self._threshold = max(self._size / 2, self.MIN_SIZE)
+        self._size = float(self.MIN_SIZE)
+
+
+class TokenBucket:
+    """一定の速さで補充されるトークンの分だけ送信を許可する
+
+    rate : 1秒あたりに補充するトークン (bytes)
+    capacity : 蓄積できるトークンの上限 (bytes)
+    トークンが残っていれば、足りなくても送信を許可して不足分を後で補う。
+
+    >>> bucket = TokenBucket(100, 200, now=0)
+    >>> bucket.consume(150, 0), bucket.consume(100, 0), bucket.consume(1, 0)
+    (True, True, False)
+    >>> bucket.available_time(0)
+    0.51
+    >>> bucket.consume(1, 0.5), bucket.consume(1, 0.51)
+    (False, True)
+    >>> bucket.consume(1, 100), bucket.available_time(100)
+    (True, 100)
+    """
+
+    __slots__ = ['_rate', '_capacity', '_tokens', '_time']
+
+    def __init__(self, rate, capacity, now=None):
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._time = time.monotonic() if now == None else now
+
+    def _refill(self, now):
+        self._tokens = min(
+            self._tokens + (now - self._time) * self._rate, self._capacity)
+        self._time = now
+
+    def consume(self, size, now):
+        """size バイトを送信できれば、トークンを消費して True を返す"""
+        self._refill(now)
+        if self._tokens <= 0:
+            return False
+        self._tokens -= size
+        return True
+
+    def available_time(self, now):
+        """次に送信できるようになる時刻を返す"""
+        self._refill(now)
+        if self._tokens > 0:
+            return now
+        return now + (1 - self._tokens) / self._rate
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
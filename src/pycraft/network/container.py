@@ -1,6 +1,9 @@
 # -*- coding: utf8 -*-
 
+import time
+from collections import OrderedDict
 from .packet.data import EncapsulatedPacket as EncapPacket
+from . import logger
 
 
 class DataPacketContainer:
@@ -32,29 +35,179 @@ class DataPacketContainer:
         return len(self._packet)
 
 
+class _SplitBuffer:
+    """1つの分割パケットの断片を結合する領域"""
+
+    __slots__ = ['count', 'size', 'buffer', 'view', 'received', 'last', 'time']
+
+    def __init__(self, count, now):
+        self.count = count
+        # 最後以外の断片の長さ (最後以外の断片が届くまで None)
+        self.size = None
+        # 結合後のバイト列を書き込む領域
+        self.buffer = None
+        self.view = None
+        # 届いた断片の index のビットマップ
+        self.received = 0
+        # 最後の断片
+        self.last = None
+        self.time = now
+
+    def is_completed(self):
+        return self.received == (1 << self.count) - 1
+
+    def allocate(self, size):
+        self.size = size
+        self.buffer = bytearray(size * self.count)
+        self.view = memoryview(self.buffer)
+
+    def concat(self):
+        """結合したバイト列を返す"""
+        if self.count == 1:
+            return self.last
+        pos = self.size * (self.count - 1)
+        end = pos + len(self.last)
+        self.view[pos:end] = self.last
+        return self.view[:end].tobytes()
+
+
 class SplitPacketContainer:
-    """分割された EncapsulatedPacket を保存して結合するコンテナ"""
-    
-    __slots__ = ['_split_packets']
+    """分割された EncapsulatedPacket を保存して結合するコンテナ
+
+    断片の長さと分割数から結合後の領域を確保し、断片を直接書き込む。
+    保持する分割パケットの数、分割数、バイト数と保持する時間に上限を設け、
+    超えた場合は古いものから破棄する。
+
+    >>> c = SplitPacketContainer()
+    >>> def split(index, buffer, count=3, id=0):
+    ...     return EncapPacket(3, buffer, split=EncapPacket.Split(count, id, index))
+    >>> c.concat(split(2, b'e'))
+    >>> c.concat(split(0, b'ab'))
+    >>> c.concat(split(0, b'ab'))  # 重複
+    >>> c.concat(split(1, b'cd')).buffer
+    b'abcde'
+    >>> c.concat(split(0, b'a', count=1)).buffer
+    b'a'
+    >>> c.concat(split(0, b'ab', count=10000)), len(c)
+    (None, 0)
+    >>> for i in range(SplitPacketContainer.MAX_SPLITS + 1):
+    ...     c.concat(split(0, b'ab', id=i))
+    >>> len(c)
+    16
+    >>> c.expire(now=float('inf'))
+    >>> len(c)
+    0
+    """
+
+    __slots__ = ['_splits', '_num_of_bytes']
+
+    MAX_SPLITS = 16  # 同時に保持する分割パケットの数
+    MAX_COUNT = 512  # 分割数
+    MAX_BYTES = 1024 * 1024  # 保持する合計バイト数
+    TIMEOUT = 10  # sec
 
     def __init__(self):
-        self._split_packets = {}
-    
+        # split.id -> _SplitBuffer (保持し始めた順)
+        self._splits = OrderedDict()
+        self._num_of_bytes = 0
+
+    def __len__(self):
+        """保持している分割パケットの数を返す"""
+        return len(self._splits)
+
+    def _discard(self, split_id, reason):
+        s = self._splits.pop(split_id)
+        if s.buffer != None:
+            self._num_of_bytes -= len(s.buffer)
+        logger.server.info(
+            'discard split packet {id} ({reason})', id=split_id, reason=reason)
+
+    def expire(self, now=None):
+        """TIMEOUT を超えて揃わない分割パケットを破棄する"""
+        if now == None:
+            now = time.monotonic()
+        while len(self._splits) > 0:
+            split_id, s = next(iter(self._splits.items()))
+            if now - s.time < self.TIMEOUT:
+                break
+            self._discard(split_id, 'timeout')
+
+    def _new_split(self, split):
+        if not 0 < split.count <= self.MAX_COUNT:
+            logger.server.info(
+                'discard split packet {id} (count={count})',
+                id=split.id, count=split.count)
+            return None
+        self.expire()
+        while len(self._splits) >= self.MAX_SPLITS:
+            self._discard(next(iter(self._splits)), 'too many splits')
+        s = self._splits[split.id] = _SplitBuffer(split.count, time.monotonic())
+        return s
+
+    def _allocate(self, split_id, s, size):
+        num_of_bytes = size * s.count
+        if num_of_bytes > self.MAX_BYTES:
+            self._discard(split_id, 'too large')
+            return False
+        for other_id in list(self._splits):
+            if self._num_of_bytes + num_of_bytes <= self.MAX_BYTES:
+                break
+            if other_id != split_id:
+                self._discard(other_id, 'out of memory')
+        s.allocate(size)
+        self._num_of_bytes += num_of_bytes
+        return True
+
     def concat(self, packet):
-        """分割された EncapsulatedPacket を結合する"""
-        # 分割されたパケットを保存するためのコンテナをつくる
-        if packet.split.id not in self._split_packets:
-            self._split_packets[packet.split.id] = {}
-        # コンテナにパケットを保存する
-        container = self._split_packets[packet.split.id]
-        container[packet.split.index] = packet
-        if len(container) == packet.split.count:
-            # コンテナにパケットが揃ったならば結合したパケットを返す
-            buffer = b''.join(
-                pk.buffer for pk in 
-                    sorted(container.values(), key=lambda v: v.split.index))
-            del self._split_packets[packet.split.id]
-            return EncapPacket(0, buffer)
+        """分割された EncapsulatedPacket を結合する
+
+        全ての断片が揃ったならば結合したパケット (断片と同じ order) を返し、
+        揃っていなければ None を返す。
+        """
+        split = packet.split
+        split_id, index = split.id, split.index
+        s = self._splits.get(split_id)
+        if s == None:
+            s = self._new_split(split)
+            if s == None:
+                return None
+        if s.count != split.count or index >= s.count:
+            self._discard(split_id, 'illegal index')
+            return None
+        bit = 1 << index
+        if s.received & bit:
+            return None  # 重複
+        buffer = packet.buffer
+        size = s.size
+        if index == s.count - 1:
+            # 最後の断片は短いので、結合する時に書き込む
+            if size != None and len(buffer) > size:
+                self._discard(split_id, 'illegal size')
+                return None
+            s.last = buffer
         else:
-            # コンテナにパケットが揃っていないならば何も返さない
+            if size == None:
+                if not self._allocate(split_id, s, len(buffer)):
+                    return None
+                size = s.size
+                if s.last != None and len(s.last) > size:
+                    self._discard(split_id, 'illegal size')
+                    return None
+            if len(buffer) != size:
+                self._discard(split_id, 'illegal size')
+                return None
+            pos = index * size
+            s.view[pos:pos + size] = buffer
+        s.received |= bit
+        if not s.is_completed():
             return None
+        # 揃ったならば結合したパケットを返す
+        del self._splits[split_id]
+        if s.buffer != None:
+            self._num_of_bytes -= len(s.buffer)
+        return EncapPacket(packet.reliability, s.concat(), order=packet.order)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
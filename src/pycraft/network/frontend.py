@@ -0,0 +1,375 @@
+# -*- coding: utf8 -*-
+
+import os
+import socket
+import struct
+import selectors
+from collections import deque
+from multiprocessing import Process, Value
+from multiprocessing.connection import wait
+from operator import attrgetter
+from . import container, interface, logger
+from .packet import ApplicationPacket
+from .server import Server
+
+
+_CHANNEL_BUFFER_SIZE = 4 * 1024 * 1024  # bytes
+# bytes (Session が組み立てられる最も大きなパケット)
+_MAX_PAYLOAD_SIZE = container.SplitPacketContainer.MAX_BYTES
+_TERMINATE_TIMEOUT = 5  # sec (ワーカープロセスの終了を待つ時間)
+
+
+class _Message:
+    """プロセス間で送受信するメッセージ
+
+    ヘッダ (kind, IPアドレス, ポート, reliability, channel, is_immediate)
+    の後ろにペイロードが続く。
+    """
+
+    OPEN = 0  # worker -> world : Session が接続した
+    CLOSE = 1  # worker -> world : Session が切断した (payload: 理由)
+    PACKET = 2  # 双方向 : ApplicationPacket (payload: 符号化済みバイト列)
+    INFO = 3  # world -> worker : Handler.info() (payload: 文字列)
+
+    HEADER = struct.Struct('!B4sHBBB')
+
+    @classmethod
+    def pack(
+            cls, kind, addr, payload=b'',
+            reliability=0, channel=0, is_immediate=False):
+        ipaddr, port = addr
+        header = cls.HEADER.pack(
+            kind, socket.inet_aton(ipaddr), port,
+            reliability, channel, 1 if is_immediate else 0)
+        return header + payload
+
+    @classmethod
+    def unpack(cls, buffer):
+        kind, ipaddr, port, reliability, channel, is_immediate = \
+            cls.HEADER.unpack_from(buffer)
+        addr = (socket.inet_ntoa(ipaddr), port)
+        payload = buffer[cls.HEADER.size:]
+        return kind, addr, payload, reliability, channel, is_immediate > 0
+
+
+class _Channel:
+    """UNIX ドメインソケットによるプロセス間のメッセージ送受信
+
+    送信できなかったメッセージは蓄積し、flush で再送する。
+
+    >>> channel, worker_channel = _Channel.pair()
+    >>> channel.setblocking(False)
+    >>> worker_channel.send(
+    ...     _Message.PACKET, ('127.0.0.1', 19132), bytes(300000))
+    >>> [(kind, addr, len(payload))
+    ...     for kind, addr, payload, _, _, _ in channel.recv_all()]
+    [(2, ('127.0.0.1', 19132), 300000)]
+    >>> channel.close()
+    >>> worker_channel.close()
+    """
+
+    __slots__ = ['_sock', '_queue', '_recv_buffer']
+
+    def __init__(self, sock):
+        self._sock = sock
+        self._queue = deque()
+        # 最も大きなメッセージを切り詰めずに受信できる大きさにする
+        self._recv_buffer = memoryview(
+            bytearray(_Message.HEADER.size + _MAX_PAYLOAD_SIZE))
+        for opt in (socket.SO_SNDBUF, socket.SO_RCVBUF):
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, opt, _CHANNEL_BUFFER_SIZE)
+            except OSError:
+                pass
+
+    @staticmethod
+    def pair():
+        return tuple(
+            _Channel(s) for s in
+                socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM))
+
+    sock = property(attrgetter('_sock'))
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def close(self):
+        self._sock.close()
+
+    def setblocking(self, flag):
+        self._sock.setblocking(flag)
+
+    def has_pending(self):
+        """送信できていないメッセージがあれば True を返す"""
+        return len(self._queue) > 0
+
+    def send(self, kind, addr, payload=b'', **kwargs):
+        """メッセージを送信する
+
+        受信側で切り詰められないように、_MAX_PAYLOAD_SIZE を超える payload は破棄する。
+        """
+        if len(payload) > _MAX_PAYLOAD_SIZE:
+            logger.server.error(
+                'discard message ({size} bytes, too large)', size=len(payload))
+            return
+        self._queue.append(_Message.pack(kind, addr, payload, **kwargs))
+        self.flush()
+
+    def flush(self):
+        while len(self._queue) > 0:
+            try:
+                self._sock.send(self._queue[0])
+            except BlockingIOError:
+                return
+            except OSError as e:
+                logger.server.error(
+                    'discard message ({size} bytes, {error})',
+                    size=len(self._queue[0]), error=e)
+            self._queue.popleft()
+
+    def recv_all(self):
+        """受信済みのメッセージを全て返す"""
+        while True:
+            try:
+                size = self._sock.recv_into(self._recv_buffer)
+            except BlockingIOError:
+                return
+            yield _Message.unpack(self._recv_buffer[:size].tobytes())
+
+
+class _WorkerHandler(interface.Handler):
+    """ネットワークワーカーで受信したパケットを World プロセスに転送する
+
+    受信したパケットは expand (World の Handler.expand) で分けて転送する。
+    """
+
+    def __init__(self, channel, expand):
+        super().__init__()
+        self._channel = channel
+        self._expand = expand
+        self.server_info = ''
+
+    def start(self):
+        pass
+
+    def terminate(self):
+        pass
+
+    def info(self):
+        return self.server_info
+
+    def open(self, session):
+        self._channel.send(_Message.OPEN, session.addr)
+
+    def close(self, session, reason):
+        self._channel.send(
+            _Message.CLOSE, session.addr, bytes(reason, 'utf8'))
+
+    def handle(self, session, packet):
+        for payload in self._expand(packet.buffer()):
+            self._channel.send(_Message.PACKET, session.addr, payload)
+
+    def update(self):
+        self._channel.flush()
+
+
+class _WorkerServer(Server):
+    """SO_REUSEPORT で同じポートを共有して Session を受け持つサーバー"""
+
+    REUSE_PORT = True
+
+    def __init__(self, server_addr, channel, terminated, expand):
+        super().__init__(server_addr, _WorkerHandler(channel, expand))
+        self._channel = channel
+        self._terminated_flag = terminated
+
+    def _init_socket(self):
+        super()._init_socket()
+        self._channel.setblocking(False)
+        self._recv_selector.register(
+            self._channel, selectors.EVENT_READ, self._handle_world_message)
+
+    def _wait(self):
+        self._terminated = self._terminated_flag.value
+        if self._channel.has_pending():
+            return
+        super()._wait()
+
+    def _handle_world_message(self, channel):
+        """World プロセスから届いたメッセージを処理する"""
+        for kind, addr, payload, reliability, channel_, is_immediate \
+                in channel.recv_all():
+            if kind == _Message.INFO:
+                self._handler.server_info = str(payload, 'utf8')
+            elif kind == _Message.PACKET:
+                session = self._sessions.get(addr)
+                if session == None:
+                    continue
+                packet = ApplicationPacket(payload)
+                packet.channel = channel_
+                session.send_application_packet(
+                    packet, reliability, is_immediate)
+
+
+class NetworkWorkerProcess:
+    """RakNet の処理を行うネットワークワーカープロセス
+
+    expand : 受信したパケットを World プロセスに転送する単位に分ける関数
+    """
+
+    def __init__(self, server_addr, expand):
+        self._server_addr = server_addr
+        self._expand = expand
+        # ワーカープロセスで使う capture.PacketCapture
+        self._capture = None
+        self._terminated = Value('b', False)
+        self._channel, self._worker_channel = _Channel.pair()
+        self._process = Process(
+            target=self.run,
+            args=(self._worker_channel, self._terminated))
+
+    channel = property(attrgetter('_channel'))
+
+    def set_capture(self, capture):
+        """ワーカープロセスで送受信した datagram を記録する"""
+        self._capture = capture
+
+    def start(self):
+        self._process.start()
+        # ワーカープロセス側の端はこのプロセスでは使わない
+        self._worker_channel.close()
+        self._channel.setblocking(False)
+
+    def terminate(self):
+        self._terminated.value = True
+        if self._process.is_alive():
+            self._process.join(_TERMINATE_TIMEOUT)
+            if self._process.is_alive():
+                self._process.terminate()
+                self._process.join()
+        self._channel.close()
+        logger.server.info('terminate {name}', name=self.__class__.__name__)
+
+    def run(self, channel, terminated):
+        # World プロセス側の端はワーカープロセスでは使わない
+        self._channel.close()
+        server = _WorkerServer(
+            self._server_addr, channel, terminated, self._expand)
+        if self._capture != None:
+            server.set_capture(self._capture)
+        server.run()
+
+
+class _RemoteSession:
+    """ネットワークワーカーが受け持つ Session"""
+
+    __slots__ = ['_channel', '_addr']
+
+    def __init__(self, channel, addr):
+        self._channel = channel
+        self._addr = addr
+
+    addr = property(attrgetter('_addr'))
+
+    def send_application_packet(self, packet, reliability, is_immediate=False):
+        """符号化したパケットをネットワークワーカーに送信する"""
+        if len(packet.buffer()) == 0:
+            packet.encode()
+        self._channel.send(
+            _Message.PACKET, self._addr, packet.buffer(),
+            reliability=reliability, channel=packet.channel,
+            is_immediate=is_immediate)
+
+
+class MultiProcessServer:
+    """複数のネットワークワーカーで UDP パケットの送受信を行うサーバー
+
+    各ワーカーは SO_REUSEPORT で同じポートを共有し、
+    クライアント毎に振り分けられた Session を受け持つ。
+    ワーカーは復号化した ApplicationPacket を Handler.expand で分けて転送し、
+    このプロセスでは Handler の処理と送信パケットの符号化のみを行う。
+    """
+
+    handler = property(attrgetter('_handler'))
+
+    def __init__(self, server_addr, handler, num_of_workers):
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            raise NotImplementedError('SO_REUSEPORT is not supported.')
+        self._handler = handler
+        self._terminated = False
+        self._workers = [
+            NetworkWorkerProcess(server_addr, handler.expand)
+                for _ in range(num_of_workers)]
+        # Session.addr -> interface.Session
+        self._sessions = {}
+        # ワーカーに通知した Handler.info()
+        self._info = None
+        logger.server.info('PyCraft server initialized.')
+
+    def terminate(self):
+        self._terminated = True
+
+    def set_capture(self, capture):
+        """ワーカー毎に datagram を記録する
+
+        記録を書き出すファイルは capture.path にワーカーの番号を付ける。
+        """
+        for i, w in enumerate(self._workers):
+            path = None if capture.path == None \
+                else '{path}.{i}'.format(path=capture.path, i=i)
+            w.set_capture(capture.clone(path))
+
+    def run(self, started_callback=lambda: None):
+        logger.server.info(
+            'start {name}(pid={pid})',
+            name=self.__class__.__name__, pid=os.getpid())
+        self._handler.start()
+        for w in self._workers:
+            w.start()
+        started_callback()
+        channels = [w.channel for w in self._workers]
+        while not self._terminated:
+            if not any(c.has_pending() for c in channels):
+                wait([c.sock for c in channels],
+                     self._handler.scheduler.wait_time())
+            self._handler.scheduler.start()
+            for c in channels:
+                self._handle_worker_message(c)
+            self._handler.update()
+            self._notify_info()
+            for c in channels:
+                c.flush()
+        self._handler.terminate()
+        for w in self._workers:
+            w.terminate()
+        logger.server.info('terminate {name}', name=self.__class__.__name__)
+
+    def _handle_worker_message(self, channel):
+        """ネットワークワーカーから届いたメッセージを処理する"""
+        for kind, addr, payload, _, _, _ in channel.recv_all():
+            if kind == _Message.OPEN:
+                session = interface.Session(_RemoteSession(channel, addr))
+                self._sessions[addr] = session
+                self._handler.open(session)
+            elif kind == _Message.CLOSE:
+                session = self._sessions.pop(addr, None)
+                if session != None:
+                    self._handler.close(session, str(payload, 'utf8'))
+            elif kind == _Message.PACKET:
+                session = self._sessions.get(addr)
+                if session != None:
+                    self._handler.handle(session, ApplicationPacket(payload))
+
+    def _notify_info(self):
+        """Handler.info() が変化したらワーカーに通知する"""
+        info = self._handler.info()
+        if info != self._info:
+            self._info = info
+            payload = bytes(info, 'utf8')
+            for w in self._workers:
+                w.channel.send(_Message.INFO, ('0.0.0.0', 0), payload)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -20,6 +20,36 @@ class Reliability:
     RELIABLE_SEQUENCED = 4
 
 
+class Priority:
+    """パケット送信の優先度 (ApplicationPacket.channel に設定する)
+
+    値の小さいものから順に送信する。順番は order_channel 毎につくので、
+    order_channel の異なるパケットの間の順番は保証しない。
+
+    CONTROL : ログイン、インベントリなどの制御
+    MOVEMENT : Entity の移動
+    BLOCK : Block の更新
+    CHUNK : Chunk の転送 (帯域を制限する)
+    """
+
+    CONTROL = 0
+    MOVEMENT = 1
+    BLOCK = 2
+    CHUNK = 3
+
+    @classmethod
+    def order_channel(cls, priority):
+        """priority のパケットの順番をつける channel を返す
+
+        Block の更新が先に送信した Chunk を追い越さないように、
+        BLOCK と CHUNK は同じ channel で順番をつける。
+
+        >>> [Priority.order_channel(p) for p in range(5)]
+        [0, 1, 2, 2, 4]
+        """
+        return cls.BLOCK if priority == cls.CHUNK else priority
+
+
 class Session:
     """公開するセッションインターフェース"""
     
@@ -60,5 +90,14 @@ class Handler:
     def handle(self, session, packet):
         raise NotImplementedError()
 
+    @staticmethod
+    def expand(buffer):
+        """受信した ApplicationPacket のバイト列を handle に渡す単位に分ける
+
+        MultiProcessServer ではネットワークワーカーで呼ばれるので、
+        重い復号化 (展開など) をワーカーに任せられる。既定では分けない。
+        """
+        return [buffer]
+
     def update(self):
         raise NotImplementedError()
\ No newline at end of file
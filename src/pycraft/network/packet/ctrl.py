@@ -130,26 +130,54 @@ class AdvertiseSystem(Packet):
 
 
 class AcknowledgePacket(Packet):
-    """Packet 受信確認のための応答"""
-
-    __slots__ = ['seq_nums']
+    """Packet 受信確認のための応答
+
+    番号は連続する範囲 (start, last) の並び records で保持する。
+
+    >>> from binascii import hexlify as hex
+    >>> pk = Ack()
+    >>> pk.seq_nums = [5, 1, 2, 3]
+    >>> pk.records
+    [(1, 3), (5, 5)]
+    >>> pk.encode()
+    >>> hex(pk.buffer())
+    b'c000020001000003000001050000'
+    >>> pk = Ack(pk.buffer())
+    >>> pk.decode()
+    >>> pk.records, sorted(pk.seq_nums)
+    ([(1, 3), (5, 5)], [1, 2, 3, 5])
+    """
+
+    __slots__ = ['records']
+
+    @property
+    def seq_nums(self):
+        """範囲に含まれる番号を返す"""
+        for start, last in self.records:
+            for seq_num in range(start, last+1):
+                yield seq_num
+
+    @seq_nums.setter
+    def seq_nums(self, seq_nums):
+        self.records = list(self._ranges(sorted(seq_nums)))
 
     @staticmethod
     def _ranges(seq_nums):
+        if len(seq_nums) == 0:
+            return
         start, last = seq_nums[0], seq_nums[0]
         for n in seq_nums[1:]:
             if last + 1 == n:
                 last += 1
-            else:
+            elif last != n:
                 yield start, last
                 start, last = n, n
         yield start, last
 
     def encode(self):
         super().encode()
-        records = list(self._ranges(sorted(self.seq_nums)))
-        self._buffer.put_short(len(records))
-        for start_num, last_num in records:
+        self._buffer.put_short(len(self.records))
+        for start_num, last_num in self.records:
             if start_num == last_num:
                 self._buffer.put_byte(0x01)
                 self._buffer.put_triad(start_num)
@@ -160,16 +188,15 @@ class AcknowledgePacket(Packet):
 
     def decode(self):
         super().decode()
-        def seq_nums():
+        def records():
             for _ in range(self._buffer.next_short()):
                 flag = self._buffer.next_byte()
+                start = self._buffer.next_triad()
                 if flag & 0x01:
-                    yield self._buffer.next_triad()
+                    yield start, start
                 else:
-                    start, last = self._buffer.next_triad(), self._buffer.next_triad()
-                    for seq_num in range(start, last+1):
-                        yield seq_num
-        self.seq_nums = set(seq_nums())
+                    yield start, self._buffer.next_triad()
+        self.records = list(records())
 
 
 class Ack(AcknowledgePacket):
@@ -180,3 +207,8 @@ class Ack(AcknowledgePacket):
 class Nack(AcknowledgePacket):
 
     id = ID.NACK
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -4,14 +4,20 @@ import time
 
 
 class Scheduler:
-    
-    __slots__ = ['frame_rate', '_time_table', '_e_time']
+
+    __slots__ = [
+        'frame_rate', '_time_table', '_e_time', '_next_frame', '_is_pending']
 
     DEFAULT_FRAME_RATE = 30  # frame/sec
-    
+
     def __init__(self):
         self.frame_rate = self.DEFAULT_FRAME_RATE
         self._time_table = {}
+        self._e_time = {}
+        # 次のフレームを開始する時刻
+        self._next_frame = 0
+        # フレーム内で処理しきれなかったタスクがあるか
+        self._is_pending = False
 
     frame_time = property(lambda self: 1.0 / self.frame_rate)
 
@@ -19,12 +25,24 @@ class Scheduler:
         self._time_table[task_id] = limit_rate
 
     def start(self):
-        now = time.clock()
+        now = time.monotonic()
         frame_time = self.frame_time
         def end_time(limit_rate):
             return now + frame_time * limit_rate
         self._e_time = dict(
             (task_id, end_time(rate)) for task_id, rate in self._time_table.items())
-    
+        self._next_frame = now + frame_time
+        self._is_pending = False
+
     def is_over(self, task_id):
-        return time.clock() > self._e_time[task_id]
+        return time.monotonic() > self._e_time[task_id]
+
+    def set_pending(self):
+        """処理を待っているタスクがあり、次のフレームを待たずに処理したい"""
+        self._is_pending = True
+
+    def wait_time(self):
+        """次のフレームを開始するまでの時間(sec)を返す"""
+        if self._is_pending:
+            return 0
+        return max(0, self._next_frame - time.monotonic())
@@ -0,0 +1,102 @@
+# -*- coding: utf8 -*-
+
+import socket
+import struct
+import sys
+from itertools import islice
+from . import logger
+
+
+# UDP GSO (Generic Segmentation Offload) の設定 (Linux)
+_SOL_UDP = getattr(socket, 'SOL_UDP', 17)
+_UDP_SEGMENT = getattr(socket, 'UDP_SEGMENT', 103)
+_MAX_SEGMENTS = 64  # datagrams (1回の sendmsg で送信する最大数)
+_MAX_GSO_SIZE = 65000  # bytes (1回の sendmsg で送信する最大バイト数)
+
+
+class DatagramSender:
+    """同じ宛先へ送信する符号化済みの datagram をまとめて送信する
+
+    UDP GSO が使える場合は、同じ大きさで連続する datagram を
+    1回の sendmsg で送信する (最後の1つは小さくてもよい)。
+    使えない場合は1つずつ sendto で送信する。
+
+    >>> recv_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    >>> recv_sock.bind(('127.0.0.1', 0))
+    >>> sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    >>> from collections import deque
+    >>> datagrams = deque([b'a' * 10, b'b' * 10, b'c' * 3, b'd' * 5])
+    >>> DatagramSender(sock).send(recv_sock.getsockname(), datagrams)
+    True
+    >>> len(datagrams)
+    0
+    >>> [recv_sock.recv(100) for _ in range(4)]
+    [b'aaaaaaaaaa', b'bbbbbbbbbb', b'ccc', b'ddddd']
+    >>> sock.close()
+    >>> recv_sock.close()
+    """
+
+    __slots__ = ['_sock', '_use_gso']
+
+    def __init__(self, sock):
+        self._sock = sock
+        self._use_gso = sys.platform.startswith('linux') \
+            and hasattr(sock, 'sendmsg')
+
+    def send(self, addr, datagrams):
+        """datagrams を先頭から順に送信する
+
+        datagrams : deque(bytes) 送信した datagram は取り除かれる
+        送信バッファが一杯になった場合は、残りを datagrams に残して
+        False を返す。
+        """
+        sendto = self._sock.sendto
+        try:
+            while len(datagrams) > 0:
+                segments = self._segments(datagrams) if self._use_gso else ()
+                if len(segments) > 1 and self._send_segments(addr, segments):
+                    for _ in range(len(segments)):
+                        datagrams.popleft()
+                else:
+                    sendto(datagrams[0], addr)
+                    datagrams.popleft()
+        except (BlockingIOError, InterruptedError):
+            return False
+        return True
+
+    @staticmethod
+    def _segments(datagrams):
+        """先頭から1回の sendmsg で送信できる datagram を返す"""
+        size = len(datagrams[0])
+        segments = []
+        for d in islice(datagrams, min(_MAX_SEGMENTS, _MAX_GSO_SIZE // size)):
+            if len(d) > size:
+                break
+            segments.append(d)
+            if len(d) < size:
+                break
+        return segments
+
+    def _send_segments(self, addr, segments):
+        """同じ大きさの datagram を GSO でまとめて送信する
+
+        GSO が使えなければ以後は使わずに False を返す。
+        """
+        option = struct.pack('=H', len(segments[0]))
+        try:
+            self._sock.sendmsg(
+                [b''.join(segments)], [(_SOL_UDP, _UDP_SEGMENT, option)],
+                0, addr)
+        except (BlockingIOError, InterruptedError):
+            raise
+        except OSError as e:
+            logger.server.warning(
+                'UDP_SEGMENT can not be used. ({error})', error=e)
+            self._use_gso = False
+            return False
+        return True
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -3,20 +3,30 @@
 import os
 import socket
 import random
-import queue
 import time
 import selectors
-from binascii import hexlify as hex
+from collections import OrderedDict, deque
 from operator import attrgetter
+from pycraft.common import Hex
 from pycraft.common.util import max_int, divide_seq
 from .packet import ID, ctrl, data, appl
 from .packet.data import EncapsulatedPacket as EncapPacket
-from . import container, interface, logger, protocol, window
+from . import capture, congestion, container, interface, logger, protocol, \
+    sender, timer, window
 
 
 _RECV_BUFFER_SIZE = 4096  # bytes
+_RECV_BATCH_SIZE = 64  # packets
+_SOCK_RECV_BUFFER_SIZE = 1024 * 1024  # bytes (0 ならば OS の既定値)
 _MAX_MTU_SIZE = 1464  # bytes
-_ACK_TIMEOUT = 60  # sec
+_MAX_RETRANSMIT = 8  # 回 (超えたら ACK 待ちのパケットを破棄する)
+_PING_INTERVAL = 5  # sec (受信が途絶えたら PING を送信する間隔)
+_SESSION_TIMEOUT = 30  # sec (受信が途絶えたら Session を破棄する)
+_ACK_DELAY = 0.01  # sec (受信してから ACK,NACK を送信するまでの最大時間)
+_ACK_THRESHOLD = 64  # packets (溜まったら待たずに ACK を送信する)
+_CHUNK_RATE = 1024 * 1024  # bytes/sec (Priority.CHUNK の送信帯域)
+_CHUNK_BURST = 256 * 1024  # bytes (Priority.CHUNK をまとめて送信できる量)
+_NUM_OF_LANES = interface.Priority.CHUNK + 1
 
 
 class Server:
@@ -26,8 +36,12 @@ class Server:
     セッションとして扱う。パケットの符号化/復号化を行う。
     """
 
+    # 同じポートを複数のプロセスで共有するか
+    REUSE_PORT = False
+
     id = property(attrgetter('_id'))
     handler = property(attrgetter('_handler'))
+    capture = property(attrgetter('_capture'))
 
     def __init__(self, server_addr, handler):
         self._server_addr = server_addr
@@ -35,7 +49,18 @@ class Server:
         self._handler = handler
         self._terminated = False
         self._sessions = {}
-        self._send_queue = queue.Queue()
+        # Session.addr を Session の更新時刻に登録する
+        self._timers = timer.TimerWheel()
+        # Session.addr -> 登録した更新時刻
+        self._update_times = {}
+        # 更新時刻を登録し直す Session.addr
+        self._touched_sessions = set()
+        # 送信する datagram が積まれている Session (Session.addr -> Session)
+        self._send_sessions = {}
+        # ソケットが送信可能になるのも待っていれば True
+        self._wait_writable = False
+        # 送受信した datagram の記録 (記録しなければ None)
+        self._capture = None
         self._init_protocol()
         logger.server.info('PyCraft server initialized.')
     
@@ -84,29 +109,49 @@ class Server:
     
     def _init_socket(self):
         self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if self.REUSE_PORT:
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self._sock.bind(self._server_addr)
         self._sock.setblocking(False)
+        self._init_recv_buffer(self._sock)
+        self._sender = sender.DatagramSender(self._sock)
         self._recv_selector = selectors.DefaultSelector()
-        self._send_selector = selectors.DefaultSelector()
-        self._send_selector.register(
-            self._sock, selectors.EVENT_WRITE, self._handle_send_packet)
         self._recv_selector.register(
             self._sock, selectors.EVENT_READ, self._handle_recv_packet)
 
+    def _init_recv_buffer(self, sock):
+        """受信バッファを拡張する"""
+        if _SOCK_RECV_BUFFER_SIZE > 0:
+            try:
+                sock.setsockopt(
+                    socket.SOL_SOCKET, socket.SO_RCVBUF, _SOCK_RECV_BUFFER_SIZE)
+            except OSError as e:
+                logger.server.warning(
+                    'SO_RCVBUF can not be changed. ({error})', error=e)
+
     def terminate(self):
         self._terminated = True
 
+    def set_capture(self, capture):
+        """送受信した datagram を capture.PacketCapture に記録する"""
+        self._capture = capture
+
     def run(self, started_callback=lambda: None):
         logger.server.info(
             'start {name}(pid={pid})',
             name=self.__class__.__name__, pid=os.getpid())
         self._handler.start()
         self._init_socket()
+        if self._capture != None:
+            self._capture.start()
         started_callback()
         while not self._terminated:
+            self._wait()
             self._handler.scheduler.start()
             self._process()
         self._handler.terminate()
+        if self._capture != None:
+            self._capture.terminate()
         self._sock.close()
         logger.server.info('terminate {name}', name=self.__class__.__name__)
     
@@ -115,50 +160,133 @@ class Server:
         self._handle_packet()
         self._handler.update()
     
+    def _wait(self):
+        """パケットを受信するか、次の処理時刻になるまで待つ
+
+        次の処理時刻は Scheduler のフレーム開始時刻と
+        各 Session の更新時刻のうち最も早い時刻とする。
+        送信しきれていない datagram があれば、送信可能になるまで待つ。
+        """
+        self._select_writable(len(self._send_sessions) > 0)
+        self._schedule_sessions()
+        timeout = self._handler.scheduler.wait_time()
+        t = self._timers.next_time()
+        if t != None:
+            timeout = min(timeout, t - time.monotonic())
+        if timeout > 0:
+            self._recv_selector.select(timeout)
+
+    def _select_writable(self, flag):
+        """ソケットが送信可能になるのを待つかどうかを切り替える"""
+        if flag == self._wait_writable:
+            return
+        self._wait_writable = flag
+        events = selectors.EVENT_READ
+        if flag:
+            events |= selectors.EVENT_WRITE
+        self._recv_selector.modify(self._sock, events, self._handle_recv_packet)
+
+    def touch_session(self, session):
+        """Session の更新時刻が変わったことを通知する"""
+        self._touched_sessions.add(session.addr)
+
+    def _schedule_sessions(self):
+        """通知された Session の更新時刻をタイマーに登録する
+
+        登録済みの時刻より早まった場合のみ登録し、
+        遅くなった場合は登録済みの時刻に更新してから登録し直す。
+        """
+        touched = self._touched_sessions
+        self._touched_sessions = set()
+        for addr in touched:
+            session = self._sessions.get(addr)
+            if session == None:
+                continue
+            t = session.next_update_time()
+            current = self._update_times.get(addr)
+            if current == None or t < current:
+                self._update_times[addr] = t
+                self._timers.add(t, addr)
+
     def _update_sessions(self):
-        for s in list(self._sessions.values()):
+        """更新時刻を過ぎた Session を更新する"""
+        self._schedule_sessions()
+        now = time.monotonic()
+        for addr in self._timers.expire(now):
+            t = self._update_times.get(addr)
+            if t == None or t > now:
+                continue  # 登録し直す前の時刻
+            del self._update_times[addr]
+            s = self._sessions[addr]
             s.update()
-            # TODO: セッションタイムアウト
             if s.is_disabled():
-                del self._sessions[s.addr]
+                del self._sessions[addr]
+            else:
+                self._touched_sessions.add(addr)
+        self._schedule_sessions()
 
     def _handle_packet(self):
-        for key, _ in self._send_selector.select(0):
-            key.data(key.fileobj)
-        for key, _ in self._recv_selector.select(0):
-            key.data(key.fileobj)
-
-    def _handle_send_packet(self, sock):
-        while not self._send_queue.empty() \
-                and self._send_packet(sock, *self._send_queue.get_nowait()):
-            pass
-
-    def _send_packet(self, sock, packet, addr):
-        """Packet を送信する"""
-        packet.encode()
-        buffer = packet.buffer()
-        sock.sendto(buffer, addr)
-        logger.packet.debug(
-            '{addr}<{buffer}', addr=addr, buffer=hex(buffer))
-        logger.server.debug(
-            'N< {addr} {packet}', addr=addr, packet=packet)
+        self._flush_sessions()
+        for key, events in self._recv_selector.select(0):
+            if events & selectors.EVENT_READ:
+                key.data(key.fileobj)
+
+    def ready_to_send(self, session):
+        """Session に送信する datagram が積まれたことを通知する"""
+        self._send_sessions[session.addr] = session
+
+    def _flush_sessions(self):
+        """Session に積まれた datagram を Session 毎にまとめて送信する
+
+        送信バッファが一杯になったら、残りは次のループで送信する。
+        """
+        sessions = self._send_sessions
+        for addr in list(sessions):
+            if not self._send_datagrams(addr, sessions[addr].datagrams):
+                return
+            del sessions[addr]
+
+    def _send_datagrams(self, addr, datagrams):
+        """符号化済みの datagram を送信する (送信しきれなければ False)"""
+        return self._sender.send(addr, datagrams)
 
     def _handle_recv_packet(self, sock):
-        packet, addr = self._recv_packet(sock)
-        session = self._session(addr)
-        protocol.net.handle(session, packet)
-        session.send_acknowledge()
+        """受信済みのパケットをまとめて処理する
+
+        1回の呼び出しで処理するパケット数は _RECV_BATCH_SIZE までとし、
+        ACK,NACK はセッション毎にまとめて1回だけ送信する。
+        """
+        # Session.addr -> Session (ACK,NACK を送信するセッション)
+        recv_sessions = {}
+        for _ in range(_RECV_BATCH_SIZE):
+            try:
+                packet, addr = self._recv_packet(sock)
+            except (BlockingIOError, InterruptedError):
+                break
+            session = self._session(addr)
+            session.received()
+            protocol.net.handle(session, packet)
+            recv_sessions[addr] = session
+        for session in recv_sessions.values():
+            session.send_acknowledge()
+            self._touched_sessions.add(session.addr)
 
     def _recv_packet(self, sock):
         """Packet を受信する"""
         buffer, addr = sock.recvfrom(_RECV_BUFFER_SIZE)
+        return self._decode_packet(buffer, addr), addr
+
+    def _decode_packet(self, buffer, addr):
+        """受信したバイト列を Packet に復号化する"""
+        if self._capture != None:
+            self._capture.record(capture.RECV, addr, buffer)
         packet = protocol.net.packet(buffer)
         packet.decode()
         logger.packet.debug(
-            '{addr}>{buffer}', addr=addr, buffer=hex(buffer))
+            '{addr}>{buffer}', addr=addr, buffer=Hex(buffer))
         logger.server.debug(
             'N> {addr} {packet}', addr=addr, packet=packet)
-        return packet, addr
+        return packet
     
     def _session(self, addr):
         """アドレスに該当する Session を返す"""
@@ -166,10 +294,6 @@ class Server:
             self._sessions[addr] = Session(self, addr)
         return self._sessions[addr]
 
-    def send_packet(self, packet, addr):
-        """Packet を送信キューに登録する"""
-        self._send_queue.put_nowait((packet, addr))
-
 
 class Session(object):
     """クライアント(IPアドレス、ポートで識別)との送受信セッション"""
@@ -180,6 +304,7 @@ class Session(object):
 
     addr = property(attrgetter('_addr'))
     id = property(attrgetter('_id'))
+    datagrams = property(attrgetter('_datagrams'))
 
     def __init__(self, server, client_addr):
         self._addr = client_addr
@@ -196,8 +321,10 @@ class Session(object):
         self._encap_packets = window.EncapsulatedPacketWindow()
         # 分割されたパケットの蓄積
         self._split_packets = container.SplitPacketContainer()
-        # 送信待ちパケット
-        self._waiting_packet = container.DataPacketContainer(data.DataPacket4)
+        # 優先度毎の送信待ちパケット
+        self._waiting_packets = [
+            container.DataPacketContainer(data.DataPacket4)
+                for _ in range(_NUM_OF_LANES)]
         # 送信 DataPacket に付与する番号
         self._send_seq_num = window.WindowIndex()
         # 送信 EncapsulatedPacket に付与する番号
@@ -206,11 +333,31 @@ class Session(object):
         self._channel_index = [window.WindowIndex() for _ in range(32)]
         # split_id に付与する番号
         self._split_id = window.WindowIndex()
-        # seq_num -> (Packet, time)
-        self._ack_wait_packets = {}
+        # 輻輳ウィンドウが空くのを待つ優先度毎の DataPacket
+        self._lanes = [deque() for _ in range(_NUM_OF_LANES)]
+        # Priority.CHUNK の送信帯域の制限
+        self._chunk_bucket = congestion.TokenBucket(_CHUNK_RATE, _CHUNK_BURST)
+        # seq_num -> (Packet, 送信時刻, 送信回数) (送信時刻の順)
+        self._ack_wait_packets = OrderedDict()
+        # 再送までの時間の計算
+        self._rtt = congestion.RttEstimator()
+        # 送信中の DataPacket 数の制限
+        self._cwnd = congestion.CongestionWindow()
+        # ACK,NACK を送信する時刻 (送信するものがなければ None)
+        self._ack_time = None
+        # 最後にパケットを受信した時刻
+        self._recv_time = time.monotonic()
+        # 応答を待っている PING (ping_id, 送信時刻)
+        self._ping = None
+        # 符号化済みで送信を待つ datagram
+        self._datagrams = deque()
     
     def is_disabled(self):
         return self._state == Session._STATE_DISCONNECTED
+
+    def received(self):
+        """パケットを受信した時刻を記録する"""
+        self._recv_time = time.monotonic()
     
     def handle_unconnected_ping(self, packet):
         pk = ctrl.UnconnectedPong()
@@ -240,19 +387,43 @@ class Session(object):
         pk.client_addr = self.addr
         self.send_packet(pk)
 
+    def _ack_wait_seq_nums(self, records):
+        """records の範囲に含まれる ACK 待ちの番号を返す"""
+        for start, last in records:
+            if last - start + 1 > len(self._ack_wait_packets):
+                seq_nums = [n for n in self._ack_wait_packets
+                    if start <= n <= last]
+            else:
+                seq_nums = [n for n in range(start, last+1)
+                    if n in self._ack_wait_packets]
+            for seq_num in seq_nums:
+                yield seq_num
+
     def handle_ack(self, packet):
-        for seq_num in packet.seq_nums:
-            if seq_num in self._ack_wait_packets:
-                del self._ack_wait_packets[seq_num]
+        now = time.monotonic()
+        rtt = None
+        num = 0
+        for seq_num in self._ack_wait_seq_nums(packet.records):
+            _, t, num_of_sent = self._ack_wait_packets.pop(seq_num)
+            num += 1
+            # 再送したパケットは、どの送信に対する ACK か分からないので使わない
+            if num_of_sent == 1:
+                rtt = now - t
+        if rtt != None:
+            self._rtt.sample(rtt)
+        self._cwnd.acked(num)
+        self._send_congested_packets()
 
     def handle_nack(self, packet):
-        for seq_num in packet.seq_nums:
-            if seq_num in self._ack_wait_packets:
-                pk, _ = self._ack_wait_packets[seq_num]
-                del self._ack_wait_packets[seq_num]
-                self.send_packet(pk)
+        for seq_num in self._ack_wait_seq_nums(packet.records):
+            pk, _, num_of_sent = self._ack_wait_packets.pop(seq_num)
+            self._cwnd.lost(seq_num, self._send_seq_num.curr())
+            self._resend_packet(pk, num_of_sent)
 
     def handle_data_packet(self, packet):
+        # ACK は _ACK_DELAY の間まとめてから送信する
+        if self._ack_time == None:
+            self._ack_time = time.monotonic() + _ACK_DELAY
         # 既に処理済みのパケットなら何もしない
         if not self._recv_packets.put(packet):
             return
@@ -264,16 +435,19 @@ class Session(object):
         """EncapsulatedPacket を処理する"""
         logger.server.debug(
             'N>> {addr} {packet}', addr=self._addr, packet=packet)
+        if not self._encap_packets.receive(packet):
+            return
+        # 分割されたパケットは結合してから順番を揃える
+        if packet.split:
+            packet = self._split_packets.concat(packet)
+            if packet == None:
+                return
         self._encap_packets.put(packet)
         while len(self._encap_packets) > 0:
             self._handle_encapsulated_packet_route(self._encap_packets.get())
         
     def _handle_encapsulated_packet_route(self, packet):
         """順番に到着した EncapsulatedPacket を処理する"""
-        if packet.split:
-            packet = self._split_packets.concat(packet)
-            if packet == None:
-                return
         pk = protocol.app.packet(packet.buffer)
         pk.decode()
         logger.server.debug(
@@ -295,6 +469,12 @@ class Session(object):
         self._server.handler.close(self._interface, 'client disconnect')
         self._state = Session._STATE_DISCONNECTED
 
+    def _timeout(self):
+        logger.server.info('{addr} session timeout', addr=self._addr)
+        if self._state == Session._STATE_CONNECTED:
+            self._server.handler.close(self._interface, 'timeout')
+        self._state = Session._STATE_DISCONNECTED
+
     def handle_ping(self, packet):
         ping_id = random.randrange(max_int(8, False) + 1)
         pk = appl.Pong()
@@ -306,7 +486,27 @@ class Session(object):
         self.send_application_packet(pk, 0)
 
     def handle_pong(self, packet):
-        pass  # TODO: セッションタイムアウトに利用する
+        if self._ping != None and self._ping[0] == packet.recv_ping_id:
+            _, t = self._ping
+            self._ping = None
+            logger.server.debug(
+                '{addr} PONG {rtt:.3f}s', addr=self._addr,
+                rtt=time.monotonic() - t)
+
+    def _keepalive_time(self):
+        """次に PING を送信する時刻を返す"""
+        t = self._recv_time
+        if self._ping != None:
+            t = max(t, self._ping[1])
+        return t + _PING_INTERVAL
+
+    def _send_keepalive(self):
+        """受信が途絶えている Session に PING を送信する"""
+        ping_id = random.randrange(max_int(8, False) + 1)
+        self._ping = (ping_id, time.monotonic())
+        pk = appl.Ping()
+        pk.ping_id = ping_id
+        self.send_application_packet(pk, 0)
 
     def handle_application_packet(self, packet):
         """ApplicationPacket を処理する"""
@@ -318,25 +518,52 @@ class Session(object):
         
         reliability : EncapsulatedPacket の reliability 参照
         is_immediate : True ならばキューに積まずに送信
+        packet.channel を優先度 (interface.Priority) として扱う。
+        順番は Priority.order_channel の channel でつけるので、
+        後から送信した BLOCK は先に送信した CHUNK の後に処理される。
+
+        >>> class Server:
+        ...     capture = None
+        ...     def touch_session(self, session): pass
+        ...     def ready_to_send(self, session): pass
+        >>> session = Session(Server(), ('127.0.0.1', 19132))
+        >>> session._mtu_size = _MAX_MTU_SIZE
+        >>> for buffer, priority in (
+        ...         (b'\\xfe\\x01', interface.Priority.CHUNK),
+        ...         (b'\\xfe\\x02', interface.Priority.BLOCK)):
+        ...     pk = appl.ApplicationPacket(buffer)
+        ...     pk.channel = priority
+        ...     session.send_application_packet(
+        ...         pk, interface.Reliability.RELIABLE_ORDERED)
+        >>> session.update()
+        >>> for buffer in session.datagrams:
+        ...     pk = protocol.net.packet(buffer)
+        ...     pk.decode()
+        ...     print(pk.seq_num, pk.packets[0].buffer, pk.packets[0].order)
+        0 b'\\xfe\\x02' (1, 2)
+        1 b'\\xfe\\x01' (0, 2)
         """
+        lane = min(packet.channel, _NUM_OF_LANES - 1)
         if len(packet.buffer()) == 0:
             packet.encode()
             logger.server.debug(
                 'N<<< {addr} {packet}', addr=self._addr, packet=packet)
+        self._server.touch_session(self)
         # EncapsulatedPacket をつくる
         param = {}
         if EncapPacket.is_reliable(reliability):
             param['message'] = \
                 EncapPacket.Message(self._send_message_index.next())
         if EncapPacket.is_ordered(reliability):
-            index = self._channel_index[packet.channel].next()
-            param['order'] = EncapPacket.Order(index, packet.channel)
+            channel = interface.Priority.order_channel(packet.channel)
+            index = self._channel_index[channel].next()
+            param['order'] = EncapPacket.Order(index, channel)
         buffer = packet.buffer()
         pk = EncapPacket(reliability, buffer, **param)
         # mtu_size に収まっているならば送信
         overflow = len(data.DataPacket0()) + len(pk) - self._mtu_size
         if overflow <= 0:
-            self._send_encapsulated_packet(pk, is_immediate)
+            self._send_encapsulated_packet(pk, lane, is_immediate)
             return
         # mtu_size に収まっていなければ分割して送信
         buf_len = len(buffer) - overflow
@@ -350,61 +577,178 @@ class Session(object):
                     EncapPacket.Message(self._send_message_index.next())
             param['split'] = EncapPacket.Split(split_count, split_id, i)
             pk = EncapPacket(reliability, buf, **param)
-            self._send_encapsulated_packet(pk, True)
+            self._send_encapsulated_packet(pk, lane, True)
     
-    def _send_encapsulated_packet(self, packet, is_immediate=False):
+    def _send_encapsulated_packet(self, packet, lane, is_immediate=False):
         """EncapsulatedPacket を DataPacket に包んで送信する
         
+        lane : 優先度 (interface.Priority)
         is_immediate : True ならばキューに積まずに送信
         """
         logger.server.debug(
             'N<< {addr} {packet}', addr=self._addr, packet=packet)
+        waiting = self._waiting_packets[lane]
         if is_immediate:
             pk = data.DataPacket0()
-            pk.seq_num = self._send_seq_num.next()
             pk.packets = [packet]
-            self._send_waiting_packet()
-            self.send_packet(pk)
+            self._send_waiting_packet(lane)
+            self._send_data_packet(pk, lane)
         else:
-            if len(self._waiting_packet) + len(packet) > self._mtu_size:
+            if len(waiting) + len(packet) > self._mtu_size:
                 # mtu_sizeを超えるようであれば超えない範囲を送信する
-                self._send_waiting_packet()
-            self._waiting_packet.add(packet)
+                self._send_waiting_packet(lane)
+            waiting.add(packet)
         
-    def _send_waiting_packet(self):
+    def _send_waiting_packet(self, lane):
         """送信待ちキューに積まれている DataPacket を送信する"""
-        if not self._waiting_packet.is_empty():
-            pk = self._waiting_packet.get()
-            pk.seq_num = self._send_seq_num.next()
-            self.send_packet(pk)
-        
+        if not self._waiting_packets[lane].is_empty():
+            self._send_data_packet(self._waiting_packets[lane].get(), lane)
+
+    def _has_waiting_packet(self):
+        """送信待ちキューに DataPacket が積まれているか？"""
+        return any(not w.is_empty() for w in self._waiting_packets)
+
+    def _send_data_packet(self, packet, lane):
+        """DataPacket を輻輳ウィンドウが空いていれば送信する"""
+        self._lanes[lane].append(packet)
+        self._send_congested_packets()
+
+    def _send_congested_packets(self):
+        """輻輳ウィンドウの空いている分だけ DataPacket を送信する
+
+        優先度の高い lane から送信し、Priority.CHUNK は
+        _CHUNK_RATE の帯域を超えないように送信する。
+        """
+        now = time.monotonic()
+        for lane, packets in enumerate(self._lanes):
+            while len(packets) > 0 \
+                    and self._cwnd.can_send(len(self._ack_wait_packets)):
+                pk = packets[0]
+                if lane == interface.Priority.CHUNK \
+                        and not self._chunk_bucket.consume(len(pk), now):
+                    break
+                packets.popleft()
+                pk.seq_num = self._send_seq_num.next()
+                self.send_packet(pk)
+
+    def _resend_packet(self, packet, num_of_sent):
+        """ACK が届いていない DataPacket を同じ番号で再送する
+
+        符号化済みのバイト列をそのまま送信する。
+        """
+        self._push_datagram(packet.buffer(), packet)
+        self._ack_wait_packets[packet.seq_num] = \
+            (packet, time.monotonic(), num_of_sent + 1)
+
+    def _push_datagram(self, buffer, packet):
+        """送信する datagram を積む (送信は Server がまとめて行う)"""
+        if len(self._datagrams) == 0:
+            self._server.ready_to_send(self)
+        self._datagrams.append(buffer)
+        if self._server.capture != None:
+            self._server.capture.record(capture.SEND, self._addr, buffer)
+        logger.packet.debug(
+            '{addr}<{buffer}', addr=self._addr, buffer=Hex(buffer))
+        logger.server.debug(
+            'N< {addr} {packet}', addr=self._addr, packet=packet)
+
     def send_packet(self, packet):
-        """Packet を送信する"""
-        self._server.send_packet(packet, self.addr)
+        """Packet を符号化して送信する"""
+        packet.encode()
+        self._push_datagram(packet.buffer(), packet)
         if packet.require_ack():
-            self._ack_wait_packets[packet.seq_num] = (packet, time.clock())
+            self._ack_wait_packets[packet.seq_num] = \
+                (packet, time.monotonic(), 1)
+
+    def send_acknowledge(self, is_forced=False):
+        """ACK,NACK を送信する
 
-    def send_acknowledge(self):
-        # ACK,NACK を送信する
-        ack_seq_nums, nack_seq_nums = self._recv_packets.get_seq_nums()
-        if len(ack_seq_nums):
+        受信した DataPacket の ACK は _ACK_DELAY の間まとめてから送信する。
+        _ACK_THRESHOLD 以上溜まっているか、is_forced ならば直ちに送信する。
+        """
+        if self._ack_time == None:
+            return
+        if not is_forced \
+                and self._recv_packets.num_of_ack() < _ACK_THRESHOLD \
+                and time.monotonic() < self._ack_time:
+            return
+        self._ack_time = None
+        ack_records, nack_records = self._recv_packets.get_records()
+        if len(ack_records):
             pk = ctrl.Ack()
-            pk.seq_nums = ack_seq_nums
+            pk.records = ack_records
             self.send_packet(pk)
-        if len(nack_seq_nums):
+        if len(nack_records):
             pk = ctrl.Nack()
-            pk.seq_nums = nack_seq_nums
+            pk.records = nack_records
             self.send_packet(pk)
 
-    def update(self):
-        """定期的に更新する"""
-        # TIMEOUT を超えた ACK 待ちパケットを破棄する
-        now = time.clock()
-        for seq_num, p in list(self._ack_wait_packets.items()):
-            pk, t = p
-            if now - t > _ACK_TIMEOUT:
-                del self._ack_wait_packets[seq_num]
+    def next_update_time(self):
+        """update を実行する必要がある時刻を返す"""
+        if self.is_disabled() or self._has_waiting_packet():
+            return time.monotonic()
+        times = [self._recv_time + _SESSION_TIMEOUT]
+        if self._state == Session._STATE_CONNECTED:
+            times.append(self._keepalive_time())
+        if self._ack_time != None:
+            times.append(self._ack_time)
+        if len(self._ack_wait_packets) > 0:
+            # 最も古い ACK 待ちパケットを再送する時刻
+            _, t, _ = next(iter(self._ack_wait_packets.values()))
+            times.append(t + self._rtt.rto)
+        chunk_packets = self._lanes[interface.Priority.CHUNK]
+        if len(chunk_packets) > 0 \
+                and self._cwnd.can_send(len(self._ack_wait_packets)):
+            # 帯域の制限で待っている Chunk を送信する時刻
+            times.append(self._chunk_bucket.available_time(time.monotonic()))
+        return min(times)
+
+    def _resend_expired_packets(self):
+        """RTO を超えても ACK が届かないパケットを再送する
+
+        _MAX_RETRANSMIT 回を超えて再送したパケットは破棄する。
+        """
+        now = time.monotonic()
+        rto = self._rtt.rto
+        expired = []
+        for seq_num, (_, t, _) in self._ack_wait_packets.items():
+            if now - t < rto:
+                break
+            expired.append(seq_num)
+        if len(expired) == 0:
+            return
+        self._rtt.back_off()
+        self._cwnd.timeout(self._send_seq_num.curr())
+        for seq_num in expired:
+            pk, _, num_of_sent = self._ack_wait_packets.pop(seq_num)
+            if num_of_sent > _MAX_RETRANSMIT:
                 logger.server.info(
                     'ACK_TIMEOUT {addr} {packet}', addr=self._addr, packet=pk)
+                continue
+            self._resend_packet(pk, num_of_sent)
+
+    def update(self):
+        """定期的に更新する"""
+        # 受信が途絶えた Session を破棄する
+        now = time.monotonic()
+        if now - self._recv_time >= _SESSION_TIMEOUT:
+            self._timeout()
+            return
+        if self._state == Session._STATE_CONNECTED \
+                and now >= self._keepalive_time():
+            self._send_keepalive()
+        # 揃わない分割パケットを破棄する
+        self._split_packets.expire(now)
+        # RTO を超えても ACK が届かないパケットを再送する
+        self._resend_expired_packets()
+        # まとめていた ACK,NACK を送信する
+        self.send_acknowledge()
         # 待機中のパケットを送信する
-        self._send_waiting_packet()
+        for lane in range(_NUM_OF_LANES):
+            self._send_waiting_packet(lane)
+        self._send_congested_packets()
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,140 @@
+# -*- coding: utf8 -*-
+
+import math
+import time
+
+
+class TimerWheel:
+    """階層化タイマーホイール
+
+    時刻に対応付けて要素を登録し、時刻を過ぎた要素を取り出す。
+    登録は登録数に依らず一定の時間で行え、取り出しは
+    経過した tick 数と取り出す要素の数に比例する時間で行える。
+
+    resolution : 1 tick の秒数
+
+    >>> wheel = TimerWheel(resolution=1.0, now=0)
+    >>> for t, item in [(3, 'a'), (100, 'b'), (5000, 'c'), (0, 'd')]:
+    ...     wheel.add(t, item)
+    >>> len(wheel)
+    4
+    >>> wheel.expire(2.5)
+    ['d']
+    >>> wheel.next_time()
+    3.0
+    >>> wheel.expire(3)
+    ['a']
+    >>> wheel.expire(99), wheel.expire(100)
+    ([], ['b'])
+    >>> wheel.add(50, 'e')
+    >>> wheel.expire(4999)
+    ['e']
+    >>> wheel.expire(10000)
+    ['c']
+    >>> len(wheel), wheel.next_time()
+    (0, None)
+    """
+
+    __slots__ = ['_resolution', '_start', '_tick', '_wheels', '_ready', '_num']
+
+    _BITS = 6
+    _SLOTS = 1 << _BITS
+    _MASK = _SLOTS - 1
+    _LEVELS = 4
+    # 最上位の wheel で扱える tick 数
+    _MAX_DELTA = 1 << (_BITS * _LEVELS)
+
+    def __init__(self, resolution=0.01, now=None):
+        self._resolution = resolution
+        self._start = time.monotonic() if now == None else now
+        # 処理済みの tick
+        self._tick = 0
+        # level -> slot -> list((tick, 要素))
+        self._wheels = [
+            [[] for _ in range(self._SLOTS)] for _ in range(self._LEVELS)]
+        # 既に時刻を過ぎている要素
+        self._ready = []
+        self._num = 0
+
+    def __len__(self):
+        """登録されている要素の数を返す"""
+        return self._num
+
+    def _time(self, tick):
+        return self._start + tick * self._resolution
+
+    def add(self, t, item):
+        """時刻 t に取り出す要素を登録する"""
+        self._num += 1
+        self._insert(math.ceil((t - self._start) / self._resolution), item)
+
+    def _insert(self, tick, item):
+        delta = tick - self._tick
+        if delta <= 0:
+            self._ready.append(item)
+            return
+        # 範囲を超える場合は最上位の wheel に置き、移し替える時に置き直す
+        pos = tick if delta < self._MAX_DELTA \
+            else self._tick + self._MAX_DELTA - 1
+        delta = pos - self._tick
+        level = 0
+        while delta >= 1 << (self._BITS * (level + 1)):
+            level += 1
+        index = (pos >> (self._BITS * level)) & self._MASK
+        self._wheels[level][index].append((tick, item))
+
+    def _cascade(self, level):
+        """上位の wheel の slot を下位の wheel に移し替える"""
+        if level >= self._LEVELS:
+            return
+        index = (self._tick >> (self._BITS * level)) & self._MASK
+        if index == 0:
+            self._cascade(level + 1)
+        slot = self._wheels[level][index]
+        self._wheels[level][index] = []
+        for tick, item in slot:
+            self._insert(tick, item)
+
+    def expire(self, now):
+        """時刻 now までに取り出す要素を返す"""
+        target = math.floor((now - self._start) / self._resolution)
+        items = self._ready
+        self._ready = []
+        wheel = self._wheels[0]
+        while self._tick < target:
+            self._tick += 1
+            index = self._tick & self._MASK
+            if index == 0:
+                self._cascade(1)
+            slot = wheel[index]
+            if len(slot) > 0:
+                wheel[index] = []
+                items.extend(item for _, item in slot)
+        # 移し替えで期限を過ぎていた要素
+        if len(self._ready) > 0:
+            items.extend(self._ready)
+            self._ready = []
+        self._num -= len(items)
+        return items
+
+    def next_time(self):
+        """次に要素を取り出す時刻を返す (登録されていなければ None)
+
+        下位の wheel に無い場合は、次に移し替えを行う時刻を返す。
+        """
+        if self._num == 0:
+            return None
+        if len(self._ready) > 0:
+            return self._time(self._tick)
+        wheel = self._wheels[0]
+        tick = self._tick + 1
+        while tick & self._MASK != 0:
+            if len(wheel[tick & self._MASK]) > 0:
+                break
+            tick += 1
+        return self._time(tick)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
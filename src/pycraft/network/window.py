@@ -1,8 +1,14 @@
 # -*- coding: utf8 -*-
 
+from bisect import bisect_right
+from collections import deque
 from . import logger
 
 
+# 順番を揃える reliability (RELIABLE_ORDERED, RELIABLE_ORDERED_WITH_ACK_RECEIPT)
+_ORDERED = (3, 8)
+
+
 class WindowIndex:
     """Packet の index を生成する
     
@@ -50,6 +56,69 @@ class WindowIndex:
         return self.seek(-1)
 
 
+class SeqNumRanges:
+    """番号の集合を、連続する番号の範囲 (start, last) の並びで保持する
+
+    >>> r = SeqNumRanges()
+    >>> for n in [1, 2, 3, 7, 5, 0, 3, 9]:
+    ...     r.add(n)
+    >>> r.ranges()
+    [(0, 3), (5, 5), (7, 7), (9, 9)]
+    >>> r.add(6)
+    >>> r.add(8)
+    >>> r.ranges()
+    [(0, 3), (5, 9)]
+    >>> len(r)
+    9
+    >>> SeqNumRanges([4, 2, 3]).ranges()
+    [(2, 4)]
+    """
+
+    __slots__ = ['_starts', '_lasts', '_num']
+
+    def __init__(self, seq_nums=()):
+        # 範囲の先頭と末尾 (昇順)
+        self._starts = []
+        self._lasts = []
+        self._num = 0
+        for n in sorted(seq_nums):
+            self.add(n)
+
+    def __len__(self):
+        """保持している番号の数を返す"""
+        return self._num
+
+    def add(self, n):
+        starts = self._starts
+        lasts = self._lasts
+        # 最後の範囲に続く番号 (大半はこの場合)
+        if len(lasts) > 0 and lasts[-1] + 1 == n:
+            lasts[-1] = n
+            self._num += 1
+            return
+        i = bisect_right(starts, n)
+        if i > 0 and lasts[i-1] >= n:
+            return  # 既に含まれている
+        join_prev = i > 0 and lasts[i-1] + 1 == n
+        join_next = i < len(starts) and starts[i] - 1 == n
+        if join_prev and join_next:
+            lasts[i-1] = lasts[i]
+            del starts[i]
+            del lasts[i]
+        elif join_prev:
+            lasts[i-1] = n
+        elif join_next:
+            starts[i] = n
+        else:
+            starts.insert(i, n)
+            lasts.insert(i, n)
+        self._num += 1
+
+    def ranges(self):
+        """範囲 (start, last) のリストを返す"""
+        return list(zip(self._starts, self._lasts))
+
+
 class DataPacketWindow:
 
     __slots__ = ['_latest_seq_num', '_wait_seq_nums', '_ack_seq_nums']
@@ -62,7 +131,7 @@ class DataPacketWindow:
         # 受信待ち DataPacket 番号
         self._wait_seq_nums = set()
         # ACK 送信待ち DataPacket 番号
-        self._ack_seq_nums = set()
+        self._ack_seq_nums = SeqNumRanges()
 
     def put(self, packet):
         self._ack_seq_nums.add(packet.seq_num)
@@ -88,80 +157,145 @@ class DataPacketWindow:
                 seq_num=packet.seq_num)
         return False
             
-    def get_seq_nums(self):
-        ack_seq_nums = self._ack_seq_nums
-        nack_seq_nums = set(self._wait_seq_nums)
-        self._ack_seq_nums = set()
-        return ack_seq_nums, nack_seq_nums
+    def num_of_ack(self):
+        """ACK 送信待ちの DataPacket 数を返す"""
+        return len(self._ack_seq_nums)
+
+    def get_records(self):
+        """ACK, NACK する番号の範囲 (start, last) のリストを返す"""
+        ack_records = self._ack_seq_nums.ranges()
+        nack_records = SeqNumRanges(self._wait_seq_nums).ranges()
+        self._ack_seq_nums = SeqNumRanges()
+        return ack_records, nack_records
+
+
+class _OrderChannel:
+    """channel 毎に順番を揃えるバッファ"""
+
+    __slots__ = ['next_index', 'packets']
+
+    def __init__(self):
+        # 次に処理する order.index
+        self.next_index = 0
+        # order.index -> 先に届いたパケット
+        self.packets = {}
 
 
 class EncapsulatedPacketWindow:
+    """受信した EncapsulatedPacket の重複を除き、順番を揃える
 
-    __slots__ = [
-        '_latest_index',
-        '_wait_index',
-        '_latest_order_index',
-        '_wait_packets',
-        ]
+    message.index の受信状況は _SIZE 個のリングバッファで管理する。
+    ORDERED のパケットは channel 毎に先に届いたものを保持し、
+    順番が揃った時点で処理可能にする。
+    SEQUENCED のパケットは古いものを捨てる。
 
-    _SIZE = 8
+    >>> from pycraft.network.packet.data import EncapsulatedPacket as EncapPacket
+    >>> def packet(m, o, reliability=3, channel=0):
+    ...     return EncapPacket(
+    ...         reliability, bytes([o]), EncapPacket.Message(m),
+    ...         EncapPacket.Order(o, channel))
+    >>> w = EncapsulatedPacketWindow()
+    >>> w.receive(packet(1, 1)), w.receive(packet(0, 0)), w.receive(packet(1, 1))
+    (True, True, False)
+    >>> w.put(packet(1, 1))
+    >>> len(w)
+    0
+    >>> w.put(packet(0, 0))
+    >>> [w.get().buffer for _ in range(len(w))]
+    [b'\\x00', b'\\x01']
+    >>> w.put(packet(3, 3, reliability=4))
+    >>> w.put(packet(2, 2, reliability=4))
+    >>> [w.get().buffer for _ in range(len(w))]
+    [b'\\x03']
+    """
+
+    __slots__ = ['_base_index', '_received', '_channels', '_wait_packets']
+
+    _SIZE = 2048
 
     def __init__(self):
-        # 最新 message.index
-        self._latest_index = -1
-        # 受信待ち message.index
-        self._wait_index = set()
-        # channel 毎の最新 index
-        self._latest_order_index = {}
+        # これより前の message.index は全て受信済み
+        self._base_index = 0
+        # message.index % _SIZE -> 受信済みならば 1
+        self._received = bytearray(self._SIZE)
+        # channel -> _OrderChannel
+        self._channels = {}
         # 処理可能パケット
-        self._wait_packets = []
-    
-    def put(self, packet):
-        # 順番付けられていない場合は即座に処理可能
+        self._wait_packets = deque()
+
+    def receive(self, packet):
+        """初めて受信したパケットならば True を返す"""
         if not packet.message:
+            return True
+        index = packet.message.index
+        base = self._base_index
+        received = self._received
+        if index < base:
+            logger.server.info('discard duplicate packet m[{index}]', index=index)
+            return False
+        if index >= base + self._SIZE:
+            # 受信していない古い番号を諦めて窓を進める
+            new_base = index - self._SIZE + 1
+            logger.server.info(
+                'skip packet m[{start}-{end}]', start=base, end=new_base-1)
+            for i in range(base, min(new_base, base + self._SIZE)):
+                received[i % self._SIZE] = 0
+            base = new_base
+        pos = index % self._SIZE
+        if received[pos]:
+            logger.server.info('discard duplicate packet m[{index}]', index=index)
+            return False
+        received[pos] = 1
+        while received[base % self._SIZE]:
+            received[base % self._SIZE] = 0
+            base += 1
+        self._base_index = base
+        return True
+
+    def put(self, packet):
+        """receive で受け取ったパケットを順番に処理可能にする"""
+        order = packet.order
+        if not order:
             self._wait_packets.append(packet)
             return
-
-        diff = packet.message.index - self._latest_index
-        if diff > 0:
-            # より新しいパケットが届いた
-            min_index = packet.message.index - self._SIZE
-            self._wait_index = set(
-                n for n in self._wait_index if n >= min_index)
-            self._wait_index |= set(
-                n for n in range(self._latest_index+1, packet.message.index))
-            self._latest_index = packet.message.index
-        elif diff + self._SIZE >= 0:
-            # 古いパケットが届いた
-            if packet.message.index in self._wait_index:
-                self._wait_index.discard(packet.message.index)
+        channel = self._channels.get(order.channel)
+        if channel == None:
+            channel = self._channels[order.channel] = _OrderChannel()
+        if packet.reliability not in _ORDERED:
+            # SEQUENCED : 古いパケットは捨てる
+            if order.index >= channel.next_index:
+                channel.next_index = order.index + 1
+                self._wait_packets.append(packet)
             else:
                 logger.server.info(
-                    'discard duplicate packet m[{index}]',
-                    index=packet.message.index)
-                return
-        else:
-            # 古すぎるパケットが届いた
+                    'discard old packet o[{channel},{index}]',
+                    channel=order.channel, index=order.index)
+            return
+        diff = order.index - channel.next_index
+        if diff < 0 or order.index in channel.packets:
             logger.server.info(
-                'discard old packet m[{index}]', index=packet.message.index)
+                'discard old packet o[{channel},{index}]',
+                channel=order.channel, index=order.index)
             return
-            
-        if packet.order:
-            channel = packet.order.channel
-            index = packet.order.index
-            if ((channel not in self._latest_order_index) or 
-                    (self._latest_order_index[channel] <= index)):
-                self._latest_order_index[channel] = index
-            else:
-                logger.server.info(
-                    'discard old packet o[{channel},{index}]',
-                    channel=channel, index=index)
-                return
-
-        self._wait_packets.append(packet)
+        if diff >= self._SIZE:
+            # 届いていないパケットを諦めて保持しているものを処理可能にする
+            logger.server.info(
+                'skip packet o[{channel},{start}-{end}]', channel=order.channel,
+                start=channel.next_index, end=order.index-1)
+            for index in sorted(channel.packets):
+                self._wait_packets.append(channel.packets[index])
+            channel.packets.clear()
+            channel.next_index = order.index
+        channel.packets[order.index] = packet
+        packets = channel.packets
+        index = channel.next_index
+        while index in packets:
+            self._wait_packets.append(packets.pop(index))
+            index += 1
+        channel.next_index = index
 
     def get(self):
-        return self._wait_packets.pop(0)
+        return self._wait_packets.popleft()
 
     def __len__(self):
         return len(self._wait_packets)
@@ -7,7 +7,7 @@ from .values import MobMotion
 
 class MobAI:
     
-    RANDOM = Random(int(time.clock()))
+    RANDOM = Random(int(time.monotonic()))
 
     def next_motion(self, status):
         if len(status.found) > 0:
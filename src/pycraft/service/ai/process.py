@@ -1,6 +1,7 @@
 # -*- coding: utf8 -*-
 
 import os
+import queue
 from multiprocessing import Process, Queue, Value
 from pycraft.service import logger
 from .base import MobAI
@@ -8,7 +9,9 @@ from .scratch import ScratchAgentManager
 
 
 class MobAIProcess:
-    
+
+    WAIT_TIME = 0.05  # sec (MobStatus を待つ時間)
+
     def __init__(self):
         self._received_motion = {}
         self._terminate = Value('b', False)
@@ -49,13 +52,15 @@ class MobAIProcess:
         agents.start()
         while not terminate.value:
             agents.update()
-            if not status_queue.empty():
-                eid, status = status_queue.get()
-                scratch_agent = agents.get_agent(eid, status.type)
-                if scratch_agent:
-                    motion = scratch_agent.next_motion(eid, status)
-                else:
-                    motion = MobAI().next_motion(status)
-                if motion != None:
-                    motion_queue.put((eid, motion))
+            try:
+                eid, status = status_queue.get(timeout=self.WAIT_TIME)
+            except queue.Empty:
+                continue
+            scratch_agent = agents.get_agent(eid, status.type)
+            if scratch_agent:
+                motion = scratch_agent.next_motion(eid, status)
+            else:
+                motion = MobAI().next_motion(status)
+            if motion != None:
+                motion_queue.put((eid, motion))
         agents.terminate()
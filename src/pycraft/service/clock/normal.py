@@ -19,13 +19,13 @@ class Clock:
         # 最後に時を刻んだ時刻
         self._mc_tick_time = 0
         # 基準となる時刻
-        self._origin = time.clock()
+        self._origin = time.monotonic()
 
     time = property(attrgetter('_mc_time'))
 
     def update(self):
         # 時刻の更新
-        sec = int(time.clock() - self._origin) % self.SEC_PER_DAY
+        sec = int(time.monotonic() - self._origin) % self.SEC_PER_DAY
         self._mc_time = sec * self.MC_TIME_PER_SEC
         # 時計の針を刻む
         diff_tick = self._mc_time - self._mc_tick_time
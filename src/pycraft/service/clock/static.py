@@ -19,12 +19,12 @@ class StaticClock:
         """
         self.time = mc_time
         self._tick = tick
-        self._tick_time = time.clock()
+        self._tick_time = time.monotonic()
     
     def update(self):
         if self._tick == None:
             return False
-        diff = time.clock() - self._tick_time
+        diff = time.monotonic() - self._tick_time
         if diff >= self._tick:
             self._tick_time += self._tick
             return True
@@ -0,0 +1,88 @@
+# -*- coding: utf8 -*-
+
+from collections import OrderedDict
+from pycraft.common.util import product
+from pycraft.service.primitive.geometry import ChunkPosition, Position
+from .core import Chunk
+
+
+class BiomeTileCache:
+    """Chunk と同じ区画 (tile) 毎に Biome を計算して保持する
+
+    Chunk の生成には周囲の Biome も必要になり、隣り合う Chunk とは重なる。
+    tile 毎にまとめて計算し、最近使った max_tiles 個を保持することで
+    同じ位置の Biome を計算し直さないようにする。
+
+    >>> cache = BiomeTileCache(lambda positions: [p.x for p in positions], 4)
+    >>> window = cache.window(ChunkPosition(1, 0), 2)
+    >>> len(window), len(window[0])
+    (20, 20)
+    >>> window[0][0], window[2][19], window[19][0]
+    (14, 16, 33)
+    >>> len(cache)
+    4
+    """
+
+    __slots__ = ['_pick_biomes', '_tiles', '_max_tiles']
+
+    def __init__(self, pick_biomes, max_tiles):
+        """
+        pick_biomes : 位置の list から Biome の list を返す関数
+        """
+        self._pick_biomes = pick_biomes
+        # ChunkPosition -> [x][z] の Biome (使った順)
+        self._tiles = OrderedDict()
+        self._max_tiles = max_tiles
+
+    def __len__(self):
+        return len(self._tiles)
+
+    def window(self, chunk_pos, margin):
+        """Chunk とその周囲 margin の範囲の Biome を返す
+
+        返り値 : [x + margin][z + margin] の Biome (x, z は Chunk 内の位置)
+        """
+        size = Chunk.SIZE.X
+        # tile の z 方向の位置 -> 使う範囲
+        z_ranges = (
+            (-1, slice(size - margin, size)),
+            (0, slice(0, size)),
+            (1, slice(0, margin)))
+        window = []
+        for dx in (-1, 0, 1):
+            tiles = [
+                (self._tile(chunk_pos + (dx, dz)), z_range)
+                    for dz, z_range in z_ranges]
+            if dx == -1:
+                x_range = range(size - margin, size)
+            elif dx == 0:
+                x_range = range(size)
+            else:
+                x_range = range(margin)
+            for x in x_range:
+                column = []
+                for tile, z_range in tiles:
+                    column.extend(tile[x][z_range])
+                window.append(column)
+        return window
+
+    def _tile(self, chunk_pos):
+        tile = self._tiles.get(chunk_pos)
+        if tile != None:
+            self._tiles.move_to_end(chunk_pos)
+            return tile
+        size = Chunk.SIZE.X
+        o = chunk_pos.o
+        picked = self._pick_biomes([
+            Position(o.x + x, o.z + z, 0)
+                for x, z in product(range(size), range(size))])
+        tile = [picked[i:i+size] for i in range(0, len(picked), size)]
+        self._tiles[chunk_pos] = tile
+        while len(self._tiles) > self._max_tiles:
+            self._tiles.popitem(last=False)
+        return tile
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -1,12 +1,32 @@
 # -*- coding: utf8 -*-
 
 from binascii import hexlify as hex
+from itertools import count
 from pycraft.common.util import product
 from pycraft.service.primitive.geometry import ChunkRectangular
 from pycraft.service.primitive.values import Color
 from pycraft.service.part.block import new_block
 
 
+# Chunk.version に設定する値 (Process 内で重複しない)
+_versions = count()
+
+
+def _opaque_table():
+    """Block ID を透過しなければ 1、透過すれば 0 に変換する bytes.translate の表"""
+    table = bytearray(256)
+    for block_id in range(256):
+        try:
+            is_transparent = new_block.cls(block_id).is_transparent()
+        except KeyError:
+            is_transparent = False
+        table[block_id] = 0 if is_transparent else 1
+    return bytes(table)
+
+
+_OPAQUE = _opaque_table()
+
+
 def _data_getter(offset):
     def get_data(self, x, z, y):
         index = offset + ((x << 10) | (z << 6) | (y >> 1))
@@ -24,6 +44,7 @@ def _data_setter(offset):
             self._data[index] = (self._data[index] & 0xF0) | (v & 0x0F)
         else:
             self._data[index] = ((v<<4) & 0xF0) | (self._data[index] & 0x0F)
+        self._version = next(_versions)
     return set_data
 
 
@@ -57,6 +78,8 @@ class Chunk:
         # ChunkPosition
         self._pos = pos
         self._data = bytearray(data)
+        # 変更される度に変わる値 (同じ値ならば data は変わっていない)
+        self._version = next(_versions)
 
     def __str__(self):
         return '{name}{pos}[{data}]'.format(
@@ -64,6 +87,11 @@ class Chunk:
 
     pos = property(lambda self: self._pos)
     data = property(lambda self: bytes(self._data))
+    version = property(lambda self: self._version)
+
+    def write_data(self, buffer):
+        """data を bytes を作らずに buffer (長さ DATA_LEN) に書き込む"""
+        buffer[:] = self._data
     
     @classmethod
     def each_xz_pos(cls, range_x=None, range_z=None):
@@ -94,6 +122,8 @@ class Chunk:
         y : 走査を開始する座標
         """
         column = self.get_block_id_column(x, z)
+        if y == None and to_bottom:
+            return self.column_ground_y(column)
         if y == None:
             y = self.TOP_Y if to_bottom else 0
         if self._is_transparent(column[y]) or to_bottom:
@@ -124,6 +154,7 @@ class Chunk:
         """Chunk内の座標に対して Block ID を設定する"""
         index = self._block_id_index(x, z, y)
         self._data[index] = block_id
+        self._version = next(_versions)
         # 最高地点の更新
         heighest_y = self.get_height_map(x, z)
         if self._is_transparent(block_id):
@@ -145,7 +176,31 @@ class Chunk:
     def get_block_id_column(self, x, z):
         """Chunk内の座標に対して縦一列の Block ID リストを返す"""
         index = self._block_id_index(x, z)
-        return bytes(v for v in self._data[index:index+self.SIZE.Y])
+        return bytes(self._data[index:index+self.SIZE.Y])
+
+    def set_block_id_column(self, x, z, column):
+        """Chunk内の座標に対して縦一列の Block ID を設定する
+
+        column : 下から順に SIZE.Y 個の Block ID を並べた bytes
+        最高地点は設定した縦一列の最も高い透過しないブロックにする。
+        """
+        assert len(column) == self.SIZE.Y
+        index = self._block_id_index(x, z)
+        self._data[index:index+self.SIZE.Y] = column
+        self.set_height_map(x, z, self.column_ground_y(column))
+
+    @staticmethod
+    def column_ground_y(column):
+        """縦一列の Block ID の中で最も高い透過しないブロックの位置を返す
+
+        透過しないブロックが無ければ 0 を返す。
+
+        >>> Chunk.column_ground_y(bytes([7, 1, 3, 0, 0]))
+        2
+        >>> Chunk.column_ground_y(bytes(5))
+        0
+        """
+        return max(column.translate(_OPAQUE).rfind(1), 0)
 
     set_block_data = _data_setter(OFFSET_BLOCK_DATA)
     get_block_data = _data_getter(OFFSET_BLOCK_DATA)
@@ -154,6 +209,13 @@ class Chunk:
     set_block_light = _data_setter(OFFSET_BLOCK_LIGHT)
     get_block_light = _data_getter(OFFSET_BLOCK_LIGHT)
 
+    def fill_sky_light(self, v):
+        """Chunk内の全ての座標に天空光の明るさを設定する"""
+        start = self.OFFSET_SKY_LIGHT
+        self._data[start:start+self.LEN_SKY_LIGHT] = \
+            bytes(((v & 0x0F) * 0x11,)) * self.LEN_SKY_LIGHT
+        self._version = next(_versions)
+
     @classmethod
     def _height_map_index(cls, x, z):
         return cls.OFFSET_HEIGHT_MAP + (z << 4) + x
@@ -161,6 +223,7 @@ class Chunk:
     def set_height_map(self, x, z, y):
         index = self._height_map_index(x, z)
         self._data[index] = y
+        self._version = next(_versions)
 
     def get_height_map(self, x, z):
         index = self._height_map_index(x, z)
@@ -174,6 +237,7 @@ class Chunk:
         """Chunk内の座標に対して Biome ID を設定する"""
         index = self._biome_color_index(x, z)
         self._data[index] = biome_id
+        self._version = next(_versions)
 
     def get_biome_id(self, x, z):
         """Chunk内の座標に対して Biome ID を返す"""
@@ -184,6 +248,7 @@ class Chunk:
         """Chunk内の座標に対して色を設定する"""
         index = self._biome_color_index(x, z) + 1
         self._data[index:index+3] = c
+        self._version = next(_versions)
 
     def get_biome_color(self, x, z):
         """Chunk内の座標の色を返す"""
@@ -198,3 +263,8 @@ class Chunk:
         return new_block(
             self.get_block_id(x, z, y),
             self.get_block_data(x, z, y))
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
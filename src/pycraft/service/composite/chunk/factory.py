@@ -2,9 +2,16 @@
 
 import os
 import math
+from heapq import heappush, heappop
+from itertools import count
 from multiprocessing import Process, Queue
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Python 3.8 より前は Queue で data を受け渡す
+    shared_memory = None
 from pycraft.common.util import product
-from pycraft.service import logger
+from pycraft.service import config, logger
 from pycraft.service.primitive.geometry import ChunkPosition
 from pycraft.service.primitive.values import Color
 from pycraft.service.primitive.fuzzy import \
@@ -12,50 +19,187 @@ from pycraft.service.primitive.fuzzy import \
 from pycraft.service.part.biome import BiomeSelector
 from pycraft.service.part.block import BlockID
 from .core import Chunk
+from .biome import BiomeTileCache
+
+
+class ChunkArena:
+    """生成した Chunk の data を Process 間で受け渡す共有メモリ
+
+    Chunk.DATA_LEN バイトの slot を num_of_slots 個持つ。
+    slot は依頼を Process に渡すときに確保し、Chunk を受け取ったら解放する。
+
+    >>> arena = ChunkArena(2)
+    >>> slot = arena.acquire()
+    >>> chunk = Chunk(ChunkPosition(0, 0))
+    >>> chunk.set_block_id(1, 2, 3, 4)
+    >>> arena.write(slot, chunk)
+    >>> arena.read(slot, ChunkPosition(0, 0)).get_block_id(1, 2, 3)
+    4
+    >>> arena.release(slot)
+    >>> arena.close()
+    """
+
+    __slots__ = ['_memory', '_free']
+
+    def __init__(self, num_of_slots):
+        self._memory = shared_memory.SharedMemory(
+            create=True, size=num_of_slots * Chunk.DATA_LEN)
+        self._free = list(range(num_of_slots))
+
+    def __getstate__(self):
+        # spawn で起動した Process には名前で共有メモリを渡す
+        return self._memory.name
+
+    def __setstate__(self, name):
+        self._memory = shared_memory.SharedMemory(name)
+        self._free = []
+
+    def acquire(self):
+        """空いている slot を返す"""
+        return self._free.pop()
+
+    def release(self, slot):
+        self._free.append(slot)
+
+    def write(self, slot, chunk):
+        """chunk の data を slot に書き込む (生成する Process で呼ぶ)"""
+        offset = slot * Chunk.DATA_LEN
+        with self._memory.buf[offset:offset+Chunk.DATA_LEN] as view:
+            chunk.write_data(view)
+
+    def read(self, slot, chunk_pos):
+        """slot の data を1度だけ複製して Chunk を返す"""
+        offset = slot * Chunk.DATA_LEN
+        with self._memory.buf[offset:offset+Chunk.DATA_LEN] as view:
+            return Chunk(chunk_pos, view)
+
+    def close(self):
+        """共有メモリを破棄する (依頼した Process で呼ぶ)"""
+        self._memory.close()
+        self._memory.unlink()
 
 
 class ChunkFactoryProcess:
-    
-    def __init__(self, create):
+    """Chunk を生成する Process の集まり
+
+    生成の依頼は priority (小さいほど優先する) と共に保持し、
+    各 Process が処理中と待ちの2件を超えないように優先度の高いものから渡す。
+    Process に渡す前の依頼は、優先度の変更と取り消しができる。
+    生成された data は共有メモリ (ChunkArena) の slot で受け取り、
+    Queue には位置と slot の番号だけを流す。
+    """
+
+    # 1つの Process に渡しておく依頼の数
+    TASKS_PER_WORKER = 2
+
+    def __init__(self, create, num_of_workers):
         self._create = create
-        self._waiting = set()
+        # ChunkPosition -> (priority, count) (Process に渡す前の依頼)
+        self._requests = {}
+        # [priority, count, ChunkPosition] (_requests と異なるものは無効)
+        self._request_queue = []
+        self._counter = count()
+        # Process に渡した ChunkPosition
+        self._working = set()
+        # 生成された ChunkPosition -> Chunk
         self._chunks = {}
         self._i_queue = Queue()
         self._o_queue = Queue()
-        self._process = Process(
-            target=self.run, args=(self._i_queue, self._o_queue))
+        self._num_of_workers = num_of_workers
+        # start で作る共有メモリ (使えなければ data を Queue で受け渡す)
+        self._arena = None
+        self._processes = []
+
+    num_of_workers = property(lambda self: self._num_of_workers)
+
+    @property
+    def queue_depth(self):
+        """(Process に渡す前の依頼の数, Process に渡した依頼の数)"""
+        return len(self._requests), len(self._working)
 
     def create(self, chunk_pos):
-        # 別Processで生成したChunkを受け取る
+        """生成された Chunk を返す (生成されていなければ None)"""
+        return self._chunks.pop(chunk_pos, None)
+
+    def request(self, chunk_pos, priority):
+        """Chunk の生成を依頼する
+
+        依頼済みで Process に渡す前ならば優先度を変更する。
+        """
+        if chunk_pos in self._chunks or chunk_pos in self._working:
+            return
+        entry = (priority, next(self._counter))
+        self._requests[chunk_pos] = entry
+        heappush(self._request_queue, entry + (chunk_pos,))
+
+    def cancel(self, chunk_pos):
+        """Process に渡す前の依頼を取り消す"""
+        self._requests.pop(chunk_pos, None)
+
+    def update(self):
+        """生成された Chunk を受け取り、空いている Process に依頼を渡す
+
+        返り値 : list(ChunkPosition) - 受け取った Chunk の位置
+        """
+        received = []
         while not self._o_queue.empty():
-            x, z, data = self._o_queue.get()
+            x, z, result = self._o_queue.get()
             p = ChunkPosition(x, z)
-            self._chunks[p] = Chunk(p, data)
-            self._waiting.discard(p)
-        # Chunkがあれば返し、なければ生成する
-        chunk = self._chunks.get(chunk_pos)
-        if chunk == None and chunk_pos not in self._waiting:
-            self._waiting.add(chunk_pos)
-            self._i_queue.put((chunk_pos.x, chunk_pos.z))
-        return chunk
+            self._working.discard(p)
+            # slot を渡していない依頼は data が返る
+            if isinstance(result, bytes):
+                self._chunks[p] = Chunk(p, result)
+            else:
+                self._chunks[p] = self._arena.read(result, p)
+                self._arena.release(result)
+            received.append(p)
+        max_working = self.TASKS_PER_WORKER * self._num_of_workers
+        while len(self._working) < max_working and len(self._requests) > 0:
+            priority, n, chunk_pos = heappop(self._request_queue)
+            if self._requests.get(chunk_pos) != (priority, n):
+                continue
+            del self._requests[chunk_pos]
+            self._working.add(chunk_pos)
+            slot = None if self._arena == None else self._arena.acquire()
+            self._i_queue.put((chunk_pos.x, chunk_pos.z, slot))
+        if len(self._requests) == 0:
+            self._request_queue.clear()
+        return received
         
     def start(self):
-        self._process.start()
+        if shared_memory != None:
+            self._arena = ChunkArena(
+                self.TASKS_PER_WORKER * self._num_of_workers)
+        self._processes = [
+            Process(
+                target=self.run,
+                args=(self._i_queue, self._o_queue, self._arena))
+                for _ in range(self._num_of_workers)]
+        for process in self._processes:
+            process.start()
 
     def terminate(self):
-        if self._process.is_alive():
-            self._process.terminate()
-            self._process.join()
+        for process in self._processes:
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        if self._arena != None:
+            self._arena.close()
+            self._arena = None
         logger.server.info('terminate {name}', name=self.__class__.__name__)
         
-    def run(self, i_queue, o_queue):
+    def run(self, i_queue, o_queue, arena):
         logger.server.info(
             'start {name}(pid={pid})',
             name=self.__class__.__name__, pid=os.getpid())
         while True:
-            x, z = i_queue.get()
+            x, z, slot = i_queue.get()
             chunk = self._create(ChunkPosition(x, z))
-            o_queue.put((x, z, chunk.data))
+            if slot == None:
+                o_queue.put((x, z, chunk.data))
+            else:
+                arena.write(slot, chunk)
+                o_queue.put((x, z, slot))
 
 
 class ChunkFactory(object):
@@ -63,16 +207,40 @@ class ChunkFactory(object):
     
     WATER_HEIGHT = 62
     SMOOTH_SIZE = 2
+    # 保持する Biome の tile (Chunk と同じ区画) の数
+    BIOME_TILES = 256
 
     def __init__(self, random):
         self._random = random
-        self._gaussian = GaussianKernel(self.SMOOTH_SIZE)
+        size = self.SMOOTH_SIZE
+        gaussian = GaussianKernel(size)
+        # (dx, dz, weight) (dx, dz は周囲の Biome の添字の差)
+        self._weights = [
+            (dx + size, dz + size, gaussian.get(dx, dz))
+                for dx, dz in product(
+                    range(-size, size+1), range(-size, size+1))]
+        # 周囲が全て同じ Biome の場合の _smooth_window の値 (Biome ID 毎)
+        self._smoothed = {}
         self._random.reset()
         self._noise_base = Simplex(self._random, 4, 1.0/4, 1.0/32)
         self._random.reset()
         self._selector = BiomeSelector(self._random)
-        self._process = ChunkFactoryProcess(self.create)
+        self._biome_tiles = BiomeTileCache(self._pick_biomes, self.BIOME_TILES)
+        # 密度に依らない縦一列の Block ID
+        self._base_column = bytes(
+            BlockID.BEDROCK if y == 0 else
+            BlockID.STILL_WATER if y <= self.WATER_HEIGHT else BlockID.AIR
+                for y in range(Chunk.SIZE.Y))
+        num_of_workers = config.chunk_workers
+        if num_of_workers == 0:
+            num_of_workers = os.cpu_count() or 1
+        self._process = ChunkFactoryProcess(self.create, num_of_workers)
         self.create = self._process.create
+        self.request = self._process.request
+        self.cancel = self._process.cancel
+        self.update = self._process.update
+
+    queue_depth = property(lambda self: self._process.queue_depth)
     
     def start(self):
         self._process.start()
@@ -87,35 +255,40 @@ class ChunkFactory(object):
             chunk.SIZE.X, chunk.SIZE.Y, chunk.SIZE.Z,
             4, 8, 4,
             chunk_pos.o.x, chunk_pos.o.y, chunk_pos.o.z)
-        biomes = dict(self._biomes(chunk))
+        biomes = self._biome_tiles.window(chunk_pos, self.SMOOTH_SIZE)
+        smoothed = self._smooth(biomes)
+        chunk.fill_sky_light(chunk.MAX_LIGHT_LEVEL)
         for x, z in chunk.each_xz_pos():
-            pos = chunk_pos.pos(x, z)
-            biome = biomes[pos]
+            biome = biomes[x + self.SMOOTH_SIZE][z + self.SMOOTH_SIZE]
             chunk.set_biome_id(x, z, biome.id)
-            min_avg, c, h = self._smooth(pos, biomes)
+            min_avg, c, h = smoothed[x][z]
             chunk.set_biome_color(x, z, c)
-            for y in chunk.each_y_pos():
-                chunk.set_sky_light(x, z, y, chunk.MAX_LIGHT_LEVEL)
-                if y == 0:
-                    chunk.set_block_id(x, z, y, BlockID.BEDROCK)
-                elif noise.on(x, z, y) - 1.0 / h * (y - h - min_avg) > 0:
-                    chunk.set_block_id(x, z, y, BlockID.STONE)
-                elif y <= self.WATER_HEIGHT:
-                    chunk.set_block_id(x, z, y, BlockID.STILL_WATER)
-            self._cover_ground(chunk, x, z, biome)
+            column = self._column(noise.column(x, z), min_avg, h)
+            self._cover_ground(chunk, x, z, column, biome)
+            chunk.set_block_id_column(x, z, column)
         self._populate(chunk, biomes)
         return chunk
 
-    def _biomes(self, chunk):
-        """Chunkの領域の各(x,z,0)のBiomeを返す"""
-        r = product(
-            range(-self.SMOOTH_SIZE, chunk.SIZE.X+self.SMOOTH_SIZE+1),
-            range(-self.SMOOTH_SIZE, chunk.SIZE.Z+self.SMOOTH_SIZE+1))
-        for x, z in r:
-            pos = chunk.pos.pos(x, z)
-            yield (pos, self._pick_biome(pos))
+    def _column(self, noise_column, min_avg, h):
+        """縦一列の地形の Block ID を返す
+
+        密度 (noise から高さに応じた値を引いた値) が正ならば STONE、
+        それ以外は WATER_HEIGHT 以下ならば STILL_WATER とし、最下段は BEDROCK とする。
+        """
+        column = bytearray(self._base_column)
+        d = 1.0 / h
+        for y in range(1, len(column)):
+            if noise_column[y] - d * (y - h - min_avg) > 0:
+                column[y] = BlockID.STONE
+        return column
+
+    def _pick_biomes(self, positions):
+        """各位置の Biome を返す"""
+        return self._selector.pick_biomes(
+            [pos + self._biome_offset(pos) for pos in positions])
 
-    def _pick_biome(self, pos):
+    def _biome_offset(self, pos):
+        """Biome の境界をぼかすために、Biome を決める位置をずらす量を返す"""
         hash_ = pos.x*2345803 ^ pos.z*9236449 ^ self._random.seed
         hash_ *= hash_ + 223
         # noise = -1, 0, 1 (0 は -1,1 よりも出現頻度が高い)
@@ -125,46 +298,87 @@ class ChunkFactory(object):
             x_noise = 0
         if z_noise == 2:
             z_noise = 0
-        return self._selector.pick_biome(pos + (x_noise, z_noise))
+        return x_noise, z_noise
+
+    def _smooth(self, biomes):
+        """周囲の Biome の標高と色を Gaussian で平均した値を返す
+
+        biomes : [x][z] の Biome (周囲 SMOOTH_SIZE を含む)
+        返り値 : [x][z] の (最低標高の平均, 色, 高さ) (周囲を除く)
+        周囲が全て同じ Biome ならば、Biome 毎に計算した値を使う。
+        同じ Biome かどうかは z 方向に調べてから x 方向に調べる。
+        """
+        n = 2*self.SMOOTH_SIZE + 1
+        width = len(biomes) - n + 1
+        depth = len(biomes[0]) - n + 1
+        # z から n 個が全て同じ Biome ならばその Biome (それ以外は None)
+        same = [
+            [column[z] if column[z:z+n].count(column[z]) == n else None
+                for z in range(depth)]
+                    for column in biomes]
+        smoothed = []
+        for x in range(width):
+            line = []
+            for z in range(depth):
+                biome = same[x][z]
+                if biome != None and all(
+                        same[x+dx][z] is biome for dx in range(1, n)):
+                    line.append(self._smooth_same(biome))
+                else:
+                    line.append(self._smooth_window(biomes, x, z))
+            smoothed.append(line)
+        return smoothed
 
-    def _smooth(self, pos, biomes):
+    def _smooth_same(self, biome):
+        smoothed = self._smoothed.get(biome.id)
+        if smoothed == None:
+            n = 2*self.SMOOTH_SIZE + 1
+            smoothed = self._smooth_window([[biome] * n] * n, 0, 0)
+            self._smoothed[biome.id] = smoothed
+        return smoothed
+
+    def _smooth_window(self, biomes, x, z):
+        """biomes[x][z] から (2*SMOOTH_SIZE+1) 四方の Biome を平均する"""
         min_sum, max_sum = 0, 0
-        c_sum = Color(0, 0, 0)
+        r_sum, g_sum, b_sum = 0, 0, 0
         weight_sum = 0.0
-        r = product(
-            range(-self.SMOOTH_SIZE, self.SMOOTH_SIZE+1),
-            range(-self.SMOOTH_SIZE, self.SMOOTH_SIZE+1))
-        for dx, dz in r:
-            weight = self._gaussian.get(dx, dz)
-            spos = pos + (dx, dz)
-            adjacent_biome = biomes[spos]
+        for dx, dz, weight in self._weights:
+            adjacent_biome = biomes[x+dx][z+dz]
+            c = adjacent_biome.color
             min_sum += (adjacent_biome.MIN_ELEVATION - 1) * weight
             max_sum += (adjacent_biome.MAX_ELEVATION) * weight
-            c_sum += (adjacent_biome.color ** 2) * weight
+            r_sum += (c.r ** 2) * weight
+            g_sum += (c.g ** 2) * weight
+            b_sum += (c.b ** 2) * weight
             weight_sum += weight
         min_avg = min_sum/weight_sum
         max_avg = max_sum/weight_sum
-        c_avg = c_sum.astype(lambda v: int(math.sqrt(v/weight_sum)))
+        c_avg = Color(r_sum, g_sum, b_sum).astype(
+            lambda v: int(math.sqrt(v/weight_sum)))
         height = (max_avg - min_avg) / 2.0
         return min_avg, c_avg, height
 
-    def _cover_ground(self, chunk, x, z, biome):
+    def _cover_ground(self, chunk, x, z, column, biome):
+        """縦一列の地表を Biome の COVER_BLOCKS で覆う
+
+        column : Chunk に設定する前の縦一列の Block ID (bytearray)
+        """
         cover_blocks = biome.COVER_BLOCKS
         if len(cover_blocks) == 0:
             return
-        ground_y = chunk.get_ground_y(x, z)
-        if not cover_blocks[0].is_solid() and ground_y != chunk.top:
+        ground_y = chunk.column_ground_y(column)
+        if not cover_blocks[0].is_solid() and ground_y != chunk.TOP_Y:
             ground_y += 1
         dont_cover_y = ground_y - len(cover_blocks)
         if dont_cover_y < 0:
             dont_cover_y = -1
         for y in range(ground_y, dont_cover_y, -1):
             block = cover_blocks[ground_y - y]
-            if (block.is_solid() and 
-                    chunk.get_block_id(x, z, y) == BlockID.AIR):
+            if block.is_solid() and column[y] == BlockID.AIR:
                 break
-            chunk.set_block_id(x, z, y, block.id)
-            chunk.set_block_data(x, z, y, block.attr)
+            column[y] = block.id
+            if block.attr != 0:
+                chunk.set_block_data(x, z, y, block.attr)
 
     def _create_random(self, chunk):
         return Random(
@@ -175,6 +389,11 @@ class ChunkFactory(object):
         # 中央付近のBiomeのpopulatorを使用する
         x = random.next_range(0, chunk.SIZE.X//2-1) + chunk.SIZE.X//4
         z = random.next_range(0, chunk.SIZE.Z//2-1) + chunk.SIZE.Z//4
-        biome = biomes[chunk.pos.pos(x, z)]
+        biome = biomes[x + self.SMOOTH_SIZE][z + self.SMOOTH_SIZE]
         for p in biome.populators:
-            p.populate(chunk, random)
\ No newline at end of file
+            p.populate(chunk, random)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
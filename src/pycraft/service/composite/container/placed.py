@@ -81,7 +81,7 @@ class FurnaceContainer(PlacedContainer):
         if i == self.SLOT_RAW:
             self._property[self.PROPERTY_PROGRESS] = 0
         if i != self.SLOT_PRODUCT:
-            self._burning_start = time.clock()
+            self._burning_start = time.monotonic()
     
     def is_burning(self):
         return self._property[self.PROPERTY_ENERGY] != 0
@@ -145,7 +145,7 @@ class FurnaceContainer(PlacedContainer):
         """
         if self._burning_start == 0:
             return False, ()
-        diff = time.clock() - self._burning_start
+        diff = time.monotonic() - self._burning_start
         count = int(diff/self.SMELTING_TICK)
         updated_slots = set(self._repeat(count))
         # 精錬が終了していなければ最終更新時間を更新
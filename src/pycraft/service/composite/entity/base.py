@@ -147,7 +147,7 @@ class MobEntity(LivingEntity):
     def __init__(self):
         super().__init__()
         self._meta.set(MetaData.Key.NAMETAG, self.__class__.__name__)
-        self._latest_time = time.clock()
+        self._latest_time = time.monotonic()
     
     def get_name(self):
         _, value = self._meta.get(MetaData.Key.NAMETAG)
@@ -181,7 +181,7 @@ class MobEntity(LivingEntity):
         return []
 
     def tick(self):
-        diff = time.clock() - self._latest_time
+        diff = time.monotonic() - self._latest_time
         if diff < self.TICK_TIME:
             return False
         self._latest_time += diff
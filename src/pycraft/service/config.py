@@ -8,6 +8,18 @@ class Config(dict):
         self.spawn_mob = True
         self.scratch_port = 42001
         self.scratch_network = '192.168.197.0/24'
+        self.use_asyncio = False
+        self.network_workers = 0
+        # Chunk を生成する Process の数 (0 ならば CPU の数)
+        self.chunk_workers = 0
+        # ログの出力レベル (logging のレベル名)
+        self.log_level = 'INFO'
+        # 全パケットを16進数で packet.log に出力するか
+        self.packet_log = False
+        # 全パケットを binary capture 形式で出力するファイル (None ならば出力しない)
+        self.packet_capture = None
+        # 符号化した FullChunkData を保持するバイト数
+        self.chunk_packet_cache_size = 64 * 1024 * 1024
 
     def __getattr__(self, name):
         if name in self:
@@ -60,6 +60,23 @@ class BiomeSelector:
         r = int(self._rainfall(pos) * max_sample)
         return biomes[self._biome_id_map[t][r]]
 
+    def pick_biomes(self, positions):
+        """位置の並びに対して pick_biome と同じ Biome の並びを返す
+
+        気温と雨量の noise をまとめて計算する。
+        """
+        max_sample = self.SAMPLE - 1
+        xs = [pos.x for pos in positions]
+        zs = [pos.z for pos in positions]
+        temperatures = self._temperature_factory.noise_2d_points(xs, zs)
+        rainfalls = self._rainfall_factory.noise_2d_points(xs, zs)
+        biome_id_map = self._biome_id_map
+        return [
+            biomes[biome_id_map
+                [int((t + 1.0) / 2 * max_sample)]
+                [int((r + 1.0) / 2 * max_sample)]]
+                    for t, r in zip(temperatures, rainfalls)]
+
     def _temperature(self, pos):
         """気温を0.0-1.0の範囲で返す"""
         return (self._temperature_factory.noise_2d(pos.x, pos.z) + 1.0) / 2
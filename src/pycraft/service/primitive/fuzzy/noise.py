@@ -1,6 +1,58 @@
 # -*- coding: utf8 -*-
 
-from pycraft.common.util import ndarray, product
+
+def _interpolation(size, sampling_rate):
+    """各座標を挟む標本点の番号と重みを返す
+
+    返り値 : list((標本点の番号1, 標本点の番号2, 重み1, 重み2))
+    """
+    nd = []
+    for i in range(size):
+        m = i % sampling_rate
+        n1 = i // sampling_rate
+        d2 = float(m) / sampling_rate
+        d1 = 1 - d2
+        nd.append((n1, n1 + 1, d1, d2))
+    return nd
+
+
+def _upsample(
+        samples,
+        xSize, ySize, zSize,
+        xSamplingRate, ySamplingRate, zSamplingRate):
+    """標本点の値を三線形補間して [x][z][y] の多次元配列を返す
+
+    x 方向の補間を (x, z) 毎に標本点の y の数だけ行ってから、
+    z, y 方向を補間する。各項の計算の順序は変えていない。
+    標本点の値は補間せずにそのまま使う。
+
+    >>> samples = [[[0.0, 1.0], [2.0, 3.0]], [[4.0, 5.0], [6.0, 7.0]]]
+    >>> a = _upsample(samples, 2, 2, 2, 2, 2, 2)
+    >>> a[0][0], a[1][1]
+    ([0.0, 0.5], [3.0, 3.5])
+    """
+    y_nd = _interpolation(ySize, ySamplingRate)
+    z_nd = _interpolation(zSize, zSamplingRate)
+    noise = []
+    for xx, (n1x, n2x, d1x, d2x) in enumerate(
+            _interpolation(xSize, xSamplingRate)):
+        s1, s2 = samples[n1x], samples[n2x]
+        # x 方向に補間した z の標本点毎の値
+        lines = [
+            [d1x * v1 + d2x * v2 for v1, v2 in zip(s1[n], s2[n])]
+                for n in range(len(s1))]
+        plane = []
+        for zz, (n1z, n2z, d1z, d2z) in enumerate(z_nd):
+            l1, l2 = lines[n1z], lines[n2z]
+            column = [
+                d1z * (d1y * l1[n1y] + d2y * l1[n2y]) +
+                d2z * (d1y * l2[n1y] + d2y * l2[n2y])
+                    for n1y, n2y, d1y, d2y in y_nd]
+            if xx % xSamplingRate == 0 and zz % zSamplingRate == 0:
+                column[::ySamplingRate] = s1[n1z][:-1]
+            plane.append(column)
+        noise.append(plane)
+    return noise
 
 
 class Noise:
@@ -20,46 +72,24 @@ class Noise:
         assert ySize % ySamplingRate == 0
         assert zSize % zSamplingRate == 0
         
-        self._noise = ndarray(xSize + 1, zSize + 1, ySize + 1)
-        r = product(
-            range(0, xSize+1, xSamplingRate),
-            range(0, zSize+1, zSamplingRate),
-            range(0, ySize+1, ySamplingRate))
-        for xx, zz, yy in r:
-            self._noise[xx][zz][yy] = base.noise_3d(x+xx, y+yy, z+zz)
-        def gen_nd(size, samplingRate):
-            nd = [None] * size
-            for i in range(size):
-                m = i % samplingRate
-                n1 = i - m
-                n2 = n1 + samplingRate
-                d2 = float(m) / samplingRate
-                d1 = 1 - d2
-                nd[i] = (i, n1, n2, d1, d2)
-            return nd
-        x_nd = gen_nd(xSize, xSamplingRate)
-        y_nd = gen_nd(ySize, ySamplingRate)
-        z_nd = gen_nd(zSize, zSamplingRate)
-        for xx, n1x, n2x, d1x, d2x in x_nd:
-            for zz, n1z, n2z, d1z, d2z in z_nd:
-                for yy, n1y, n2y, d1y, d2y in y_nd:
-                    if n1x == xx and n1y == yy and n1z == zz:
-                        continue
-                    self._noise[xx][zz][yy] = (
-                        d1z * (
-                            d1y * (
-                                d1x * self._noise[n1x][n1z][n1y] +
-                                d2x * self._noise[n2x][n1z][n1y]) +
-                            d2y * (
-                                d1x * self._noise[n1x][n1z][n2y] +
-                                d2x * self._noise[n2x][n1z][n2y])) +
-                        d2z * (
-                            d1y * (
-                                d1x * self._noise[n1x][n2z][n1y] +
-                                d2x * self._noise[n2x][n2z][n1y]) +
-                            d2y * (
-                                d1x * self._noise[n1x][n2z][n2y] +
-                                d2x * self._noise[n2x][n2z][n2y])))
+        # 標本点の値 [x][z][y]
+        samples = base.noise_3d_grid(
+            [x+xx for xx in range(0, xSize+1, xSamplingRate)],
+            [y+yy for yy in range(0, ySize+1, ySamplingRate)],
+            [z+zz for zz in range(0, zSize+1, zSamplingRate)])
+        self._noise = _upsample(
+            samples,
+            xSize, ySize, zSize,
+            xSamplingRate, ySamplingRate, zSamplingRate)
 
     def on(self, x, z, y):
         return self._noise[x][z][y]
+
+    def column(self, x, z):
+        """(x, z) の縦一列の値を y の順に返す"""
+        return self._noise[x][z]
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -56,196 +56,180 @@ class Simplex:
         self._offset_w = random.next_float() * 256
 
     def noise_3d(self, x, y, z, normalized=True):
-        result = 0.0
-        amp = 1.0
-        freq = 1.0
-        max_ = 0.0
+        return self.noise_3d_points([x], [y], [z], normalized)[0]
 
-        x *= self._expansion
-        y *= self._expansion
-        z *= self._expansion
-
-        for _ in range(self._octaves):
-            result += self._calc_noise_3d(x * freq, y * freq, z * freq) * amp
-            max_ += amp
-            freq *= 2
-            amp *= self._persistence
+    def noise_2d(self, x, z, normalized=True):
+        return self.noise_2d_points([x], [z], normalized)[0]
 
-        if normalized:
-            result /= max_
+    def _sum_octaves(self, calc_batch, coords, normalized):
+        """座標の並びに対して octave 毎の値を足し合わせた値の並びを返す
 
-        return result
-    
-    def noise_2d(self, x, z, normalized=True):
-        result = 0.0
+        coords : 座標軸毎の座標の並び
+        """
+        coords = [[c * self._expansion for c in axis] for axis in coords]
+        result = [0.0] * len(coords[0])
         amp = 1.0
         freq = 1.0
         max_ = 0.0
-
-        x *= self._expansion
-        z *= self._expansion
-
         for _ in range(self._octaves):
-            result += self._calc_noise_2d(x * freq, z * freq) * amp
+            values = calc_batch(*([c * freq for c in axis] for axis in coords))
+            result = [r + v * amp for r, v in zip(result, values)]
             max_ += amp
             freq *= 2
             amp *= self._persistence
-
         if normalized:
-            result /= max_
+            result = [r / max_ for r in result]
+        return result
 
+    def noise_3d_points(self, xs, ys, zs, normalized=True):
+        """(xs[i], ys[i], zs[i]) の noise_3d の値の並びを返す
+
+        >>> from .random import Random
+        >>> s = Simplex(Random(3), 4, 1.0/4, 1.0/32)
+        >>> points = [(0, 0, 0), (5, 70, -3), (100.5, 3, 17)]
+        >>> [round(v, 6) for v in s.noise_3d_points(*zip(*points))]
+        [-0.41482, -0.015921, -0.497199]
+        """
+        return self._sum_octaves(
+            self._calc_noise_3d_batch, (xs, ys, zs), normalized)
+
+    def noise_3d_grid(self, xs, ys, zs, normalized=True):
+        """格子点の noise_3d の値を [x][z][y] の順の多次元配列で返す
+
+        xs, ys, zs : 各軸の座標の並び
+
+        >>> from .random import Random
+        >>> s = Simplex(Random(3), 4, 1.0/4, 1.0/32)
+        >>> grid = s.noise_3d_grid([0, 4], [0, 8, 16], [-4, 0])
+        >>> grid[1][0][2] == s.noise_3d(4, 16, -4)
+        True
+        """
+        points = [(x, y, z) for x in xs for z in zs for y in ys]
+        values = iter(self.noise_3d_points(*zip(*points), normalized))
+        return [[[next(values) for _ in ys] for _ in zs] for _ in xs]
+
+    def noise_2d_points(self, xs, zs, normalized=True):
+        """(xs[i], zs[i]) の noise_2d の値の並びを返す
+
+        >>> from .random import Random
+        >>> s = Simplex(Random(3), 2, 1.0/16, 1.0/512)
+        >>> points = [(0, 0), (4294967295, 12), (640, -77)]
+        >>> [round(v, 6) for v in s.noise_2d_points(*zip(*points))]
+        [0.287937, -0.533258, 0.210271]
+        """
+        return self._sum_octaves(
+            self._calc_noise_2d_batch, (xs, zs), normalized)
+
+    def _calc_noise_3d_batch(self, xs, ys, zs):
+        """座標の並びに対して 1 octave 分の 3D noise の値の並びを返す"""
+        perm = self._perm
+        grad3 = self.GRAD3
+        offset_x, offset_y, offset_z = \
+            self._offset_x, self._offset_y, self._offset_z
+        F3, G3 = self.F3, self.G3
+        G3_2, G3_3 = 2.0 * G3, 3.0 * G3
+        result = []
+        for x, y, z in zip(xs, ys, zs):
+            x += offset_x
+            y += offset_y
+            z += offset_z
+            s = (x + y + z) * F3
+            i = int(x + s)
+            j = int(y + s)
+            k = int(z + s)
+            t = (i + j + k) * G3
+            x0 = x - (i - t)
+            y0 = y - (j - t)
+            z0 = z - (k - t)
+            if x0 >= y0:
+                if y0 >= z0:
+                    i1, j1, k1, i2, j2, k2 = 1, 0, 0, 1, 1, 0
+                elif x0 >= z0:
+                    i1, j1, k1, i2, j2, k2 = 1, 0, 0, 1, 0, 1
+                else:
+                    i1, j1, k1, i2, j2, k2 = 0, 0, 1, 1, 0, 1
+            else:
+                if y0 < 0:
+                    i1, j1, k1, i2, j2, k2 = 0, 0, 1, 0, 1, 1
+                elif x0 < z0:
+                    i1, j1, k1, i2, j2, k2 = 0, 1, 0, 0, 1, 1
+                else:
+                    i1, j1, k1, i2, j2, k2 = 0, 1, 0, 1, 1, 0
+            x1 = x0 - i1 + G3
+            y1 = y0 - j1 + G3
+            z1 = z0 - k1 + G3
+            x2 = x0 - i2 + G3_2
+            y2 = y0 - j2 + G3_2
+            z2 = z0 - k2 + G3_2
+            x3 = x0 - 1.0 + G3_3
+            y3 = y0 - 1.0 + G3_3
+            z3 = z0 - 1.0 + G3_3
+            ii = i & 255
+            jj = j & 255
+            kk = k & 255
+            n = 0
+            t0 = 0.6 - x0 * x0 - y0 * y0 - z0 * z0
+            if t0 > 0:
+                g = grad3[perm[ii + perm[jj + perm[kk]]] % 12]
+                n += t0 * t0 * t0 * t0 * (g[0] * x0 + g[1] * y0 + g[2] * z0)
+            t1 = 0.6 - x1 * x1 - y1 * y1 - z1 * z1
+            if t1 > 0:
+                g = grad3[perm[ii + i1 + perm[jj + j1 + perm[kk + k1]]] % 12]
+                n += t1 * t1 * t1 * t1 * (g[0] * x1 + g[1] * y1 + g[2] * z1)
+            t2 = 0.6 - x2 * x2 - y2 * y2 - z2 * z2
+            if t2 > 0:
+                g = grad3[perm[ii + i2 + perm[jj + j2 + perm[kk + k2]]] % 12]
+                n += t2 * t2 * t2 * t2 * (g[0] * x2 + g[1] * y2 + g[2] * z2)
+            t3 = 0.6 - x3 * x3 - y3 * y3 - z3 * z3
+            if t3 > 0:
+                g = grad3[perm[ii + 1 + perm[jj + 1 + perm[kk + 1]]] % 12]
+                n += t3 * t3 * t3 * t3 * (g[0] * x3 + g[1] * y3 + g[2] * z3)
+            result.append(32.0 * n)
         return result
 
-    def _calc_noise_3d(self, x, y, z):
-        x += self._offset_x
-        y += self._offset_y
-        z += self._offset_z
-
-        # Skew the input space to determine which simplex cell we're in
-        s = (x + y + z) * self.F3  # Very nice and simple skew factor for 3D
-        i = int(x + s)
-        j = int(y + s)
-        k = int(z + s)
-        t = (i + j + k) * self.G3
-        # Unskew the cell origin back to (x,y,z) space
-        # The x,y,z distances from the cell origin
-        x0 = x - (i - t)
-        y0 = y - (j - t)
-        z0 = z - (k - t)
-
-        # For the 3D case, the simplex shape is a slightly irregular tetrahedron.
-
-        # Determine which simplex we are in.
-        if x0 >= y0:
-            if y0 >= z0:  # X Y Z order
-                i1, j1, k1 = 1, 0, 0
-                i2, j2, k2 = 1, 1, 0
-            elif x0 >= z0:  # X Z Y order
-                i1, j1, k1 = 1, 0, 0
-                i2, j2, k2 = 1, 0, 1
-            else:  # Z X Y order
-                i1, j1, k1 = 0, 0, 1
-                i2, j2, k2 = 1, 0, 1
-        else:  # x0<y0
-            if y0 < 0:  # Z Y X order
-                i1, j1, k1 = 0, 0, 1
-                i2, j2, k2 = 0, 1, 1
-            elif x0 < z0:  # Y Z X order
-                i1, j1, k1 = 0, 1, 0
-                i2, j2, k2 = 0, 1, 1
-            else:  # Y X Z order
-                i1, j1, k1 = 0, 1, 0
-                i2, j2, k2 = 1, 1, 0
-
-        # A step of (1,0,0) in (i,j,k) means a step of (1-c,-c,-c) in (x,y,z),
-        # a step of (0,1,0) in (i,j,k) means a step of (-c,1-c,-c) in (x,y,z), and
-        # a step of (0,0,1) in (i,j,k) means a step of (-c,-c,1-c) in (x,y,z), where
-        # c = 1/6.
-        # Offsets for second corner in (x,y,z) coords
-        x1 = x0 - i1 + self.G3 
-        y1 = y0 - j1 + self.G3
-        z1 = z0 - k1 + self.G3
-        # Offsets for third corner in (x,y,z) coords
-        x2 = x0 - i2 + 2.0 * self.G3
-        y2 = y0 - j2 + 2.0 * self.G3
-        z2 = z0 - k2 + 2.0 * self.G3
-        # Offsets for last corner in (x,y,z) coords
-        x3 = x0 - 1.0 + 3.0 * self.G3
-        y3 = y0 - 1.0 + 3.0 * self.G3
-        z3 = z0 - 1.0 + 3.0 * self.G3
-
-        # Work out the hashed gradient indices of the four simplex corners
-        ii = i & 255
-        jj = j & 255
-        kk = k & 255
-
-        n = 0
-
-        # Calculate the contribution from the four corners
-        t0 = 0.6 - x0 * x0 - y0 * y0 - z0 * z0
-        if t0 > 0:
-            gi0 = self.GRAD3[
-                self._perm[ii + self._perm[jj + self._perm[kk]]] % 12]
-            n += t0 * t0 * t0 * t0 * (gi0[0] * x0 + gi0[1] * y0 + gi0[2] * z0)
-
-        t1 = 0.6 - x1 * x1 - y1 * y1 - z1 * z1
-        if t1 > 0:
-            gi1 = self.GRAD3[
-                self._perm[ii + i1 + self._perm[jj + j1 + self._perm[kk + k1]]] % 12]
-            n += t1 * t1 * t1 * t1 * (gi1[0] * x1 + gi1[1] * y1 + gi1[2] * z1)
-
-        t2 = 0.6 - x2 * x2 - y2 * y2 - z2 * z2
-        if t2 > 0:
-            gi2 = self.GRAD3[
-                self._perm[ii + i2 + self._perm[jj + j2 + self._perm[kk + k2]]] % 12]
-            n += t2 * t2 * t2 * t2 * (gi2[0] * x2 + gi2[1] * y2 + gi2[2] * z2)
-
-        t3 = 0.6 - x3 * x3 - y3 * y3 - z3 * z3
-        if t3 > 0:
-            gi3 = self.GRAD3[
-                self._perm[ii + 1 + self._perm[jj + 1 +self._perm[kk + 1]]] % 12]
-            n += t3 * t3 * t3 * t3 * (gi3[0] * x3 + gi3[1] * y3 + gi3[2] * z3)
-
-        # Add contributions from each corner to get the noise value.
-        # The result is scaled to stay just inside [-1,1]
-        return 32.0 * n
-
-    def _calc_noise_2d(self, x, y):
-        x += self._offset_x
-        y += self._offset_y
-
-        # Skew the input space to determine which simplex cell we're in
-        s = (x + y) * self.F2  # Hairy factor for 2D
-        i = int(x + s)
-        j = int(y + s)
-        t = (i + j) * self.G2
-        # Unskew the cell origin back to (x,y) space
-        # The x,y distances from the cell origin
-        x0 = x - (i - t)
-        y0 = y - (j - t)
-
-        # For the 2D case, the simplex shape is an equilateral triangle.
-
-        # Determine which simplex we are in.
-        if x0 > y0:  # lower triangle, XY order: (0,0)->(1,0)->(1,1)
-            i1, j1 = 1, 0
-        else:  # upper triangle, YX order: (0,0)->(0,1)->(1,1)
-            i1, j1 = 0, 1
-
-        # A step of (1,0) in (i,j) means a step of (1-c,-c) in (x,y), and
-        # a step of (0,1) in (i,j) means a step of (-c,1-c) in (x,y), where
-        # c = (3-sqrt(3))/6
-
-        # Offsets for middle corner in (x,y) unskewed coords
-        x1 = x0 - i1 + self.G2
-        y1 = y0 - j1 + self.G2
-        # Offsets for last corner in (x,y) unskewed coords
-        x2 = x0 + self.G22
-        y2 = y0 + self.G22
-
-        # Work out the hashed gradient indices of the three simplex corners
-        ii = i & 255
-        jj = j & 255
-
-        n = 0
-
-        # Calculate the contribution from the three corners
-        t0 = 0.5 - x0 * x0 - y0 * y0
-        if t0 > 0:
-            gi0 = self.GRAD3[self._perm[ii + self._perm[jj]] % 12]
-            # (x,y) of grad3 used for 2D gradient
-            n += t0 * t0 * t0 * t0 * (gi0[0] * x0 + gi0[1] * y0)
-
-        t1 = 0.5 - x1 * x1 - y1 * y1
-        if t1 > 0:
-            gi1 = self.GRAD3[self._perm[ii + i1 + self._perm[jj + j1]] % 12]
-            n += t1 * t1 * t1 * t1 * (gi1[0] * x1 + gi1[1] * y1)
-
-        t2 = 0.5 - x2 * x2 - y2 * y2
-        if t2 > 0:
-            gi2 = self.GRAD3[self._perm[ii + 1 + self._perm[jj + 1]] % 12]
-            n += t2 * t2 * t2 * t2 * (gi2[0] * x2 + gi2[1] * y2)
-
-        # Add contributions from each corner to get the noise value.
-        # The result is scaled to return values in the interval [-1,1].
-        return 70.0 * n
+    def _calc_noise_2d_batch(self, xs, ys):
+        """座標の並びに対して 1 octave 分の 2D noise の値の並びを返す"""
+        perm = self._perm
+        grad3 = self.GRAD3
+        offset_x, offset_y = self._offset_x, self._offset_y
+        F2, G2, G22 = self.F2, self.G2, self.G22
+        result = []
+        for x, y in zip(xs, ys):
+            x += offset_x
+            y += offset_y
+            s = (x + y) * F2
+            i = int(x + s)
+            j = int(y + s)
+            t = (i + j) * G2
+            x0 = x - (i - t)
+            y0 = y - (j - t)
+            if x0 > y0:
+                i1, j1 = 1, 0
+            else:
+                i1, j1 = 0, 1
+            x1 = x0 - i1 + G2
+            y1 = y0 - j1 + G2
+            x2 = x0 + G22
+            y2 = y0 + G22
+            ii = i & 255
+            jj = j & 255
+            n = 0
+            t0 = 0.5 - x0 * x0 - y0 * y0
+            if t0 > 0:
+                g = grad3[perm[ii + perm[jj]] % 12]
+                n += t0 * t0 * t0 * t0 * (g[0] * x0 + g[1] * y0)
+            t1 = 0.5 - x1 * x1 - y1 * y1
+            if t1 > 0:
+                g = grad3[perm[ii + i1 + perm[jj + j1]] % 12]
+                n += t1 * t1 * t1 * t1 * (g[0] * x1 + g[1] * y1)
+            t2 = 0.5 - x2 * x2 - y2 * y2
+            if t2 > 0:
+                g = grad3[perm[ii + 1 + perm[jj + 1]] % 12]
+                n += t2 * t2 * t2 * t2 * (g[0] * x2 + g[1] * y2)
+            result.append(70.0 * n)
+        return result
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -101,6 +101,9 @@ class Handler(network.Handler):
     def update(self):
         self._listener.update()
         self._entrance.update()
+        # このフレームで蓄積したパケットを送信する
+        for player in self._players.values():
+            player.flush()
 
     def info(self):
         # MCPE;サーバー名;プロトコルバージョン;MCPEバージョン;ログイン人数;上限
@@ -152,6 +155,27 @@ class Handler(network.Handler):
                 'Decode did not conclude. [{buffer}]', buffer=pk.buffer())
             raise NotImplementedError()
 
+    @staticmethod
+    def expand(buffer):
+        """Batch を中のパケットに展開する
+
+        MultiProcessServer ではネットワークワーカーで zlib の展開まで行い、
+        中のパケットを1つずつ handle に渡す。
+
+        >>> pk = both.Batch()
+        >>> pk.payloads = [b'\\x01', b'\\x02\\x03']
+        >>> pk.encode()
+        >>> Handler.expand(pk.buffer())
+        [b'\\x01', b'\\x02\\x03']
+        >>> Handler.expand(b'\\x05')
+        [b'\\x05']
+        """
+        if len(buffer) == 0 or buffer[0] != ID.BATCH:
+            return [buffer]
+        pk = both.Batch(buffer)
+        pk.decode()
+        return pk.payloads
+
     def _handle_batch(self, session, packet):
         for buffer in packet.payloads:
             pk = self._packet(buffer, session)
@@ -187,23 +211,41 @@ class Handler(network.Handler):
         pk = both.Text()
         pk.type = pk.TYPE_RAW if message.is_raw else pk.TYPE_TRANSLATION 
         pk.message = message
+        # 言語毎に1度だけ符号化する
+        packets = {}
         for player in self._players.values():
-            player.direct_text_packet(pk)
+            lang = player.lang
+            if lang not in packets:
+                packets[lang] = Player.text_packets(pk, lang)
+            player.direct_shared_packets(packets[lang])
 
     def broadcast(self, func, *args, **kwargs):
         for player in self._players.values():
             func(player, *args, **kwargs)
 
+    def broadcast_packets(self, packets, player_ids=None, exclude_eid=None):
+        """符号化済みのパケットを Player に送信する
+
+        packets : iterable(SharedPacket)
+        player_ids : 送信先の Player.id (None ならば全ての Player)
+        exclude_eid : 送信しない Player の eid
+        """
+        for player in self._players.values():
+            if player_ids != None and player.id not in player_ids:
+                continue
+            if player.eid == exclude_eid:
+                continue
+            player.direct_shared_packets(packets)
+
     def unicast(self, func, player_id, *args, **kwargs):
         if player_id in self._players:
             func(self._players[player_id], *args, **kwargs)
 
     def _handle_animate(self, packet, player_id):
         player = self._players[player_id]
-        pk = player.create_animate_packet(packet.action)
         # 他Playerにアニメーションを通知
-        for player in self._players.values():
-            player.send_animate(pk)
+        self.broadcast_packets(
+            player.animate_packets(packet.action), exclude_eid=player.eid)
 
     def _handle_player_action(self, packet, player_id):
         if packet.action == PlayerActionID.RESPAWN:
@@ -250,3 +292,8 @@ class Handler(network.Handler):
 
     def _handle_interact(self, packet, player_id):
         self._entrance.attack_entity(packet.target, player_id)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
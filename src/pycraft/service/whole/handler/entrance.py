@@ -10,6 +10,7 @@ class WorldEntrance:
     
     def __init__(self, components):
         self._is_over = components.scheduler.is_over
+        self._set_pending = components.scheduler.set_pending
         self._world = World(components)
         # Event Queue (コピーしたデータ/変更不可能なデータのみ設定する)
         self._update_queue = EventQueue()
@@ -40,6 +41,7 @@ class WorldEntrance:
             method, param = self._next_update_queue.get()
             self._update_queue.put(method, *param)
         if len(self._update_queue) > 0:
+            self._set_pending()
             logger.server.debug(
                 'WorldEntrance has {n} tasks.', n=len(self._update_queue))
         
@@ -1,9 +1,10 @@
 # -*- coding: utf8 -*-
 
-from pycraft.service import logger
+from pycraft.service import config, logger
 from pycraft.service.primitive.values import Message
 from .player import Player
 from .queue import EventQueue
+from .shared import ChunkPacketCache
 from .task import TaskID
 
 
@@ -12,11 +13,14 @@ class WorldEventListener:
 
     def __init__(self, handler):
         self._is_over = handler.scheduler.is_over
+        self._set_pending = handler.scheduler.set_pending
         self._handler = handler
         # Event Queue (コピーしたデータ/変更不可能なデータのみ設定する)
         self._update_queue = EventQueue()
-        # 更新された Chunk Data を蓄積
+        # ロードされた Chunk の FullChunkData を蓄積
         self._loaded_chunks = []
+        # 前に作った FullChunkData を再利用する
+        self._chunk_packets = ChunkPacketCache(config.chunk_packet_cache_size)
 
     def player_loggedin(self, player, seed):
         """Player がログインした
@@ -84,10 +88,17 @@ class WorldEventListener:
         chunk : Chunk
         block_entities : iterable(BlockEntity)
         """
-        chunk_data = [chunk.data, bytes(4)]  # TODO: 確認する
-        for e in block_entities:
-            chunk_data.append(e.named_tag)
-        self._loaded_chunks.append((chunk.pos, b''.join(chunk_data)))
+        tags = tuple(e.named_tag for e in block_entities)
+        key = (chunk.version, tags)
+        pk = self._chunk_packets.get(chunk.pos, key)
+        if pk == None:
+            chunk_data = [chunk.data, bytes(4)]  # TODO: 確認する
+            chunk_data.extend(tags)
+            chunk_data = b''.join(chunk_data)
+            pk = Player.full_chunk_packet(chunk.pos, chunk_data)
+            # 元のバイト列と符号化したバイト列を保持する
+            self._chunk_packets.put(chunk.pos, key, pk, len(chunk_data) * 2)
+        self._loaded_chunks.append((chunk.pos, pk))
     
     def chunk_updated(self, updated_chunks):
         """Chunkが変更された
@@ -257,6 +268,7 @@ class WorldEventListener:
             self._update_queue.exec_next()
         self._notify_chunk_data()
         if len(self._update_queue) > 0:
+            self._set_pending()
             logger.server.debug(
                 'WorldEventListener has {n} tasks.',
                     n=len(self._update_queue))
@@ -273,43 +285,54 @@ class WorldEventListener:
         player_id = player.player_id
         self._handler.unicast(Player.spawn, player_id, player, time)
         self._handler.unicast(Player.send_new_entities, player_id, entities)
-        self._handler.broadcast(Player.send_new_entities, [player])
+        self._broadcast_new_player(player)
         msg = Message(
             Message.Esc.YELLOW + '%multiplayer.player.joined',
             player.name, is_raw=False)
         self._handler.notify(msg)
 
     def _player_respawned(self, player):
-        self._handler.broadcast(Player.send_new_entities, [player])
+        self._broadcast_new_player(player)
+
+    def _broadcast_new_player(self, player):
+        self._handler.broadcast(
+            Player.send_new_player, player, Player.new_player_packets(player))
 
     def _player_removed(self, eid, public_id):
-        self._handler.broadcast(Player.send_removed_player, eid, public_id)
+        self._handler.broadcast_packets(
+            Player.removed_player_packets(eid, public_id))
 
     def _player_chunk_moved(self, player_id, pos):
         self._handler.unicast(Player.change_chunk_pos, player_id, pos)
 
     def _player_equiped(self, eid, held_hotbar, slot, item):
-        self._handler.broadcast(
-            Player.send_player_equiped, eid, held_hotbar, slot, item)
+        self._handler.broadcast_packets(
+            Player.player_equiped_packets(eid, held_hotbar, slot, item),
+            exclude_eid=eid)
 
     def _player_died(self, eid, spawn_pos, msg):
         self._handler.notify(msg)
-        self._handler.broadcast(Player.send_died_entity, eid, spawn_pos)
+        self._handler.broadcast(
+            Player.send_died_entity, eid, spawn_pos,
+            Player.died_entity_packets(eid))
         
     def _chunk_updated(self, updated_chunks):
         self._handler.broadcast(Player.reset_chunk, updated_chunks)
 
     def _block_updated(self, blocks):
-        self._handler.broadcast(Player.send_updated_block, blocks)
+        self._handler.broadcast_packets(Player.updated_block_packets(blocks))
     
     def _block_entity_updated(self, block_entities):
-        self._handler.broadcast(Player.send_block_entities, block_entities)
+        self._handler.broadcast_packets(
+            Player.block_entities_packets(block_entities))
     
     def _item_added(self, entity, speed):
-        self._handler.broadcast(Player.send_new_item, entity, speed)
+        self._handler.broadcast_packets(Player.new_item_packets(entity, speed))
     
     def _item_taken(self, entity_eid, player_eid):
-        self._handler.broadcast(Player.send_taken_item, entity_eid, player_eid)
+        self._handler.broadcast(
+            Player.send_taken_item, entity_eid, player_eid,
+            Player.taken_item_packets(entity_eid, player_eid))
     
     def _inventory_updated(self, player_id, updated_slot, item):
         self._handler.unicast(
@@ -318,46 +341,55 @@ class WorldEventListener:
     def _container_opened(self, player_id, pos, container, did_open):
         self._handler.unicast(Player.send_container, player_id, pos, container)
         if did_open:
-            self._handler.broadcast(Player.send_open_event, container.pos)
+            self._handler.broadcast_packets(
+                Player.open_event_packets(container.pos))
 
     def _container_closed(self, player_id, pos_list, window_id, did_close):
         self._handler.unicast(
-            Player.send_closed_container, player_id, window_id)
+            Player.direct_shared_packets, player_id,
+            Player.closed_container_packets(window_id))
         if did_close:
-            self._handler.broadcast(Player.send_close_event, pos_list)
+            self._handler.broadcast_packets(
+                Player.close_event_packets(pos_list))
 
     def _container_changed(self, player_ids, window_id, slot, item):
-        self._handler.broadcast(
-            Player.send_changed_container_slot,
-            player_ids, window_id, slot, item)
+        self._handler.broadcast_packets(
+            Player.changed_container_slot_packets(window_id, slot, item),
+            player_ids)
 
     def _container_broken(self, window_id):
-        self._handler.broadcast(Player.send_closed_container, window_id)
+        self._handler.broadcast_packets(
+            Player.closed_container_packets(window_id))
 
     def _furnace_burning(self, player_ids, window_id, prop):
-        self._handler.broadcast(
-            Player.send_container_data, player_ids, window_id, prop)
+        self._handler.broadcast_packets(
+            Player.container_data_packets(window_id, prop), player_ids)
 
     def _entity_moved(self, motions):
-        self._handler.broadcast(Player.send_moved_entity, motions)
+        self._handler.broadcast(
+            Player.send_moved_entity, Player.moved_entity_packets(motions))
 
     def _entity_injured(self, eid, health):
-        self._handler.broadcast(Player.send_injured_entity, eid, health)
+        self._handler.broadcast(
+            Player.send_injured_entity, eid, health,
+            Player.injured_entity_packets(eid))
 
     def _entity_changed(self, eid, meta):
-        self._handler.broadcast(Player.send_changed_entity, eid, meta)
+        self._handler.broadcast_packets(
+            Player.changed_entity_packets(eid, meta))
 
     def _mob_added(self, entities):
-        self._handler.broadcast(Player.send_new_mob, entities)
+        self._handler.broadcast_packets(Player.new_mob_packets(entities))
 
     def _mob_removed(self, eid):
-        self._handler.broadcast(Player.send_removed_mob, eid)
+        self._handler.broadcast_packets(Player.removed_mob_packets(eid))
 
     def _mob_died(self, eid):
-        self._handler.broadcast(Player.send_died_entity, eid)
+        self._handler.broadcast_packets(Player.died_entity_packets(eid))
 
     def _time_updated(self, time):
-        self._handler.broadcast(Player.send_time, time)
+        self._handler.broadcast_packets(Player.time_packets(time))
         
     def _sounded(self, event_id, pos, data):
-        self._handler.broadcast(Player.send_sound, event_id, pos, data)
+        self._handler.broadcast_packets(
+            Player.sound_packets(event_id, pos, data))
@@ -0,0 +1,113 @@
+# -*- coding: utf8 -*-
+
+from pycraft.network import ApplicationPacket, Priority
+from .packet import both
+
+
+class Outbox:
+    """1フレームの間に Player へ送信するパケットを蓄積する
+
+    flush で蓄積した順に送信する。reliability, 優先度 (Priority), is_immediate
+    が同じものが連続していれば Batch にまとめる。
+    1つの Batch に入れるバイト数は MAX_BATCH_SIZE までとする。
+    Batch で圧縮済みのパケットはそのまま送信する。
+
+    >>> class Session:
+    ...     def send_packet(self, packet, reliability, is_immediate):
+    ...         print(type(packet).__name__, reliability, is_immediate,
+    ...             packet.channel)
+    >>> outbox = Outbox(Session())
+    >>> outbox.put(b'\\x01', 3)
+    >>> outbox.flush()
+    ApplicationPacket 3 False 0
+    >>> outbox.put(b'\\x01', 3)
+    >>> outbox.put(b'\\x02', 3)
+    >>> outbox.put(b'\\x03', 0)
+    >>> outbox.put(b'\\x04', 3, True)
+    >>> outbox.put(b'\\x05', 3, priority=Priority.MOVEMENT)
+    >>> outbox.put(b'\\x06', 3)
+    >>> outbox.flush()
+    Batch 3 False 0
+    ApplicationPacket 0 False 0
+    ApplicationPacket 3 True 0
+    ApplicationPacket 3 False 1
+    ApplicationPacket 3 False 0
+    >>> outbox.flush()
+    >>> outbox.put(bytes(Outbox.MAX_BATCH_SIZE), 3)
+    >>> outbox.put(b'\\x01', 3)
+    >>> outbox.flush()
+    Batch 3 False 0
+    ApplicationPacket 3 False 0
+    """
+
+    __slots__ = ['_session', '_runs']
+
+    MAX_BATCH_SIZE = 0x10000  # bytes
+
+    def __init__(self, session):
+        self._session = session
+        # [((reliability, priority, is_immediate),
+        #   list(bytes or ApplicationPacket))] (蓄積した順)
+        self._runs = []
+
+    def _put(self, entry, reliability, priority, is_immediate):
+        key = (reliability, priority, is_immediate)
+        if len(self._runs) > 0 and self._runs[-1][0] == key:
+            self._runs[-1][1].append(entry)
+        else:
+            self._runs.append((key, [entry]))
+
+    def put(
+            self, buffer, reliability, is_immediate=False,
+            priority=Priority.CONTROL):
+        """符号化済みのバイト列を蓄積する"""
+        self._put(buffer, reliability, priority, is_immediate)
+
+    def put_packet(self, packet, reliability, is_immediate=False):
+        """そのまま送信するパケット (圧縮済みの Batch など) を蓄積する
+
+        packet.channel を優先度とする。
+        """
+        self._put(packet, reliability, packet.channel, is_immediate)
+
+    def flush(self):
+        """蓄積したパケットを送信する"""
+        runs = self._runs
+        self._runs = []
+        for (reliability, priority, is_immediate), entries in runs:
+            for pk in self._packets(entries, priority):
+                self._session.send_packet(pk, reliability, is_immediate)
+
+    def _packets(self, entries, priority):
+        """送信するパケットを送信する順に返す"""
+        payloads = []
+        size = 0
+        for entry in entries:
+            if not isinstance(entry, bytes):
+                if len(payloads) > 0:
+                    yield self._batch(payloads, priority)
+                    payloads, size = [], 0
+                yield entry
+                continue
+            if len(payloads) > 0 and size + len(entry) > self.MAX_BATCH_SIZE:
+                yield self._batch(payloads, priority)
+                payloads, size = [], 0
+            payloads.append(entry)
+            size += len(entry)
+        if len(payloads) > 0:
+            yield self._batch(payloads, priority)
+
+    @staticmethod
+    def _batch(payloads, priority):
+        if len(payloads) == 1 and len(payloads[0]) < both.Batch.THRESHOLD:
+            pk = ApplicationPacket(payloads[0])
+        else:
+            pk = both.Batch()
+            pk.payloads = payloads
+        pk.channel = priority
+        return pk
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
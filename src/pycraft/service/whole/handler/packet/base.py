@@ -2,8 +2,24 @@
 
 from pycraft.network import ApplicationPacket
 from .buffer import ByteBuffer
+from .schema import SchemaMeta
 
 
-class Packet(ApplicationPacket):
-    
-    BUFFER_FACTORY = ByteBuffer
\ No newline at end of file
+class Packet(ApplicationPacket, metaclass=SchemaMeta):
+    """fields を宣言すると、符号化と復号化の関数が生成される"""
+
+    BUFFER_FACTORY = ByteBuffer
+
+    def _encode_fields(self, buf):
+        pass
+
+    def _decode_fields(self, buf):
+        pass
+
+    def encode(self):
+        super().encode()
+        self._encode_fields(self._buffer)
+
+    def decode(self):
+        super().decode()
+        self._decode_fields(self._buffer)
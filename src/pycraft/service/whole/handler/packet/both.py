@@ -4,6 +4,8 @@ import zlib
 from binascii import hexlify as hex
 from .base import Packet
 from .ids import ID
+from .schema import Array, Byte, Bool, Short, Int, Long, Str, Item, Rest, \
+    IntPos, Motion
 from pycraft.common.buffer import ByteBuffer
 
 
@@ -50,37 +52,29 @@ class Text(Packet):
 
 class MovePlayer(Packet):
 
-    __slots__ = ['motion', 'mode', 'on_ground']
-
     id = ID.MOVE_PLAYER
 
     MODE_NORMAL = 0  # recv
     MODE_RESET = 1  # send
     MODE_ROTATION = 2
 
-    def encode(self):
-        super().encode()
-        self._buffer.put_motion(self.motion)
-        self._buffer.put_byte(self.mode)
-        self._buffer.put_byte(1 if self.on_ground else 0)
-
-    def decode(self):
-        super().decode()
-        self.motion = self._buffer.next_motion()
-        self.mode = self._buffer.next_byte()
-        self.on_ground = self._buffer.next_byte() > 0
+    fields = (
+        Motion('motion'),
+        Byte('mode'),
+        Bool('on_ground'),
+        )
 
 
 class AddPainting(Packet):
-     
+
     id = ID.ADD_PAINTING
- 
-    def decode(self):
-        super().decode()
-        self.eid = self._buffer.next_long()
-        self.pos = self._buffer.next_int_pos()
-        self.direc = self._buffer.next_int()
-        self.title = self._buffer.next_str()
+
+    fields = (
+        Long('eid'),
+        IntPos('pos'),
+        Int('direc'),
+        Str('title'),
+        )
 
 
 class PlayerEquipment(Packet):
@@ -92,53 +86,35 @@ class PlayerEquipment(Packet):
     slot : inventory slots の index (9..), slot から外す時は 255
     held_hotbar : inventory hotbar の index (0..8)
     """
-    
-    __slots__ = ['eid', 'item', 'slot', 'held_hotbar']
 
     id = ID.PLAYER_EQUIPMENT
 
-    def encode(self):
-        super().encode()
-        self._buffer.put_long(self.eid)
-        self._buffer.put_item(self.item)
-        self._buffer.put_byte(self.slot)
-        self._buffer.put_byte(self.held_hotbar)
-
-    def decode(self):
-        super().decode()
-        self.eid = self._buffer.next_long()
-        self.item = self._buffer.next_item()
-        self.slot = self._buffer.next_byte()
-        self.held_hotbar = self._buffer.next_byte()
+    fields = (
+        Long('eid'),
+        Item('item'),
+        Byte('slot'),
+        Byte('held_hotbar'),
+        )
 
 
 class PlayerArmorEquipment(Packet):
-    
-    __slots__ = ['eid', 'slots']
 
     id = ID.PLAYER_ARMOR_EQUIPMENT
 
-    def decode(self):
-        super().decode()
-        self.eid = self._buffer.next_long()
-        self.slots = [self._buffer.next_byte() for _ in range(4)]
+    fields = (
+        Long('eid'),
+        Array('slots', Byte, count=4),
+        )
 
 
 class Animate(Packet):
-    
-    __slots__ = ['action', 'eid']
 
     id = ID.ANIMATE
 
-    def encode(self):
-        super().encode()
-        self._buffer.put_byte(self.action)
-        self._buffer.put_long(self.eid)
-
-    def decode(self):
-        super().decode()
-        self.action = self._buffer.next_byte()
-        self.eid = self._buffer.next_long()
+    fields = (
+        Byte('action'),
+        Long('eid'),
+        )
 
 
 class DropItem(Packet):
@@ -147,35 +123,22 @@ class DropItem(Packet):
 
 
 class TileEntityData(Packet):
-    
-    __slots__ = ['pos', 'named_tag']
 
     id = ID.TILE_ENTITY_DATA
 
-    def encode(self):
-        super().encode()
-        self._buffer.put_int_pos(self.pos)
-        self._buffer.put(self.named_tag)
-
-    def decode(self):
-        super().decode()
-        self.pos = self._buffer.next_int_pos()
-        self.named_tag = self._buffer.next()
+    fields = (
+        IntPos('pos'),
+        Rest('named_tag'),
+        )
 
 
 class ContainerClose(Packet):
 
-    __slots__ = ['window_id']    
-
     id = ID.CONTAINER_CLOSE
 
-    def encode(self):
-        super().encode()
-        self._buffer.put_byte(self.window_id)
-
-    def decode(self):
-        super().decode()
-        self.window_id = self._buffer.next_byte()
+    fields = (
+        Byte('window_id'),
+        )
 
 
 class ContainerSetSlot(Packet):
@@ -186,24 +149,15 @@ class ContainerSetSlot(Packet):
     send:
         アイテムを拾ったとき
     """
-    
-    __slots__ = ['window_id', 'slot', 'unknown', 'item']
 
     id = ID.CONTAINER_SET_SLOT
 
-    def encode(self):
-        super().encode()
-        self._buffer.put_byte(self.window_id)
-        self._buffer.put_short(self.slot)
-        self._buffer.put_short(0)  # TODO: 対応する
-        self._buffer.put_item(self.item)
-
-    def decode(self):
-        super().decode()
-        self.window_id = self._buffer.next_byte()
-        self.slot = self._buffer.next_short()
-        self.unknown = self._buffer.next_short()  # TODO: 対応する
-        self.item = self._buffer.next_item()
+    fields = (
+        Byte('window_id'),
+        Short('slot'),
+        Short('unknown', const=0),  # TODO: 対応する
+        Item('item'),
+        )
 
 
 class Batch(Packet):
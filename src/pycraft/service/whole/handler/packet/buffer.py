@@ -7,54 +7,46 @@ from pycraft.service.primitive.values import Motion, MetaData
 from pycraft.service.part.item import new_item
 
 
+# 複数の値をまとめて符号化する struct.Struct
+_VECTOR = Endian.BIG.struct('fff')
+_MOTION = Endian.BIG.struct('Qffffff')
+
+
 class ByteBuffer(common.ByteBuffer):
     
     def __init__(self, buffer=b''):
         super().__init__(buffer)
     
     def put_pos(self, pos):
-        self.put_float(pos.x)
-        self.put_float(pos.y)
-        self.put_float(pos.z)
+        self.put_values(_VECTOR, pos.x, pos.y, pos.z)
 
     def next_pos(self):
-        x, y, z = self.next_float(), self.next_float(), self.next_float()
+        x, y, z = self.next_values(_VECTOR)
         return Position(x, z, y)
 
     def put_int_pos(self, pos, endian=Endian.BIG):
-        self.put_int(pos.x, endian)
-        self.put_int(pos.y, endian)
-        self.put_int(pos.z, endian)
+        self.put_values(endian.struct('III'), pos.x, pos.y, pos.z)
 
     def next_int_pos(self, endian=Endian.BIG):
-        x = self.next_int(endian)
-        y = self.next_int(endian)
-        z = self.next_int(endian)
+        x, y, z = self.next_values(endian.struct('III'))
         return Position(x, z, y)
 
     def put_direc(self, direc):
-        self.put_float(direc.x)
-        self.put_float(direc.y)
-        self.put_float(direc.z)
+        self.put_values(_VECTOR, direc.x, direc.y, direc.z)
     
     def next_direc(self):
-        x, y, z = self.next_float(), self.next_float(), self.next_float()
+        x, y, z = self.next_values(_VECTOR)
         return Vector(x, z, y)
 
     def put_motion(self, motion):
-        self.put_long(motion.eid)
-        self.put_pos(motion.pos)
-        self.put_float(motion.yaw)
-        self.put_float(motion.head_yaw)
-        self.put_float(motion.pitch)
+        pos = motion.pos
+        self.put_values(
+            _MOTION, motion.eid, pos.x, pos.y, pos.z,
+            motion.yaw, motion.head_yaw, motion.pitch)
 
     def next_motion(self):
-        eid = self.next_long()
-        pos = self.next_pos()
-        yaw = self.next_float()
-        head_yaw = self.next_float()
-        pitch = self.next_float()
-        return Motion(eid, pos, yaw, head_yaw, pitch)
+        eid, x, y, z, yaw, head_yaw, pitch = self.next_values(_MOTION)
+        return Motion(eid, Position(x, z, y), yaw, head_yaw, pitch)
 
     def put_item(self, item, endian=Endian.BIG):
         self.put_short(item.id, endian)
@@ -1,58 +1,46 @@
 # -*- coding: utf8 -*-
 
 from binascii import hexlify as hex
-from pycraft.service.primitive.geometry import Position
 from .base import Packet
 from .ids import ID
+from .schema import Byte, Int, Long, Raw, Str, Bytes, Item, Pos, IntPos, BlockPos
 
 
 class Login(Packet):
-    
-    __slots__ = [
-        'user_name', 'protocol1', 'protocol2', 'client_id', 'public_id',
-        'server', 'unknown', 'skin_name', 'skin',
-        ]
 
     id = ID.LOGIN
 
-    def decode(self):
-        super().decode()
-        self.user_name = self._buffer.next_str()
-        self.protocol1 = self._buffer.next_int()
-        self.protocol2 = self._buffer.next_int()
-        self.client_id = self._buffer.next_long()
-        self.public_id = self._buffer.next(16)  # TODO: 確認する
-        self.server = self._buffer.next_str()
-        self.unknown = self._buffer.next_bytes()  # TODO: 対応する
-        self.skin_name = self._buffer.next_str()
-        self.skin = self._buffer.next_bytes()
+    fields = (
+        Str('user_name'),
+        Int('protocol1'),
+        Int('protocol2'),
+        Long('client_id'),
+        Raw(16)('public_id'),  # TODO: 確認する
+        Str('server'),
+        Bytes('unknown'),  # TODO: 対応する
+        Str('skin_name'),
+        Bytes('skin'),
+        )
 
 
 class RemoveBlock(Packet):
 
-    __slots__ = ['eid', 'pos']    
-
     id = ID.REMOVE_BLOCK
 
-    def decode(self):
-        super().decode()
-        self.eid = self._buffer.next_long()
-        x = self._buffer.next_int()
-        z = self._buffer.next_int()
-        y = self._buffer.next_byte()
-        self.pos = Position(x, z, y)
+    fields = (
+        Long('eid'),
+        BlockPos('pos'),
+        )
 
 
 class Interact(Packet):
-    
-    __slots__ = ['action', 'target']
 
     id = ID.INTERACT
 
-    def decode(self):
-        super().decode()
-        self.action = self._buffer.next_byte()
-        self.target = self._buffer.next_long()
+    fields = (
+        Byte('action'),
+        Long('target'),
+        )
 
 
 class UseItem(Packet):
@@ -66,49 +54,44 @@ class UseItem(Packet):
     f : Player の相対位置 (負方向 0.0..1.0 正方向)
     pos : Player の Position
     """
-    
-    __slots__ = ['bpos', 'face', 'f', 'pos', 'item']
+
 
     id = ID.USE_ITEM
 
     FACE_NONE = 255
 
+    fields = (
+        IntPos('bpos'),
+        Byte('face'),
+        Pos('f'),
+        Pos('pos'),
+        Item('item'),
+        )
+
     def has_face(self):
         return self.face != self.FACE_NONE
 
-    def decode(self):
-        super().decode()
-        self.bpos = self._buffer.next_int_pos()
-        self.face = self._buffer.next_byte()
-        self.f = self._buffer.next_pos()
-        self.pos = self._buffer.next_pos()
-        self.item = self._buffer.next_item()
-
 
 class PlayerAction(Packet):
-    
-    __slots__ = ['eid', 'action', 'pos', 'face']
 
     id = ID.PLAYER_ACTION
 
-    def decode(self):
-        super().decode()
-        self.eid = self._buffer.next_long()
-        self.action = self._buffer.next_int()
-        self.pos = self._buffer.next_int_pos()
-        self.face = self._buffer.next_int()
+    fields = (
+        Long('eid'),
+        Int('action'),
+        IntPos('pos'),
+        Int('face'),
+        )
 
 
 class Unknown2(Packet):
-    
-    __slots__ = ['unknown', 'item']
 
     id = ID.UNKNOWN2
-    
-    def decode(self):
-        super().decode()
-        self.unknown = self._buffer.next_byte()
-        self.item = self._buffer.next_item()
+
+    fields = (
+        Byte('unknown'),
+        Item('item'),
+        )
 
 
 class MakeItem(Packet):
@@ -0,0 +1,357 @@
+# -*- coding: utf8 -*-
+
+from pycraft.common import Endian
+from pycraft.service.primitive.geometry import Vector, Position, ChunkPosition
+from pycraft.service.primitive.values import Motion as _Motion, BlockRecord
+
+
+class Field:
+    """パケットの属性と型の組
+
+    name : 属性名 (None ならば復号化した値を捨てる)
+    type : Type
+    const : 符号化する時に属性の代わりに使用する値
+    """
+
+    __slots__ = ['name', 'type', 'const']
+
+    _NONE = object()
+
+    def __init__(self, name, type_, const=_NONE):
+        self.name = name
+        self.type = type_
+        self.const = const
+
+    def has_const(self):
+        return self.const is not self._NONE
+
+
+class Type:
+    """フィールドの型
+
+    符号化と復号化を行う Python の式を生成する。
+    fmt が None でなければ固定長で、隣接する固定長のフィールドと
+    まとめて1つの struct.Struct で符号化される。
+
+    fmt : struct のフォーマット (可変長ならば None)
+    size : 符号化したバイト数 (固定長の場合)
+    pack : 値の式 -> struct に渡す式のリスト
+    unpack : struct から得た変数名のリスト -> 値の式
+    put : 値の式 -> 書き込む文 (可変長の場合)
+    next : 読み込む式 (可変長の場合)
+    env : 生成した式が参照する名前
+    """
+
+    __slots__ = [
+        'fmt', 'size', 'num', 'pack', 'unpack', 'put', 'next', 'env']
+
+    def __init__(
+            self, fmt=None, pack=lambda v: [v], unpack=lambda n: n[0],
+            put=None, next=None, env={}):
+        self.fmt = fmt
+        if fmt != None:
+            st = Endian.BIG.struct(fmt)
+            self.size = st.size
+            self.num = len(st.unpack(bytes(st.size)))
+        self.pack = pack
+        self.unpack = unpack
+        self.put = put
+        self.next = next
+        self.env = env
+
+    def __call__(self, name, const=Field._NONE):
+        return Field(name, self, const)
+
+    def is_fixed(self):
+        return self.fmt != None
+
+
+class Tuple(Type):
+    """複数の型を組にした型 (Array の要素として使用する)"""
+
+    __slots__ = ['types']
+
+    def __init__(self, *types):
+        self.types = types
+        env = {}
+        for t in types:
+            env.update(t.env)
+        if all(t.is_fixed() for t in types):
+            def unpack(names):
+                values = []
+                for t in types:
+                    values.append(t.unpack(names[:t.num]))
+                    names = names[t.num:]
+                return '({0},)'.format(', '.join(values))
+            super().__init__(
+                ''.join(t.fmt for t in types),
+                lambda v: [e for i, t in enumerate(types)
+                    for e in t.pack('{0}[{1}]'.format(v, i))],
+                unpack,
+                env=env)
+        else:
+            super().__init__(
+                put=lambda v: '; '.join(
+                    t.put('{0}[{1}]'.format(v, i))
+                        for i, t in enumerate(types)),
+                next='({0},)'.format(', '.join(t.next for t in types)),
+                env=env)
+
+
+class Array(Field):
+    """要素数に続いて同じ型の要素が並ぶフィールド
+
+    count : 要素数の Type (要素数が決まっている場合は int)
+    container : 復号化した要素を格納する型 (list または dict)
+    """
+
+    __slots__ = ['count', 'container']
+
+    def __init__(self, name, type_, count, container=list):
+        super().__init__(name, type_)
+        self.count = count
+        self.container = container
+
+    def has_prefix(self):
+        return not isinstance(self.count, int)
+
+
+class _Compiler:
+    """フィールドの宣言から符号化、復号化の関数を生成する"""
+
+    def __init__(self, cls_name, fields):
+        self._cls_name = cls_name
+        self._fields = fields
+        self._env = {}
+        self._encode = ['def _encode_fields(self, buf):']
+        self._decode = ['def _decode_fields(self, buf):']
+        # 固定長のフィールドの並び
+        self._fmt = []
+        self._values = []
+        self._decoders = []
+        self._num_of_names = 0
+
+    def compile(self):
+        for field in self._fields:
+            if isinstance(field, Array):
+                self._array(field)
+            elif field.type.is_fixed():
+                self._fixed(field)
+            else:
+                self._flush()
+                self._variable(field)
+        self._flush()
+        self._encode.append('    pass')
+        self._decode.append('    pass')
+        source = '\n'.join(self._encode + self._decode)
+        env = dict(self._env)
+        exec(compile(source, '<{0} codec>'.format(self._cls_name), 'exec'), env)
+        return env['_encode_fields'], env['_decode_fields']
+
+    def _struct(self, fmt):
+        name = '_s{0}'.format(sum(1 for k in self._env if k.startswith('_s')))
+        self._env[name] = Endian.BIG.struct(fmt)
+        return name
+
+    def _new_names(self, num):
+        start = self._num_of_names
+        self._num_of_names += num
+        return ['v{0}'.format(i) for i in range(start, self._num_of_names)]
+
+    def _value(self, field):
+        if field.has_const():
+            return repr(field.const)
+        return 'self.{0}'.format(field.name)
+
+    def _assign(self, field, expr):
+        if field.name != None:
+            self._decode.append('    self.{0} = {1}'.format(field.name, expr))
+
+    def _fixed(self, field):
+        self._env.update(field.type.env)
+        self._fmt.append(field.type.fmt)
+        self._values.extend(field.type.pack(self._value(field)))
+        names = self._new_names(field.type.num)
+        self._decoders.append((field, field.type.unpack(names)))
+
+    def _flush(self):
+        """固定長のフィールドを1つの struct.Struct で符号化する"""
+        if len(self._fmt) == 0:
+            return
+        st = self._struct(''.join(self._fmt))
+        self._encode.append('    buf.put_values({0}, {1})'.format(
+            st, ', '.join(self._values)))
+        names = ['v{0}'.format(i) for i in range(self._num_of_names)]
+        self._decode.append('    {0}, = buf.next_values({1})'.format(
+            ', '.join(names), st))
+        for field, expr in self._decoders:
+            self._assign(field, expr)
+        self._fmt = []
+        self._values = []
+        self._decoders = []
+        self._num_of_names = 0
+
+    def _variable(self, field):
+        self._env.update(field.type.env)
+        self._encode.append('    ' + field.type.put(self._value(field)))
+        self._assign(field, field.type.next)
+
+    def _array(self, field):
+        t = field.type
+        self._env.update(t.env)
+        items = self._value(field)
+        if field.container == dict:
+            items += '.items()'
+        if field.has_prefix():
+            # 要素数は直前の固定長のフィールドとまとめる
+            self._fmt.append(field.count.fmt)
+            self._values.append('len({0})'.format(self._value(field)))
+            count = self._new_names(1)[0]
+            self._decoders.append((Field(None, field.count), None))
+        else:
+            count = str(field.count)
+        self._flush()
+        if t.is_fixed():
+            st = self._struct(t.fmt)
+            self._encode.append(
+                '    for e in {0}: buf.put_values({1}, {2})'.format(
+                    items, st, ', '.join(t.pack('e'))))
+            names = ['e{0}'.format(i) for i in range(t.num)]
+            expr = '[{0} for {1}, in buf.iter_values({2}, {3})]'.format(
+                t.unpack(names), ', '.join(names), st, count)
+        else:
+            self._encode.append(
+                '    for e in {0}: {1}'.format(items, t.put('e')))
+            expr = '[{0} for _ in range({1})]'.format(t.next, count)
+        if field.container != list:
+            expr = '{0}({1})'.format(field.container.__name__, expr)
+        self._assign(field, expr)
+
+
+def compile_fields(cls_name, fields):
+    """fields から (_encode_fields, _decode_fields) を生成する"""
+    return _Compiler(cls_name, fields).compile()
+
+
+class SchemaMeta(type):
+    """fields を宣言したパケットに符号化、復号化の関数を追加するメタクラス
+
+    __slots__ が宣言されていなければ fields の属性名から生成する。
+
+    >>> class Example(metaclass=SchemaMeta):
+    ...
+    ...     fields = (
+    ...         Long('eid'),
+    ...         Byte('unknown', const=0),
+    ...         Array('values', Short, count=Int),
+    ...         Str('name'),
+    ...         )
+
+    >>> Example.__slots__
+    ['eid', 'unknown', 'values', 'name']
+    >>> from binascii import hexlify as hex
+    >>> from pycraft.common import ByteBuffer
+    >>> o = Example()
+    >>> o.eid, o.values, o.name = 1, [2, 3], 'a'
+    >>> buf = ByteBuffer()
+    >>> o._encode_fields(buf)
+    >>> hex(buf.bytes())
+    b'0000000000000001000000000200020003000161'
+    >>> o = Example()
+    >>> o._decode_fields(ByteBuffer(buf.bytes()))
+    >>> o.eid, o.unknown, o.values, o.name
+    (1, 0, [2, 3], 'a')
+    """
+
+    def __new__(cls, cls_name, bases, attrs):
+        if 'fields' in attrs:
+            fields = attrs['fields']
+            if '__slots__' not in attrs:
+                attrs['__slots__'] = [f.name for f in fields if f.name != None]
+            encode, decode = compile_fields(cls_name, fields)
+            attrs['_encode_fields'] = encode
+            attrs['_decode_fields'] = decode
+        return type.__new__(cls, cls_name, bases, attrs)
+
+
+Byte = Type('B')
+
+Bool = Type('B', lambda v: ['1 if {0} else 0'.format(v)], lambda n: n[0] + ' > 0')
+
+Short = Type('H')
+
+Int = Type('I')
+
+Long = Type('Q')
+
+Float = Type('f')
+
+
+def Raw(byte):
+    """長さが byte に決まっているバイト列"""
+    return Type('{0}s'.format(byte))
+
+
+Pos = Type(
+    'fff',
+    lambda v: ['{0}.x'.format(v), '{0}.y'.format(v), '{0}.z'.format(v)],
+    lambda n: 'Position({0}, {2}, {1})'.format(*n),
+    env=dict(Position=Position))
+
+IntPos = Type(
+    'III', Pos.pack,
+    Pos.unpack,
+    env=dict(Position=Position))
+
+BlockPos = Type(
+    'IIB',
+    lambda v: ['{0}.x'.format(v), '{0}.z'.format(v), '{0}.y'.format(v)],
+    lambda n: 'Position({0}, {1}, {2})'.format(*n),
+    env=dict(Position=Position))
+
+ChunkPos = Type(
+    'II',
+    lambda v: ['{0}.x'.format(v), '{0}.z'.format(v)],
+    lambda n: 'ChunkPosition({0}, {1})'.format(*n),
+    env=dict(ChunkPosition=ChunkPosition))
+
+Direc = Type(
+    'fff', Pos.pack,
+    lambda n: 'Vector({0}, {2}, {1})'.format(*n),
+    env=dict(Vector=Vector))
+
+Motion = Type(
+    'Qffffff',
+    lambda v: ['{0}.eid'.format(v)] + Pos.pack('{0}.pos'.format(v)) + [
+        '{0}.yaw'.format(v), '{0}.head_yaw'.format(v), '{0}.pitch'.format(v)],
+    lambda n: 'Motion({0}, {1}, {2}, {3}, {4})'.format(
+        n[0], Pos.unpack(n[1:4]), *n[4:]),
+    env=dict(Motion=_Motion, Position=Position))
+
+Block = Type(
+    'IIBBB',
+    lambda v: [
+        '{0}.x'.format(v), '{0}.z'.format(v), '{0}.y'.format(v),
+        '{0}.id'.format(v), '({0}.flags << 4) | {0}.attr'.format(v)],
+    lambda n: 'BlockRecord({0}, {1}, {2}, {3}, {4} & 0xF, {4} >> 4)'.format(*n),
+    env=dict(BlockRecord=BlockRecord))
+
+Str = Type(put=lambda v: 'buf.put_str({0})'.format(v), next='buf.next_str()')
+
+Bytes = Type(
+    put=lambda v: 'buf.put_bytes({0})'.format(v), next='buf.next_bytes()')
+
+LongBytes = Type(
+    put=lambda v: 'buf.put_int(len({0})); buf.put({0})'.format(v),
+    next='buf.next(buf.next_int())')
+
+Rest = Type(put=lambda v: 'buf.put({0})'.format(v), next='buf.next()')
+
+Item = Type(put=lambda v: 'buf.put_item({0})'.format(v), next='buf.next_item()')
+
+Meta = Type(put=lambda v: 'buf.put_meta({0})'.format(v), next='buf.next_meta()')
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -1,16 +1,15 @@
 # -*- coding: utf8 -*-
 
 from binascii import hexlify as hex
-from pycraft.service.primitive.geometry import ChunkPosition
-from pycraft.service.primitive.values import BlockRecord
 from pycraft.service.part.recipe import recipe_data
 from .base import Packet
 from .ids import ID
+from .schema import Type, Array, Tuple, \
+    Byte, Bool, Short, Int, Long, Float, Raw, Str, Item, Meta, LongBytes, \
+    Pos, IntPos, ChunkPos, Direc, Motion, Block
 
 
 class PlayStatus(Packet):
-    
-    __slots__ = ['status']
 
     id = ID.PLAY_STATUS
 
@@ -18,65 +17,43 @@ class PlayStatus(Packet):
     LOGIN_FAILED_CLIENT = 1
     LOGIN_FAILED_SERVER = 2
     PLAYER_SPAWN = 3
-    
-    def encode(self):
-        super().encode()
-        self._buffer.put_int(self.status)
 
-    def decode(self):
-        super().decode()
-        self.status = self._buffer.next_int()
+    fields = (
+        Int('status'),
+        )
 
 
 class Disconnect(Packet):
-    
-    __slots__ = ['message']
 
     id = ID.DISCONNECT
 
-    def encode(self):
-        super().encode()
-        self._buffer.put_str(self.message)
+    fields = (
+        Str('message'),
+        )
 
-    def decode(self):
-        super().decode()
-        self.message = self._buffer.next_str()
+
+# 0: Survival, 1: Creative のみを通知する
+_GameMode = Type('I', lambda v: ['{0} & 0x01'.format(v)])
 
 
 class StartGame(Packet):
-    
-    __slots__ = [
-        'seed', 'generator', 'game_mode', 'eid', 'spawn', 'pos',
-        'unknown1', 'unknown2', 'unknown3']
 
     id = ID.START_GAME
 
     GENERATOR_INFINITE = 1
     GENERATOR_FLAT = 2
-    
-    def encode(self):
-        super().encode()
-        self._buffer.put_int(self.seed)
-        self._buffer.put_byte(0)  # TODO: 対応する
-        self._buffer.put_int(self.generator)
-        self._buffer.put_int(self.game_mode & 0x01)
-        self._buffer.put_long(self.eid)
-        self._buffer.put_int_pos(self.spawn)
-        self._buffer.put_pos(self.pos)
-        self._buffer.put_byte(0)  # TODO: 対応する
-        self._buffer.put_int(0)  # TODO: 対応する
 
-    def decode(self):
-        super().decode()
-        self.seed = self._buffer.next_int()
-        self.unknown1 = self._buffer.next_byte()  # TODO: 対応する
-        self.generator = self._buffer.next_int()
-        self.game_mode = self._buffer.next_int()
-        self.eid = self._buffer.next_long()
-        self.spawn = self._buffer.next_int_pos()
-        self.pos = self._buffer.next_pos()
-        self.unknown2 = self._buffer.next_byte()  # TODO: 対応する
-        self.unknown3 = self._buffer.next_int()  # TODO: 対応する
+    fields = (
+        Int('seed'),
+        Byte('unknown1', const=0),  # TODO: 対応する
+        Int('generator'),
+        _GameMode('game_mode'),
+        Long('eid'),
+        IntPos('spawn'),
+        Pos('pos'),
+        Byte('unknown2', const=0),  # TODO: 対応する
+        Int('unknown3', const=0),  # TODO: 対応する
+        )
 
 
 class AdventureSettings(Packet):
@@ -118,48 +95,30 @@ class AdventureSettings(Packet):
 
 
 class SetDifficulty(Packet):
-    
-    __slots__ = ['difficulty']
 
     id = ID.SET_DIFFICULTY
 
-    def encode(self):
-        super().encode()
-        self._buffer.put_int(self.difficulty)
-
-    def decode(self):
-        super().decode()
-        self.difficulty = self._buffer.next_int()
+    fields = (
+        Int('difficulty'),
+        )
 
 
 class SetSpawnPosition(Packet):
-    
-    __slots__ = ['pos']
 
     id = ID.SET_SPAWN_POSITION
 
-    def encode(self):
-        super().encode()
-        self._buffer.put_int_pos(self.pos)
-
-    def decode(self):
-        super().decode()
-        self.pos = self._buffer.next_int_pos()
+    fields = (
+        IntPos('pos'),
+        )
 
 
 class Respawn(Packet):
 
-    __slots__ = ['pos']    
-
     id = ID.RESPAWN
 
-    def encode(self):
-        super().encode()
-        self._buffer.put_pos(self.pos)
-
-    def decode(self):
-        super().decode()
-        self.pos = self._buffer.next_pos()
+    fields = (
+        Pos('pos'),
+        )
 
 
 class SetTime(Packet):
@@ -181,17 +140,11 @@ class SetTime(Packet):
 
 class SetHealth(Packet):
 
-    __slots__ = ['health']    
-
     id = ID.SET_HEALTH
 
-    def encode(self):
-        super().encode()
-        self._buffer.put_int(self.health)
-
-    def decode(self):
-        super().decode()
-        self.health = self._buffer.next_int()
+    fields = (
+        Int('health'),
+        )
 
 
 class AddPlayer(Packet):
@@ -237,228 +190,122 @@ class AddPlayer(Packet):
                 for _ in range(self._buffer.next_int())]
 
 class AddPlayer2(Packet):
-    
-    __slots__ = [
-        'public_id', 'user_name', 'eid',
-        'pos', 'speed', 'yaw', 'head_yaw', 'pitch',
-        'item', 'meta'
-    ]
 
     id = ID.ADD_PLAYER2
 
-    def encode(self):
-        super().encode()
-        self._buffer.put(self.public_id)
-        self._buffer.put_str(self.user_name)
-        self._buffer.put_long(self.eid) 
-        self._buffer.put_pos(self.pos) 
-        self._buffer.put_direc(self.speed) 
-        self._buffer.put_float(self.yaw) 
-        self._buffer.put_float(self.head_yaw) 
-        self._buffer.put_float(self.pitch) 
-        self._buffer.put_item(self.item) 
-        self._buffer.put_meta(self.meta) 
-        
-    def decode(self):
-        super().decode()
-        self.public_id = self._buffer.next(16)
-        self.user_name = self._buffer.next_str()
-        self.eid = self._buffer.next_long()
-        self.pos = self._buffer.next_pos()
-        self.speed = self._buffer.next_direc()
-        self.yaw = self._buffer.next_float()
-        self.head_yaw = self._buffer.next_float()
-        self.pitch = self._buffer.next_float()
-        self.item = self._buffer.next_item()
-        self.meta = self._buffer.next_meta()
+    fields = (
+        Raw(16)('public_id'),
+        Str('user_name'),
+        Long('eid'),
+        Pos('pos'),
+        Direc('speed'),
+        Float('yaw'),
+        Float('head_yaw'),
+        Float('pitch'),
+        Item('item'),
+        Meta('meta'),
+        )
 
 
 class RemovePlayer(Packet):
-     
-    __slots__ = ['eid', 'public_id', 'public_id2']
- 
+
     id = ID.REMOVE_PLAYER
- 
-    def encode(self):
-        super().encode()
-        self._buffer.put_long(self.eid)
-        self._buffer.put(self.public_id)
-        self._buffer.put(self.public_id2)
- 
-    def decode(self):
-        super().decode()
-        self.eid = self._buffer.next_long()
-        self.public_id = self._buffer.next(16)
-        self.public_id2 = self._buffer.next(16)
+
+    fields = (
+        Long('eid'),
+        Raw(16)('public_id'),
+        Raw(16)('public_id2'),
+        )
 
 
 class AddEntity(Packet):
-    
-    __slots__ = [
-        'eid', 'type', 'pos', 'speed', 'yaw', 'pitch', 'meta', 'links']
 
     id = ID.ADD_ENTITY
 
-    def encode(self):
-        super().encode()
-        self._buffer.put_long(self.eid)
-        self._buffer.put_int(self.type)
-        self._buffer.put_pos(self.pos)
-        self._buffer.put_direc(self.speed)
-        self._buffer.put_float(self.yaw)
-        self._buffer.put_float(self.pitch)
-        self._buffer.put_meta(self.meta)
-        self._buffer.put_short(len(self.links))
-        # 用途不明
-        for link in self.links:
-            self._buffer.put_long(link[0])
-            self._buffer.put_long(link[1])
-            self._buffer.put_byte(link[2])
-    
-    def decode(self):
-        super().decode()
-        self.eid = self._buffer.next_long()
-        self.type = self._buffer.next_int()
-        self.pos = self._buffer.next_pos()
-        self.speed = self._buffer.next_direc()
-        self.yaw = self._buffer.next_float()
-        self.pitch = self._buffer.next_float()
-        self.meta = self._buffer.next_meta()
+    fields = (
+        Long('eid'),
+        Int('type'),
+        Pos('pos'),
+        Direc('speed'),
+        Float('yaw'),
+        Float('pitch'),
+        Meta('meta'),
         # 用途不明
-        self.links = [
-            (self._buffer.next_long(),
-             self._buffer.next_long(),
-             self._buffer.next_byte())
-                for _ in range(self._buffer.next_short())]
+        Array('links', Tuple(Long, Long, Byte), count=Short),
+        )
 
 
 class RemoveEntity(Packet):
 
-    __slots__ = ['eid']    
-
     id = ID.REMOVE_ENTITY
 
-    def encode(self):
-        super().encode()
-        self._buffer.put_long(self.eid)
-
-    def decode(self):
-        super().decode()
-        self.eid = self._buffer.next_long()
+    fields = (
+        Long('eid'),
+        )
 
 
 class AddItemEntity(Packet):
 
-    __slots__ = ['eid', 'item', 'pos', 'speed']    
-
     id = ID.ADD_ITEM_ENTITY
 
-    def encode(self):
-        super().encode()
-        self._buffer.put_long(self.eid)
-        self._buffer.put_item(self.item)
-        self._buffer.put_pos(self.pos)
-        self._buffer.put_direc(self.speed)
-
-    def decode(self):
-        super().decode()
-        self.eid = self._buffer.next_long()
-        self.item = self._buffer.next_item()
-        self.pos = self._buffer.next_pos()
-        self.speed = self._buffer.next_direc()
+    fields = (
+        Long('eid'),
+        Item('item'),
+        Pos('pos'),
+        Direc('speed'),
+        )
 
 
 class TakeItemEntity(Packet):
-    
-    __slots__ = ['item_eid', 'player_eid']
 
     id = ID.TAKE_ITEM_ENTITY
 
-    def encode(self):
-        super().encode()
-        self._buffer.put_long(self.item_eid)
-        self._buffer.put_long(self.player_eid)
-    
-    def decode(self):
-        super().decode()
-        self.item_eid = self._buffer.next_long()
-        self.player_eid = self._buffer.next_long()
+    fields = (
+        Long('item_eid'),
+        Long('player_eid'),
+        )
 
 
 class MoveEntity(Packet):
-    
-    __slots__ = ['motions']
 
     id = ID.MOVE_ENTITY
 
-    def encode(self):
-        super().encode()
-        self._buffer.put_int(len(self.motions))
-        for m in self.motions:
-            self._buffer.put_motion(m)
-
-    def decode(self):
-        super().decode()
-        num = self._buffer.next_int()
-        self.motions = [self._buffer.next_motion() for _ in range(num)]
+    fields = (
+        Array('motions', Motion, count=Int),
+        )
 
 
 class EntityEvent(Packet):
-    
-    __slots__ = ['eid', 'event']
 
     id = ID.ENTITY_EVENT
 
-    def encode(self):
-        super().encode()
-        self._buffer.put_long(self.eid)
-        self._buffer.put_byte(self.event)
-
-    def decode(self):
-        super().decode()
-        self.eid = self._buffer.next_long()
-        self.event = self._buffer.next_byte()
+    fields = (
+        Long('eid'),
+        Byte('event'),
+        )
 
 
 class SetEntityData(Packet):
-    
-    __slots__ = ['eid', 'meta']
 
     id = ID.SET_ENTITY_DATA
 
-    def encode(self):
-        super().encode()
-        self._buffer.put_long(self.eid)
-        self._buffer.put_meta(self.meta)
-
-    def decode(self):
-        super().decode()
-        self.eid = self._buffer.next_long()
-        self.meta = self._buffer.next_meta()
+    fields = (
+        Long('eid'),
+        Meta('meta'),
+        )
 
 
 class SetEntityMotion(Packet):
-    
-    __slots__ = ['motions']
+    """Entity の速度通知
 
-    id = ID.SET_ENTITY_MOTION
+    motions : eid -> 速度 (Vector)
+    """
 
-    def encode(self):
-        super().encode()
-        self._buffer.put_int(len(self.motions))
-        for eid, direction in self.motions.items():
-            self._buffer.put_long(eid)
-            self._buffer.put_direc(direction)
+    id = ID.SET_ENTITY_MOTION
 
-    def decode(self):
-        super().decode()
-        length = self._buffer.next_int()
-        def entity_motions():
-            for _ in range(length):
-                eid = self._buffer.next_long()
-                direc = self._buffer.next_direc()
-                yield (eid, direc)
-        self.motions = dict(entity_motions())
+    fields = (
+        Array('motions', Tuple(Long, Direc), count=Int, container=dict),
+        )
 
 
 class SetEntityLink(Packet):
@@ -469,28 +316,15 @@ class SetEntityLink(Packet):
 class MobEffect(Packet):
     
     id = ID.MOB_EFFECT
-    
-    __slots__ = [
-        'eid', 'event_id', 'effect_id', 'amplifier', 'particles', 'duration'
-    ]
 
-    def encode(self):
-        super().encode()
-        self._buffer.put_long(self.eid)
-        self._buffer.put_byte(self.event_id)
-        self._buffer.put_byte(self.effect_id)
-        self._buffer.put_byte(self.amplifire)
-        self._buffer.put_byte(1 if self.particles else 0)
-        self._buffer.put_int(self.duration)
-    
-    def decode(self):
-        super().decode()
-        self.eid = self._buffer.next_long()
-        self.event_id = self._buffer.next_byte()
-        self.effect_id = self._buffer.next_byte()
-        self.amplifire = self._buffer.next_byte()
-        self.particles = self._buffer.next_byte() > 0
-        self.duration = self._buffer.next_int()
+    fields = (
+        Long('eid'),
+        Byte('event_id'),
+        Byte('effect_id'),
+        Byte('amplifier'),
+        Bool('particles'),
+        Int('duration'),
+        )
 
 
 class Explode(Packet):
@@ -504,144 +338,68 @@ class HurtArmor(Packet):
 
 
 class FullChunkData(Packet):
-    
-    __slots__ = ['pos', 'unknown', 'chunk_data']
 
     id = ID.FULL_CHUNK_DATA
 
-    def encode(self):
-        super().encode()
-        self._buffer.put_int(self.pos.x)
-        self._buffer.put_int(self.pos.z)
-        self._buffer.put_byte(0)  # TODO: 調べる 
-        self._buffer.put_int(len(self.chunk_data))
-        self._buffer.put(self.chunk_data)
-
-    def decode(self):
-        super().decode()
-        self.pos = ChunkPosition(
-            self._buffer.next_int(), self._buffer.next_int())
-        self.unknown = self._buffer.next_byte() # TODO: 調べる
-        self.chunk_data = self._buffer.next(self._buffer.next_int())
+    fields = (
+        ChunkPos('pos'),
+        Byte('unknown', const=0),  # TODO: 調べる
+        LongBytes('chunk_data'),
+        )
 
 
 class UpdateBlock(Packet):
-    
-    __slots__ = ['records']
 
     id = ID.UPDATE_BLOCK
 
-    def _put_block(self, record):
-        self._buffer.put_int(record.x)
-        self._buffer.put_int(record.z)
-        self._buffer.put_byte(record.y)
-        self._buffer.put_byte(record.id)
-        self._buffer.put_byte((record.flags << 4) | record.attr)
-
-    def _next_block(self):
-        x = self._buffer.next_int()
-        z = self._buffer.next_int()
-        y = self._buffer.next_byte()
-        id_ = self._buffer.next_byte()
-        data = self._buffer.next_byte()
-        return BlockRecord(x, z, y, id_, data & 0xF, data >> 4)
-
-    def encode(self):
-        super().encode()
-        self._buffer.put_int(len(self.records))
-        for r in self.records:
-            self._put_block(r)
-
-    def decode(self):
-        super().decode()
-        self.records = [
-            self._next_block() for _ in range(self._buffer.next_int())]
+    fields = (
+        Array('records', Block, count=Int),
+        )
 
 
 class LevelEvent(Packet):
 
-    __slots__ = ['event_id', 'pos', 'data']    
-
     id = ID.LEVEL_EVENT
 
-    def encode(self):
-        super().encode()
-        self._buffer.put_short(self.event_id)
-        self._buffer.put_pos(self.pos)
-        self._buffer.put_int(self.data)
-    
-    def decode(self):
-        super().decode()
-        self.event_id = self._buffer.next_short()
-        self.pos = self._buffer.next_pos()
-        self.data = self._buffer.next_int()
+    fields = (
+        Short('event_id'),
+        Pos('pos'),
+        Int('data'),
+        )
 
 
 class TileEvent(Packet):
-    
-    __slots__ = ['pos', 'case1', 'case2']
 
     id = ID.TILE_EVENT
 
-    def encode(self):
-        super().encode()
-        self._buffer.put_int_pos(self.pos)
-        self._buffer.put_int(self.case1)
-        self._buffer.put_int(self.case2)
-    
-    def decode(self):
-        super().decode()
-        self.pos = self._buffer.next_int_pos()
-        self.case1 = self._buffer.next_int()
-        self.case2 = self._buffer.next_int()
+    fields = (
+        IntPos('pos'),
+        Int('case1'),
+        Int('case2'),
+        )
 
 
 class ContainerOpen(Packet):
-    
-    __slots__ = ['window_id', 'type', 'slots', 'pos']
 
     id = ID.CONTAINER_OPEN
 
-    def encode(self):
-        super().encode()
-        self._buffer.put_byte(self.window_id)
-        self._buffer.put_byte(self.type)
-        self._buffer.put_short(self.slots)
-        self._buffer.put_int_pos(self.pos)
-    
-    def decode(self):
-        super().decode()
-        self.window_id = self._buffer.next_byte()
-        self.type = self._buffer.next_byte()
-        self.slots = self._buffer.next_short()
-        self.pos = self._buffer.next_int_pos()
+    fields = (
+        Byte('window_id'),
+        Byte('type'),
+        Short('slots'),
+        IntPos('pos'),
+        )
 
 
 class ContainerSetContent(Packet):
-    
-    __slots__ = ['window_id', 'slots', 'hotbar']
 
     id = ID.CONTAINER_SET_CONTENT
 
-    def encode(self):
-        super().encode()
-        self._buffer.put_byte(self.window_id)
-        self._buffer.put_short(len(self.slots))
-        for slot in self.slots:
-            self._buffer.put_item(slot)
-        self._buffer.put_short(len(self.hotbar))
-        for slot in self.hotbar:
-            self._buffer.put_int(slot)
-
-    def decode(self):
-        super().decode()
-        self.window_id = self._buffer.next_byte()
-        self.slots = [
-            self._buffer.next_item()
-                for _ in range(self._buffer.next_short())]
-        self.hotbar = [
-            self._buffer.next_int()
-                for _ in range(self._buffer.next_short())]
+    fields = (
+        Byte('window_id'),
+        Array('slots', Item, count=Short),
+        Array('hotbar', Int, count=Short),
+        )
 
 
 class ContainerSetData(Packet):
@@ -653,22 +411,14 @@ class ContainerSetData(Packet):
     property : 情報の種別
     value : 情報の値
     """
-    
-    __slots__ = ['window_id', 'property', 'value']
 
     id = ID.CONTAINER_SET_DATA
 
-    def encode(self):
-        super().encode()
-        self._buffer.put_byte(self.window_id)
-        self._buffer.put_short(self.property)
-        self._buffer.put_short(self.value)
-    
-    def decode(self):
-        super().decode()
-        self.window_id = self._buffer.next_byte()
-        self.property = self._buffer.next_short()
-        self.value = self._buffer.next_short()
+    fields = (
+        Byte('window_id'),
+        Short('property'),
+        Short('value'),
+        )
 
 
 class Unknown1(Packet):
@@ -760,14 +510,8 @@ class RecipeData(Packet):
 
 class Unknown4(Packet):
 
-    __slots__ = ['unknown']
-
     id = ID.UNKNOWN4
-    
-    def encode(self):
-        super().encode()
-        self._buffer.put_byte(2)  # TODO: 対応する
-    
-    def decode(self):
-        super().decode()
-        self.unknown = self._buffer.next_byte()
\ No newline at end of file
+
+    fields = (
+        Byte('unknown', const=2),  # TODO: 対応する
+        )
@@ -3,7 +3,7 @@
 import copy
 from operator import attrgetter
 from pycraft.common.util import iter_count
-from pycraft.network import Reliability
+from pycraft.network import Reliability, Priority
 from pycraft.service import logger
 from pycraft.service.const import \
     GameMode, Difficulty, ContainerWindowID, EntityEventID
@@ -13,6 +13,8 @@ from pycraft.service.primitive.values import Motion
 from pycraft.service.composite.entity import \
     PlayerEntity, MobEntity, ItemEntity
 from .packet import send, both
+from .outbox import Outbox
+from .shared import SharedPacket, SharedMotions
 
 
 class ChunkMonitor:
@@ -66,6 +68,8 @@ class Player:
     def __init__(self, handler, session, client_id, name):
         self._handler = handler
         self._session = session
+        # 1フレームの間に送信するパケット
+        self._outbox = Outbox(session)
         self._lang = ja
         self._client_id = client_id
         self._name = name
@@ -75,6 +79,8 @@ class Player:
 
     id = property(attrgetter('_client_id')) 
     name = property(attrgetter('_name'))
+    eid = property(attrgetter('_eid'))
+    lang = property(attrgetter('_lang'))
 
     def direct_text_packet(self, packet):
         packet = copy.deepcopy(packet)
@@ -85,31 +91,57 @@ class Player:
         packet.encode()
         logger.server.debug(
             'H< {addr} {packet}', addr=self._session.addr, packet=packet)
-        buffer = packet.buffer()
-        if len(buffer) >= both.Batch.THRESHOLD:
-            pk = both.Batch()
-            pk.payloads = [buffer]
-            packet = pk
-        self._session.send_packet(packet, reliability, is_immediate)
-
-    def send_full_chunk(self, updated_chunks):
-        def chunk_buffer(chunk_pos, chunk_data):
-            pk = send.FullChunkData()
-            pk.pos = chunk_pos
-            pk.chunk_data = chunk_data
-            pk.encode()
-            logger.server.debug(
-                'H< {addr} {packet}', addr=self._session.addr, packet=pk)
-            del self._chunk[chunk_pos]
-            return pk.buffer()
-        chunk_data = (
-            chunk_buffer(chunk_pos, chunk_data)
-                for chunk_pos, chunk_data in updated_chunks
-                    if chunk_pos in self._chunk) 
-        pk = both.Batch()
-        pk.payloads = list(chunk_data)
-        if len(pk.payloads) > 0:
-            self._session.send_packet(pk, Reliability.RELIABLE_ORDERED, True)
+        self._outbox.put(packet.buffer(), reliability, is_immediate)
+
+    def direct_shared_packets(
+            self, packets, is_immediate=False, priority=None):
+        """符号化済みの SharedPacket を送信する
+
+        priority : None でなければ SharedPacket.priority の代わりに使う
+        """
+        for pk in packets:
+            p = pk.priority if priority == None else priority
+            if pk.is_large():
+                self._outbox.put_packet(
+                    pk.packet(p), pk.reliability, is_immediate)
+            else:
+                self._outbox.put(pk.buffer, pk.reliability, is_immediate, p)
+
+    def flush(self):
+        """蓄積したパケットをまとめて送信する"""
+        self._outbox.flush()
+
+    @staticmethod
+    def text_packets(packet, lang):
+        packet = copy.deepcopy(packet)
+        packet.tr(lang)
+        return [SharedPacket(packet)]
+
+    @staticmethod
+    def full_chunk_packet(chunk_pos, chunk_data):
+        """ロードされた Chunk の FullChunkData
+        
+        chunk_pos : ChunkPosition
+        chunk_data : bytes
+        """
+        pk = send.FullChunkData()
+        pk.pos = chunk_pos
+        pk.chunk_data = chunk_data
+        return SharedPacket(pk, priority=Priority.CHUNK)
+
+    def send_full_chunk(self, chunk_packets):
+        """要求している Chunk を送信する
+
+        chunk_packets : list((ChunkPosition, full_chunk_packet で作ったパケット))
+        """
+        def packets():
+            for chunk_pos, pk in chunk_packets:
+                if chunk_pos in self._chunk:
+                    del self._chunk[chunk_pos]
+                    yield pk
+        # スポーンするまでは Chunk の到着を待たせないように優先して送信する
+        priority = None if self._spawned else Priority.CONTROL
+        self.direct_shared_packets(packets(), True, priority)
         # Chunk の準備ができたらスポーンを要求する
         if not self._spawned and self._chunk.is_ready():
             self._handler.spawn(self._client_id)
@@ -127,6 +159,7 @@ class Player:
         pk = send.Disconnect()
         pk.message = reason
         self.direct_data_packet(pk, Reliability.RELIABLE_ORDERED)
+        self.flush()
 
     def login(self, player, seed):
         # ログイン成功
@@ -205,15 +238,11 @@ class Player:
         # 状態を設定する
         self._spawned = True
     
-    def create_animate_packet(self, action):
+    def animate_packets(self, action):
         pk = both.Animate()
         pk.eid = self._eid
         pk.action = action
-        return pk
-
-    def send_animate(self, packet):
-        if packet.eid != self._eid:
-            self.direct_data_packet(packet, Reliability.UNRELIABLE)
+        return [SharedPacket(pk, Reliability.UNRELIABLE)]
 
     def send_new_entities(self, entities):
         for entity in entities:
@@ -224,26 +253,26 @@ class Player:
             elif isinstance(entity, ItemEntity):
                 self.send_new_item(entity, Vector(0,0,0))
 
-    def send_new_player(self, player):
-        eid = self.to_packet_eid(player.eid)
+    @staticmethod
+    def _new_player_packets(player, eid):
         v0 = Vector(0,0,0)
         # EntityData
         pk = send.SetEntityData()
         pk.eid = eid
         pk.meta = player.meta
-        self.direct_data_packet(pk, Reliability.RELIABLE_ORDERED)
+        yield pk
         # EntityMotion
         pk = send.SetEntityMotion()
         pk.motions = {eid : v0}
-        self.direct_data_packet(pk, Reliability.RELIABLE_ORDERED)
+        yield pk
         # 自分自身の場合はここまで
-        if eid == self.OWN_EID:
+        if eid == Player.OWN_EID:
             return
         # AddPlayer
         pk = send.AddPlayer()
         pk.is_remove = False
         pk.players = [player]
-        self.direct_data_packet(pk, Reliability.RELIABLE_ORDERED)
+        yield pk
         # AddPlayer2
         pk = send.AddPlayer2()
         pk.public_id = player.public_id
@@ -256,63 +285,108 @@ class Player:
         pk.pitch = player.pitch
         pk.item = player.get_held_item()
         pk.meta = player.meta
-        self.direct_data_packet(pk, Reliability.RELIABLE_ORDERED)
+        yield pk
 
-    def send_removed_player(self, eid, public_id):
+    @staticmethod
+    def new_player_packets(player):
+        """他の Player に player を通知するパケット"""
+        return [
+            SharedPacket(pk)
+                for pk in Player._new_player_packets(player, player.eid)]
+
+    def send_new_player(self, player, packets=None):
+        """player を通知する
+
+        packets : 他の Player と共有するパケット (new_player_packets)
+        """
+        eid = self.to_packet_eid(player.eid)
+        if eid != self.OWN_EID and packets != None:
+            self.direct_shared_packets(packets)
+            return
+        for pk in self._new_player_packets(player, eid):
+            self.direct_data_packet(pk, Reliability.RELIABLE_ORDERED)
+
+    @staticmethod
+    def removed_player_packets(eid, public_id):
         # RemovePlayer
-        pk = send.RemovePlayer()
-        pk.eid = eid
-        pk.public_id = public_id
-        pk.public_id2 = public_id
-        self.direct_data_packet(pk, Reliability.RELIABLE_ORDERED)
+        pk1 = send.RemovePlayer()
+        pk1.eid = eid
+        pk1.public_id = public_id
+        pk1.public_id2 = public_id
         # AddPlayer
-        pk = send.AddPlayer()
-        pk.is_remove = True
-        pk.players = [public_id]
-        self.direct_data_packet(pk, Reliability.RELIABLE_ORDERED)
+        pk2 = send.AddPlayer()
+        pk2.is_remove = True
+        pk2.players = [public_id]
+        return [SharedPacket(pk1), SharedPacket(pk2)]
 
-    def send_player_equiped(self, eid, held_hotbar, slot, item):
-        if eid == self._eid:
-            return
+    @staticmethod
+    def player_equiped_packets(eid, held_hotbar, slot, item):
         pk = both.PlayerEquipment()
         pk.eid = eid
         pk.item = item
-        pk.attr = item.attr
         pk.slot = slot
         pk.held_hotbar = held_hotbar
-        self.direct_data_packet(pk, Reliability.RELIABLE_ORDERED)
+        return [SharedPacket(pk)]
 
-    def send_updated_block(self, blocks):
+    @staticmethod
+    def updated_block_packets(blocks):
         pk = send.UpdateBlock()
         pk.records = blocks
-        self.direct_data_packet(pk, Reliability.RELIABLE_ORDERED)
+        return [SharedPacket(pk, priority=Priority.BLOCK)]
 
-    def send_block_entities(self, block_entities):
-        for e in block_entities:
+    @staticmethod
+    def block_entities_packets(block_entities):
+        def packet(e):
             pk = both.TileEntityData()
             pk.pos = e.pos
             pk.named_tag = e.named_tag
-            self.direct_data_packet(pk, Reliability.RELIABLE_ORDERED)
+            return SharedPacket(pk, priority=Priority.BLOCK)
+        return [packet(e) for e in block_entities]
 
-    def send_new_item(self, entity, speed):
+    @staticmethod
+    def _new_item_packet(entity, speed):
         pk = send.AddItemEntity()
         pk.eid = entity.eid
         pk.item = entity.item
         pk.pos = entity.pos
         pk.speed = speed
+        return pk
+
+    @staticmethod
+    def new_item_packets(entity, speed):
+        return [SharedPacket(Player._new_item_packet(entity, speed))]
+
+    def send_new_item(self, entity, speed):
+        pk = self._new_item_packet(entity, speed)
         self.direct_data_packet(pk, Reliability.RELIABLE_ORDERED)
 
-    def send_taken_item(self, entity_eid, player_eid):
-        player_eid = self.to_packet_eid(player_eid)
-        # TakeItemEntity
+    @staticmethod
+    def _taken_item_packet(entity_eid, player_eid):
         pk = send.TakeItemEntity()
         pk.player_eid = player_eid
         pk.item_eid = entity_eid
-        self.direct_data_packet(pk, Reliability.RELIABLE_ORDERED)
+        return pk
+
+    @staticmethod
+    def taken_item_packets(entity_eid, player_eid):
         # RemoveEntity
         pk = send.RemoveEntity()
         pk.eid = entity_eid
+        return [
+            SharedPacket(Player._taken_item_packet(entity_eid, player_eid)),
+            SharedPacket(pk)]
+
+    def send_taken_item(self, entity_eid, player_eid, packets):
+        """Item が拾われたことを通知する
+
+        packets : 他の Player と共有するパケット (taken_item_packets)
+        """
+        if self.to_packet_eid(player_eid) != self.OWN_EID:
+            self.direct_shared_packets(packets)
+            return
+        pk = self._taken_item_packet(entity_eid, self.OWN_EID)
         self.direct_data_packet(pk, Reliability.RELIABLE_ORDERED)
+        self.direct_shared_packets(packets[1:])
 
     def send_inventory(self, updated_slot, item):
         pk = both.ContainerSetSlot()
@@ -336,80 +410,100 @@ class Player:
         pk.hotbar = []
         self.direct_data_packet(pk, Reliability.RELIABLE_ORDERED, True)
 
-    def send_open_event(self, pos_list):
-        for pos in pos_list:
+    @staticmethod
+    def _tile_event_packets(pos_list, case2):
+        def packet(pos):
             pk = send.TileEvent()
             pk.pos = pos
             pk.case1 = 1
-            pk.case2 = 2
-            self.direct_data_packet(pk, Reliability.RELIABLE_ORDERED)
+            pk.case2 = case2
+            return SharedPacket(pk)
+        return [packet(pos) for pos in pos_list]
+
+    @staticmethod
+    def open_event_packets(pos_list):
+        return Player._tile_event_packets(pos_list, 2)
 
-    def send_closed_container(self, window_id):
+    @staticmethod
+    def close_event_packets(pos_list):
+        return Player._tile_event_packets(pos_list, 0)
+
+    @staticmethod
+    def closed_container_packets(window_id):
         pk = both.ContainerClose()
         pk.window_id = window_id
-        self.direct_data_packet(pk, Reliability.RELIABLE_ORDERED)
-
-    def send_close_event(self, pos_list):
-        for pos in pos_list:
-            pk = send.TileEvent()
-            pk.pos = pos
-            pk.case1 = 1
-            pk.case2 = 0
-            self.direct_data_packet(pk, Reliability.RELIABLE_ORDERED)
+        return [SharedPacket(pk)]
 
-    def send_changed_container_slot(self, player_ids, window_id, slot, item):
-        if self._client_id not in player_ids:
-            return
+    @staticmethod
+    def changed_container_slot_packets(window_id, slot, item):
         pk = both.ContainerSetSlot()
         pk.window_id = window_id
         pk.slot = slot
         pk.item = item
-        self.direct_data_packet(pk, Reliability.RELIABLE_ORDERED)
+        return [SharedPacket(pk)]
 
-    def send_container_data(self, player_ids, window_id, prop):
-        if self._client_id not in player_ids:
-            return
-        for index, value in prop.items():
+    @staticmethod
+    def container_data_packets(window_id, prop):
+        def packet(index, value):
             pk = send.ContainerSetData()
             pk.window_id = window_id
             pk.property = index
             pk.value = value
-            self.direct_data_packet(pk, Reliability.RELIABLE_ORDERED)
+            return SharedPacket(pk)
+        return [packet(index, value) for index, value in prop.items()]
+
+    @staticmethod
+    def moved_entity_packets(motions):
+        return SharedMotions(motions)
+
+    def send_moved_entity(self, shared_motions):
+        """自分自身を除いた Entity の移動を通知する
+
+        shared_motions : SharedMotions (moved_entity_packets)
+        """
+        for buffer in shared_motions.buffers(self._eid):
+            self._outbox.put(
+                buffer, Reliability.RELIABLE_ORDERED,
+                priority=Priority.MOVEMENT)
+
+    @staticmethod
+    def _entity_event_packets(eid, event):
+        pk = send.EntityEvent()
+        pk.eid = eid
+        pk.event = event
+        return [SharedPacket(pk)]
+
+    @staticmethod
+    def injured_entity_packets(eid):
+        return Player._entity_event_packets(
+            eid, EntityEventID.HURT_ANIMATION)
+
+    def send_injured_entity(self, eid, health, packets):
+        """Entity が傷ついたことを通知する
 
-    def send_moved_entity(self, motions):
-        motions = list(m for m in motions if m.eid != self._eid)
-        if len(motions) == 0:
+        packets : 他の Player と共有するパケット (injured_entity_packets)
+        """
+        if self.to_packet_eid(eid) != self.OWN_EID:
+            self.direct_shared_packets(packets)
             return
-        pk = send.MoveEntity()
-        pk.motions = motions
-        self.direct_data_packet(pk, Reliability.RELIABLE_ORDERED)
-        pk = send.SetEntityMotion()
-        pk.motions = dict((m.eid, Vector(0, 0, 0)) for m in motions)
+        pk = send.SetHealth()
+        pk.health = health
         self.direct_data_packet(pk, Reliability.RELIABLE_ORDERED)
-        
-    def send_injured_entity(self, eid, health):
-        eid = self.to_packet_eid(eid)
-        if eid == self.OWN_EID:
-            pk = send.SetHealth()
-            pk.health = health
-            self.direct_data_packet(pk, Reliability.RELIABLE_ORDERED)
         pk = send.EntityEvent()
-        pk.eid = eid
+        pk.eid = self.OWN_EID
         pk.event = EntityEventID.HURT_ANIMATION
         self.direct_data_packet(pk, Reliability.RELIABLE_ORDERED)
 
-    def send_changed_entity(self, eid, meta):
+    @staticmethod
+    def changed_entity_packets(eid, meta):
         # EntityData
         pk = send.SetEntityData()
         pk.eid = eid
         pk.meta = meta
-        self.direct_data_packet(pk, Reliability.RELIABLE_ORDERED)
-        
-    def send_new_mob(self, entities):
-        for e in entities:
-            self._send_new_mob(e)
+        return [SharedPacket(pk)]
 
-    def _send_new_mob(self, e):
+    @staticmethod
+    def _new_mob_packet(e):
         pk = send.AddEntity()
         pk.eid = e.eid
         pk.type = e.TYPE
@@ -419,34 +513,51 @@ class Player:
         pk.pitch = e.pitch
         pk.meta = e.meta
         pk.links = []  # TODO: link を設定する
+        return pk
+
+    @staticmethod
+    def new_mob_packets(entities):
+        return [SharedPacket(Player._new_mob_packet(e)) for e in entities]
+
+    def _send_new_mob(self, e):
+        pk = self._new_mob_packet(e)
         self.direct_data_packet(pk, Reliability.RELIABLE_ORDERED)
 
-    def send_removed_mob(self, eid):
+    @staticmethod
+    def removed_mob_packets(eid):
         # RemoveEntity
         pk = send.RemoveEntity()
         pk.eid = eid
-        self.direct_data_packet(pk, Reliability.RELIABLE_ORDERED)
+        return [SharedPacket(pk)]
+
+    @staticmethod
+    def died_entity_packets(eid):
+        return Player._entity_event_packets(
+            eid, EntityEventID.DEATH_ANIMATION)
 
-    def send_died_entity(self, eid, spawn_pos=None):
+    def send_died_entity(self, eid, spawn_pos, packets):
+        """Entity が死んだことを通知する
+
+        packets : 他の Player と共有するパケット (died_entity_packets)
+        """
         if eid == self._eid:
             pk = send.Respawn()
             pk.pos = spawn_pos
             self.direct_data_packet(pk, Reliability.RELIABLE_ORDERED)
         else:
-            pk = send.EntityEvent()
-            pk.eid = eid
-            pk.event = EntityEventID.DEATH_ANIMATION
-            self.direct_data_packet(pk, Reliability.RELIABLE_ORDERED)
+            self.direct_shared_packets(packets)
 
-    def send_time(self, time):
+    @staticmethod
+    def time_packets(time):
         pk = send.SetTime()
         pk.time = time
         pk.started = True
-        self.direct_data_packet(pk, Reliability.RELIABLE_ORDERED)
+        return [SharedPacket(pk)]
 
-    def send_sound(self, event_id, pos, data):
+    @staticmethod
+    def sound_packets(event_id, pos, data):
         pk = send.LevelEvent()
         pk.event_id = event_id
         pk.pos = pos
         pk.data = data
-        self.direct_data_packet(pk, Reliability.RELIABLE_ORDERED)
+        return [SharedPacket(pk)]
@@ -0,0 +1,206 @@
+# -*- coding: utf8 -*-
+
+from collections import OrderedDict
+from operator import attrgetter
+from pycraft.common import Endian
+from pycraft.network import ApplicationPacket, Reliability, Priority
+from pycraft.service import logger
+from pycraft.service.primitive.geometry import Vector
+from .packet import send, both
+
+
+def _batch_buffer(buffer):
+    """符号化済みのバイト列を送信するバイト列にする
+
+    大きなパケットは Batch で圧縮する。
+    返したバイト列は変更されないので、複数の Session で共有できる。
+    """
+    if len(buffer) >= both.Batch.THRESHOLD:
+        pk = both.Batch()
+        pk.payloads = [buffer]
+        pk.encode()
+        buffer = pk.buffer()
+    return buffer
+
+
+class SharedPacket:
+    """複数の Player に送信する符号化済みのパケット
+
+    最初に送信する時に1度だけ符号化する。
+    priority : 送信の優先度 (Priority)
+    """
+
+    __slots__ = ['_packet', '_buffer', '_batch', '_reliability', '_priority']
+
+    def __init__(
+            self, packet, reliability=Reliability.RELIABLE_ORDERED,
+            priority=Priority.CONTROL):
+        self._packet = packet
+        self._buffer = None
+        self._batch = None
+        self._reliability = reliability
+        self._priority = priority
+
+    reliability = property(attrgetter('_reliability'))
+    priority = property(attrgetter('_priority'))
+
+    @property
+    def buffer(self):
+        """符号化したバイト列"""
+        if self._buffer == None:
+            self._packet.encode()
+            logger.server.debug('H< {packet}', packet=self._packet)
+            self._buffer = self._packet.buffer()
+        return self._buffer
+
+    def is_large(self):
+        """Batch で圧縮して送信するならば True を返す"""
+        return len(self.buffer) >= both.Batch.THRESHOLD
+
+    def packet(self, priority):
+        """送信するパケット (大きなパケットは圧縮した Batch) を返す
+
+        バイト列は共有し、priority を channel に設定したパケットをつくる。
+        """
+        if self._batch == None:
+            self._batch = _batch_buffer(self.buffer)
+        pk = ApplicationPacket(self._batch)
+        pk.channel = priority
+        return pk
+
+
+class ChunkPacketCache:
+    """Chunk 毎に FullChunkData の SharedPacket を保持する
+
+    key (Chunk の version と BlockEntity の named_tag) が一致する間は
+    同じ SharedPacket を返すので、符号化と圧縮は Chunk の版毎に1度で済む。
+    保持するバイト数が max_size を超えたら、最も長く使われていないものから破棄する。
+
+    >>> cache = ChunkPacketCache(100)
+    >>> cache.put((0, 0), (1, ()), 'a', 60)
+    >>> cache.put((0, 1), (1, ()), 'b', 30)
+    >>> cache.get((0, 0), (1, ())), cache.get((0, 1), (2, ()))
+    ('a', None)
+    >>> len(cache), cache.size
+    (1, 60)
+    >>> cache.put((1, 0), (1, ()), 'c', 30)
+    >>> cache.put((1, 1), (1, ()), 'd', 50)
+    >>> cache.get((0, 0), (1, ())), cache.get((1, 0), (1, ()))
+    (None, 'c')
+    >>> len(cache), cache.size
+    (2, 80)
+    """
+
+    __slots__ = ['_entries', '_size', '_max_size']
+
+    def __init__(self, max_size):
+        # ChunkPosition -> (key, SharedPacket, バイト数) (使った順)
+        self._entries = OrderedDict()
+        self._size = 0
+        self._max_size = max_size
+
+    size = property(attrgetter('_size'))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, chunk_pos, key):
+        """key が一致する SharedPacket を返す (無ければ None)"""
+        entry = self._entries.get(chunk_pos)
+        if entry == None:
+            return None
+        if entry[0] != key:
+            # Chunk か BlockEntity が変更されている
+            self.discard(chunk_pos)
+            return None
+        self._entries.move_to_end(chunk_pos)
+        return entry[1]
+
+    def put(self, chunk_pos, key, packet, size):
+        """SharedPacket を保持する
+
+        size : packet が保持するバイト数の見積もり
+        """
+        self.discard(chunk_pos)
+        self._entries[chunk_pos] = (key, packet, size)
+        self._size += size
+        while self._size > self._max_size and len(self._entries) > 1:
+            _, (_, _, s) = self._entries.popitem(last=False)
+            self._size -= s
+
+    def discard(self, chunk_pos):
+        entry = self._entries.pop(chunk_pos, None)
+        if entry != None:
+            self._size -= entry[2]
+
+
+class SharedMotions:
+    """Entity の移動通知 (MoveEntity, SetEntityMotion) を共有する
+
+    受信者自身の Motion を除いたバイト列は、符号化せずに
+    符号化済みのバイト列から該当する要素を切り取って作る。
+    """
+
+    __slots__ = ['_motions', '_eids', '_move', '_velocity']
+
+    def __init__(self, motions):
+        self._motions = motions
+        self._eids = [m.eid for m in motions]
+        self._move = None
+        self._velocity = None
+
+    def _encode(self):
+        pk = send.MoveEntity()
+        pk.motions = self._motions
+        pk.encode()
+        logger.server.debug('H< {packet}', packet=pk)
+        self._move = pk.buffer()
+        pk = send.SetEntityMotion()
+        pk.motions = dict((eid, Vector(0, 0, 0)) for eid in self._eids)
+        pk.encode()
+        logger.server.debug('H< {packet}', packet=pk)
+        # SetEntityMotion の要素は eid の重複を除いた並びになる
+        self._velocity = (list(pk.motions.keys()), pk.buffer())
+
+    def buffers(self, own_eid):
+        """own_eid の Motion を除いたパケットのバイト列を返す"""
+        if self._move == None:
+            self._encode()
+        if own_eid not in self._eids:
+            return [self._move, self._velocity[1]]
+        if all(eid == own_eid for eid in self._eids):
+            return []
+        velocity_eids, velocity = self._velocity
+        return [
+            _exclude(
+                self._move, send.MoveEntity,
+                [i for i, eid in enumerate(self._eids) if eid == own_eid]),
+            _exclude(
+                velocity, send.SetEntityMotion,
+                [velocity_eids.index(own_eid)]),
+            ]
+
+
+def _exclude(buffer, packet_cls, indices):
+    """要素数と固定長の要素の並びだけを持つパケットから要素を取り除く
+
+    buffer : packet_cls を符号化したバイト列
+    indices : 取り除く要素の index (昇順)
+    """
+    array = packet_cls.fields[0]
+    count = array.count
+    size = array.type.size
+    header = 1 + count.size  # id + 要素数
+    num = (len(buffer) - header) // size - len(indices)
+    chunks = [buffer[:1], Endian.BIG.struct(count.fmt).pack(num)]
+    start = header
+    for i in indices:
+        chunks.append(buffer[start:header + i*size])
+        start = header + (i+1)*size
+    chunks.append(buffer[start:])
+    return b''.join(chunks)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
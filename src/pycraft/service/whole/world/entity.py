@@ -24,12 +24,12 @@ class EntityWorld:
         # MotionLaw
         self._motion_law = MotionLaw()
         # 最後に activate を実行した時間
-        self._last_activate_time = time.clock()
+        self._last_activate_time = time.monotonic()
     
     moved_entities = property(lambda self: self._moved_entities())
 
     def activate(self):
-        t = time.clock()
+        t = time.monotonic()
         if t - self._last_activate_time >= self.MOTION_NOTIFY_TICK:
             self._moved_entity.update(self._moved_entity_waiting)
             self._moved_entity_waiting.clear()
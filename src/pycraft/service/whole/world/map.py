@@ -44,10 +44,13 @@ class ChunkInfo:
     def remove_mob(self, eid):
         self._mob.discard(eid)
     
+    def has_player(self):
+        """Player の周囲の位置ならば True を返す"""
+        return len(self._scores) > 0
+
     def empty(self):
         """情報が空ならば True を返す"""
-        return not self.is_cached and \
-            len(self._scores) + len(self._animals) + len(self._monsters) == 0
+        return not self.is_cached and len(self._scores) + len(self._mob) == 0
 
 
 class GroupByScore:
@@ -145,6 +148,11 @@ class ChunkMap:
         info = self._info[pos.chunk_pos]
         return info.score if info.is_cached else 0
 
+    def is_required(self, chunk_pos):
+        """いずれかの Player の周囲にある ChunkPosition ならば True を返す"""
+        info = self._info.get(chunk_pos)
+        return info != None and info.has_player()
+
     def has_chunk(self, pos_iterable):
         """指定された位置に Chunk があるならば True を返す
         """
@@ -199,7 +207,8 @@ class ChunkMap:
             else:
                 self._group_by_score.append(chunk_pos, info.score)
         pos = self._entity_pos.pop(player.eid)
-        map(remove, (chunk_pos for _, chunk_pos in pos.surrounding_chunk()))
+        for _, chunk_pos in pos.surrounding_chunk():
+            remove(chunk_pos)
 
     def move_mob(self, entity):
         """Entity の移動を地図に反映する
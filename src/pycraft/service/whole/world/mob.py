@@ -30,7 +30,7 @@ class MobWorld:
             self, components,
             terrain, entity, player, hit_callback, lose_callback):
         self._listener = components.listener
-        self._random = Random(int(time.clock()))  # TODO: 時刻にする
+        self._random = Random(int(time.monotonic()))  # TODO: 時刻にする
         self._terrain = terrain
         self._entity = entity
         self._player = player
@@ -149,7 +149,7 @@ class MobWorld:
         self._append_dead_mob(mob.eid, 3)
     
     def _append_dead_mob(self, eid, wait_time):
-        t = time.clock() + wait_time
+        t = time.monotonic() + wait_time
         i = 0
         for i in range(len(self._dead_mobs)):
             if self._dead_mobs[i][0] < t:
@@ -160,7 +160,7 @@ class MobWorld:
     def _process_dead_mob(self):
         while len(self._dead_mobs) > 0:
             t, eid = self._dead_mobs.pop()
-            if time.clock() >= t:
+            if time.monotonic() >= t:
                 self._remove(eid)
             else:
                 value = (t, eid)
@@ -174,8 +174,11 @@ class MobWorld:
         self._listener.mob_removed(eid)
 
     def move(self):
-        if len(self._mobs) == 0:
-            return
+        # 全ての Mob を1回ずつ動かす (動作の間隔は MobEntity.tick で制限する)
+        for _ in range(len(self._mobs)):
+            self._move_next()
+
+    def _move_next(self):
         mob = self._mobs.pop(0)
         # Playerと遠く離れていたらデスポーンする
         if self._terrain.map.score(mob.pos) <= self._remove_score:
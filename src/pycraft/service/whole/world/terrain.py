@@ -1,7 +1,7 @@
 # -*- coding: utf8 -*-
 
 from pycraft.common import PriorityQueue
-from pycraft.service import config
+from pycraft.service import config, logger
 from pycraft.service.const import LevelEventID
 from pycraft.service.primitive.geometry import Face, Position
 from pycraft.service.primitive.values import BlockRecord
@@ -23,6 +23,7 @@ class Terrain:
     def __init__(self, components, chunk_map, seed):
         self.map = chunk_map
         self._is_over = components.scheduler.is_over
+        self._set_pending = components.scheduler.set_pending
         self._datastore = components.datastore
         self._listener = components.listener
         self._factory = ChunkFactory(Random(seed))
@@ -39,6 +40,8 @@ class Terrain:
             Position.CHUNK_AREA.CHUNK_NUM * config.max_player_num
         # task: ChunkPosition
         self._load_queue = PriorityQueue()
+        # 生成を依頼した ChunkPosition -> priority
+        self._generating = {}
         # 保存する順番でcacheのkeyを持つ
         self._store_queue = []
         # 更新されたChunk(ChunkPosition)
@@ -105,11 +108,16 @@ class Terrain:
         self._process_updated_block()
         self._update_block_entity()
         self._block_light.update()
+        self._update_generating()
+        is_loaded = False
         if not self._load_queue.empty(self.PRIORITY_THRESHOLD):
-            self._next_load()
+            is_loaded |= self._next_load()
         if not self._load_queue.empty() and \
                 not self._is_over(TaskID.UPDATE_TERRAIN):
-            self._next_load()
+            is_loaded |= self._next_load()
+        # 読み込みが進んでいるならば次のフレームを待たない
+        if is_loaded and not self._load_queue.empty():
+            self._set_pending()
 
     def store(self):
         if not self._is_over(TaskID.STORE_BLOCK_ENTITY):
@@ -117,10 +125,37 @@ class Terrain:
         if not self._is_over(TaskID.STORE_TERRAIN):
             self._store()
         
+    def _update_generating(self):
+        """生成された Chunk を読み込み待ちに戻し、不要になった生成を取り消す"""
+        for chunk_pos in self._factory.update():
+            priority = self._generating.pop(chunk_pos, None)
+            if priority != None:
+                self._load_queue.put(priority, chunk_pos)
+            else:
+                # 取り消す前に生成が始まっていた
+                self._factory.create(chunk_pos)
+        unnecessary = [
+            chunk_pos for chunk_pos in self._generating
+                if not self.map.is_required(chunk_pos)]
+        for chunk_pos in unnecessary:
+            del self._generating[chunk_pos]
+            self._factory.cancel(chunk_pos)
+        waiting, working = self._factory.queue_depth
+        if waiting + working > 0:
+            logger.server.debug(
+                'ChunkFactory has {waiting} waiting and {working} working.',
+                waiting=waiting, working=working)
+
     def _next_load(self):
+        """Chunkを1件読み込むか生成を依頼し、進んだならば True を返す"""
         priority, chunk_pos = self._load_queue.get()
-        if not self._load(chunk_pos):
-            self._load_queue.put(priority, chunk_pos)
+        if self._load(chunk_pos):
+            return True
+        if not self.map.is_required(chunk_pos):
+            return False
+        self._generating[chunk_pos] = priority
+        self._factory.request(chunk_pos, priority)
+        return True
 
     def _load(self, chunk_pos):
         """ChunkPositionのChunkを読み込む、もしくは生成する"""
@@ -137,7 +172,7 @@ class Terrain:
             # DataStoreを読み込む
             chunk = self._datastore.load_chunk(chunk_pos)
             if chunk == None:
-                # Chunkを生成する
+                # 生成された Chunk を受け取る
                 chunk = self._factory.create(chunk_pos)
                 if chunk == None:
                     return False
@@ -160,7 +195,13 @@ class Terrain:
 
     def load(self, chunk_place):
         """ChunkPlacementのChunkを読み込む、もしくは生成する"""
-        self._load_queue.put(*chunk_place)
+        priority, chunk_pos = chunk_place
+        if chunk_pos in self._generating:
+            # 生成を待っている Chunk は優先度を変更する
+            self._generating[chunk_pos] = priority
+            self._factory.request(chunk_pos, priority)
+        else:
+            self._load_queue.put(priority, chunk_pos)
 
     def _store(self):
         """地形データを1件保存する"""
@@ -0,0 +1,144 @@
+# -*- coding: utf8 -*-
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+from operator import attrgetter
+from pycraft import network, service
+
+
+_SERVER_ADDR = ('127.0.0.1', 19132)
+_SERVER_TIMEOUT = 60  # sec (サーバーの起動、終了を待つ時間)
+_PERCENTILES = (50, 90, 99)
+
+
+def percentile(values, p):
+    """整列済みの values の p パーセンタイルを返す
+
+    >>> percentile([1, 2, 3, 4], 50), percentile([1, 2, 3, 4], 99)
+    (2, 4)
+    """
+    if len(values) == 0:
+        return 0
+    return values[max(0, -(-len(values) * p // 100) - 1)]
+
+
+def summary_line(name, values, unit=1000, unit_name='ms'):
+    """計測値のパーセンタイルと最大値を表示する行を返す
+
+    >>> summary_line('rtt', [0.001, 0.003, 0.002])
+    'rtt                3 samples p50 2.00 ms p90 3.00 ms p99 3.00 ms max 3.00 ms'
+    """
+    values = sorted(values)
+    return '{0:<10}{1:>10} samples {2} max {3:.2f} {4}'.format(
+        name, len(values),
+        ' '.join('p{0} {1:.2f} {2}'.format(
+            p, percentile(values, p) * unit, unit_name)
+                for p in _PERCENTILES),
+        (values[-1] if len(values) > 0 else 0) * unit, unit_name)
+
+
+class TimedServer(network.Server):
+    """_process の処理時間を記録する Server"""
+
+    def __init__(self, server_addr, handler):
+        super().__init__(server_addr, handler)
+        self.process_times = []
+
+    def _process(self):
+        t = time.perf_counter()
+        super()._process()
+        self.process_times.append(time.perf_counter() - t)
+
+
+def _run_server(server_addr, config, started, stopped, conn):
+    """空の世界で TimedServer を動かし、終了したら計測値を conn に送る"""
+    root = tempfile.mkdtemp()
+    try:
+        database = os.path.join(root, 'world.db')
+        store = service.DataStore(database)
+        store.start()
+        store.create_table()
+        store.terminate()
+        # Config は属性で値を持つので update ではなく属性に設定する
+        for name, value in config.items():
+            setattr(service.config, name, value)
+        handler = service.Handler(
+            service.DataStore(database), service.Clock())
+        server = TimedServer(server_addr, handler)
+        def terminate():
+            stopped.wait()
+            server.terminate()
+        threading.Thread(target=terminate, daemon=True).start()
+        server.run(started.set)
+        conn.send((handler.scheduler.frame_time, server.process_times))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+class BenchmarkServer:
+    """空の世界の TimedServer を別プロセスで動かす
+
+    with の間サーバーを動かし、終了後に処理時間を参照できる。
+    計測する度に同じ結果になるように、既定では Mob を出現させず、
+    Scratch を探すのは自ホストだけにする。
+    """
+
+    def __init__(self, server_addr=_SERVER_ADDR, **config):
+        self._server_addr = server_addr
+        self._config = dict(
+            spawn_mob=False, scratch_network='127.0.0.1/32')
+        self._config.update(config)
+        self._process = None
+        self._stopped = None
+        self._conn = None
+        self._frame_time = 0
+        self._process_times = []
+
+    addr = property(attrgetter('_server_addr'))
+    frame_time = property(attrgetter('_frame_time'))
+    process_times = property(attrgetter('_process_times'))
+
+    def start(self):
+        started = multiprocessing.Event()
+        self._stopped = multiprocessing.Event()
+        self._conn, send_conn = multiprocessing.Pipe(False)
+        self._process = multiprocessing.Process(
+            target=_run_server,
+            args=(self._server_addr, self._config,
+                started, self._stopped, send_conn))
+        self._process.start()
+        # サーバーが異常終了したら recv で EOFError になるように閉じる
+        send_conn.close()
+        if not started.wait(_SERVER_TIMEOUT):
+            self.terminate()
+            raise RuntimeError('server did not start')
+
+    def terminate(self):
+        if self._process == None:
+            return
+        self._stopped.set()
+        try:
+            if self._conn.poll(_SERVER_TIMEOUT):
+                self._frame_time, self._process_times = self._conn.recv()
+        except EOFError:
+            pass
+        self._process.join(_SERVER_TIMEOUT)
+        self._process = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        self.terminate()
+
+    def report(self):
+        """処理時間と、フレームの時間を超えた回数を表示する行を返す"""
+        overruns = sum(1 for t in self._process_times if t > self._frame_time)
+        yield summary_line('tick', self._process_times)
+        yield '{0:<10}{1:>10} ticks over {2:.1f} ms'.format(
+            'overrun', overruns, self._frame_time * 1000)
@@ -0,0 +1,309 @@
+# -*- coding: utf8 -*-
+
+import heapq
+import io
+import mmap
+import os
+import selectors
+import socket
+import struct
+import time
+from operator import attrgetter
+from pycraft.network import capture, protocol
+from pycraft.network.packet import ID, ctrl
+from pycraft.network.packet.data import DataPacket
+from pycraft.network.packet.data import EncapsulatedPacket as EncapPacket
+from pycraft.service.whole.handler.packet import ID as ServiceID
+from .benchmark import BenchmarkServer, summary_line
+
+
+_SERVER_ADDR = ('127.0.0.1', 19132)
+_START_INTERVAL = 0.05  # sec (複製したクライアントが接続を始める間隔)
+_DRAIN_TIME = 2.0  # sec (送信し終えてから ACK を待つ時間)
+_RECV_BUFFER_SIZE = 65536  # bytes
+_CLIENT_ID_SHIFT = 40  # bits (複製の番号を client_id に加える位置)
+
+_LONG = struct.Struct('!Q')
+_SHORT = struct.Struct('!H')
+
+
+def load_sessions(path):
+    """capture からクライアントが送信した datagram を Session 毎に読み出す
+
+    接続要求 (OpenConnectionRequest1) より前の記録と、
+    元のサーバーの送信に対する ACK, NACK は除く。
+    接続要求が記録されていない Session は返さない。
+    返り値 : list(list((Session の開始からの時刻, bytes))) (開始の順)
+    """
+    with io.open(path, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        index = capture.index_records(buf)
+        sessions = []
+        for offsets in sorted(index.values(), key=lambda o: o[0]):
+            records = []
+            start = None
+            for offset in offsets:
+                t, _, direction, view = capture.read_record(buf, offset)
+                with view:
+                    buffer = bytes(view)
+                if direction != capture.RECV or len(buffer) == 0:
+                    continue
+                if buffer[0] == ID.OPEN_CONNECTION_REQUEST_1 and start == None:
+                    start = t
+                if start == None or buffer[0] in (ID.ACK, ID.NACK):
+                    continue
+                records.append((t - start, buffer))
+            if len(records) > 0:
+                sessions.append(records)
+        return sessions
+
+
+def rewrite(buffer, n):
+    """n 番目の複製のクライアントが送信する datagram に書き換える
+
+    OpenConnectionRequest2, ClientConnect, Login の client_id と
+    Login の user_name を書き換える (0 番目は書き換えない)。
+    分割された Login は先頭の断片を書き換えるので、
+    user_name は長さを変えずに末尾を n にする。
+
+    >>> from pycraft.common import ByteBuffer
+    >>> b = ByteBuffer()
+    >>> b.put_byte(ServiceID.LOGIN)
+    >>> b.put_str('steve')
+    >>> b.put_int(38)
+    >>> b.put_int(38)
+    >>> b.put_long(1001)
+    >>> pk = protocol.net.packet(bytes([ID.DATA_PACKET_4, 7, 0, 0]))
+    >>> pk.decode()
+    >>> pk.packets = [EncapPacket(
+    ...     3, b.bytes(), message=EncapPacket.Message(0),
+    ...     order=EncapPacket.Order(0, 0))]
+    >>> pk.encode()
+    >>> pk = protocol.net.packet(rewrite(pk.buffer(), 12))
+    >>> pk.decode()
+    >>> pk.seq_num, pk.packets[0].buffer[1:8]
+    (7, b'\\x00\\x05ste12')
+    >>> _LONG.unpack_from(pk.packets[0].buffer, 16)[0] == 1001 + (12 << 40)
+    True
+    """
+    if n == 0:
+        return buffer
+    if buffer[0] == ID.OPEN_CONNECTION_REQUEST_2:
+        return buffer[:-8] + _client_id(buffer[-8:], n)
+    packet = protocol.net.packet(buffer)
+    if not isinstance(packet, DataPacket):
+        return buffer
+    packet.decode()
+    packets = [_rewrite_encapsulated(pk, n) for pk in packet.packets]
+    if all(a is b for a, b in zip(packets, packet.packets)):
+        return buffer
+    packet.packets = packets
+    packet.encode()
+    return packet.buffer()
+
+
+def _rewrite_encapsulated(packet, n):
+    if packet.split != None and packet.split.index != 0:
+        return packet
+    buffer = packet.buffer
+    if buffer[0] == ID.CLIENT_CONNECT:
+        buffer = buffer[:1] + _client_id(buffer[1:9], n) + buffer[9:]
+    elif buffer[0] == ServiceID.LOGIN:
+        name_end = 3 + _SHORT.unpack_from(buffer, 1)[0]
+        pos = name_end + 8  # protocol1, protocol2
+        buffer = buffer[:3] + _rename(buffer[3:name_end], n) \
+            + buffer[name_end:pos] + _client_id(buffer[pos:pos+8], n) \
+            + buffer[pos+8:]
+    else:
+        return packet
+    return EncapPacket(
+        packet.reliability, buffer,
+        message=packet.message, order=packet.order, split=packet.split)
+
+
+def _client_id(buffer, n):
+    client_id = _LONG.unpack(buffer)[0] + (n << _CLIENT_ID_SHIFT)
+    return _LONG.pack(client_id % (1 << 64))
+
+
+def _rename(name, n):
+    suffix = str(n).encode()
+    if len(suffix) > len(name) or not name.isascii():
+        return name
+    return name[:len(name)-len(suffix)] + suffix
+
+
+class ReplayStats:
+    """再生中にクライアントで計測した値"""
+
+    def __init__(self):
+        self.duration = 0
+        self.sent = [0, 0]  # [datagram 数, バイト数]
+        self.received = [0, 0]  # [datagram 数, バイト数]
+        # 送信した DataPacket に ACK が返るまでの時間 (sec)
+        self.latencies = []
+
+    def report(self):
+        """計測結果を表示する行を返す"""
+        duration = max(self.duration, 1e-9)
+        yield 'duration: {0:.2f} sec'.format(self.duration)
+        for name, (n, size) in (
+                ('sent', self.sent), ('received', self.received)):
+            yield '{0:<10}{1:>10} datagrams {2:>10.1f} /s {3:>10.1f} KB/s' \
+                .format(name, n, n / duration, size / duration / 1024)
+        yield summary_line('ack', self.latencies)
+
+
+class ReplayClient:
+    """capture の1つの Session を n 番目の複製として送信するクライアント
+
+    自分のソケット (addr) から記録の時刻を speed 倍速にして送信する。
+    サーバーの応答は待たず、受信した DataPacket にだけ ACK を返す。
+    """
+
+    def __init__(self, server_addr, records, n, start_time, speed, stats):
+        self._server_addr = server_addr
+        self._records = records
+        self._n = n
+        self._start_time = start_time
+        self._speed = speed
+        self._stats = stats
+        self._index = 0
+        # 送信した DataPacket の seq_num -> 送信時刻
+        self._send_times = {}
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind(('127.0.0.1', 0))
+        self._sock.setblocking(False)
+
+    sock = property(attrgetter('_sock'))
+
+    def next_time(self):
+        """次の記録を送信する時刻 (送信し終えていたら None) を返す"""
+        if self._index == len(self._records):
+            return None
+        return self._start_time + self._records[self._index][0] / self._speed
+
+    def send_next(self, now):
+        buffer = rewrite(self._records[self._index][1], self._n)
+        self._index += 1
+        if ID.DATA_PACKET_0 <= buffer[0] <= ID.DATA_PACKET_F:
+            seq_num = int.from_bytes(buffer[1:4], 'little')
+            self._send_times.setdefault(seq_num, now)
+        self._sock.sendto(buffer, self._server_addr)
+        self._stats.sent[0] += 1
+        self._stats.sent[1] += len(buffer)
+
+    def receive(self, now):
+        """受信した datagram を処理し、DataPacket には ACK を返す"""
+        seq_nums = []
+        while True:
+            try:
+                buffer = self._sock.recv(_RECV_BUFFER_SIZE)
+            except (BlockingIOError, InterruptedError):
+                break
+            self._stats.received[0] += 1
+            self._stats.received[1] += len(buffer)
+            if ID.DATA_PACKET_0 <= buffer[0] <= ID.DATA_PACKET_F:
+                seq_nums.append(int.from_bytes(buffer[1:4], 'little'))
+            elif buffer[0] == ID.ACK:
+                ack = ctrl.Ack(buffer)
+                ack.decode()
+                for seq_num in ack.seq_nums:
+                    t = self._send_times.pop(seq_num, None)
+                    if t != None:
+                        self._stats.latencies.append(now - t)
+        if len(seq_nums) > 0:
+            ack = ctrl.Ack()
+            ack.seq_nums = seq_nums
+            ack.encode()
+            self._sock.sendto(ack.buffer(), self._server_addr)
+
+    def close(self):
+        self._sock.close()
+
+
+class ReplayDriver:
+    """capture の Session を num_of_clients 個のクライアントに複製して再生する
+
+    i 番目のクライアントは (i % Session 数) 番目の Session を
+    (i // Session 数) 番目の複製として、i * _START_INTERVAL 秒後から送信する。
+    """
+
+    def __init__(
+            self, sessions, server_addr=_SERVER_ADDR,
+            num_of_clients=None, speed=1.0):
+        self._sessions = sessions
+        self._server_addr = server_addr
+        self._num_of_clients = len(sessions) \
+            if num_of_clients == None else num_of_clients
+        self._speed = speed
+
+    def run(self):
+        stats = ReplayStats()
+        selector = selectors.DefaultSelector()
+        start = time.monotonic()
+        clients = []
+        for i in range(self._num_of_clients):
+            n, k = divmod(i, len(self._sessions))
+            c = ReplayClient(
+                self._server_addr, self._sessions[k], n,
+                start + i * _START_INTERVAL / self._speed, self._speed, stats)
+            selector.register(c.sock, selectors.EVENT_READ, c)
+            clients.append(c)
+        # (送信時刻, クライアントの番号)
+        schedule = [(c.next_time(), i) for i, c in enumerate(clients)]
+        heapq.heapify(schedule)
+        end = None
+        try:
+            while True:
+                now = time.monotonic()
+                while len(schedule) > 0 and schedule[0][0] <= now:
+                    _, i = heapq.heappop(schedule)
+                    clients[i].send_next(now)
+                    t = clients[i].next_time()
+                    if t != None:
+                        heapq.heappush(schedule, (t, i))
+                if len(schedule) > 0:
+                    timeout = schedule[0][0] - now
+                else:
+                    if end == None:
+                        end = now + _DRAIN_TIME
+                    if now >= end:
+                        break
+                    timeout = end - now
+                for key, _ in selector.select(timeout):
+                    key.data.receive(time.monotonic())
+        finally:
+            for c in clients:
+                selector.unregister(c.sock)
+                c.close()
+        stats.duration = time.monotonic() - start
+        return stats
+
+
+def benchmark(path, num_of_clients=None, speed=1.0, server_addr=_SERVER_ADDR):
+    """別プロセスで起動したサーバーに capture を再生して計測する"""
+    sessions = load_sessions(path)
+    if len(sessions) == 0:
+        raise ValueError('no session to replay in ' + path)
+    with BenchmarkServer(server_addr) as server:
+        stats = ReplayDriver(
+            sessions, server_addr, num_of_clients, speed).run()
+    return stats, server
+
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) <= 1:
+        print('Usage: {0} capture_file [num_of_clients] [speed] [port]'.format(
+            os.path.basename(sys.argv[0])))
+    else:
+        num_of_clients = int(sys.argv[2]) if len(sys.argv) > 2 else None
+        speed = float(sys.argv[3]) if len(sys.argv) > 3 else 1.0
+        port = int(sys.argv[4]) if len(sys.argv) > 4 else _SERVER_ADDR[1]
+        stats, server = benchmark(
+            sys.argv[1], num_of_clients, speed, (_SERVER_ADDR[0], port))
+        for line in stats.report():
+            print(line)
+        for line in server.report():
+            print(line)
@@ -0,0 +1,489 @@
+# -*- coding: utf8 -*-
+
+import math
+import random
+import selectors
+import socket
+import time
+from collections import Counter
+from operator import attrgetter
+from pycraft.common import ByteBuffer
+from pycraft.network import protocol
+from pycraft.network.container import SplitPacketContainer
+from pycraft.network.packet import ID, appl, ctrl
+from pycraft.network.packet.data import DataPacket4
+from pycraft.network.packet.data import EncapsulatedPacket as EncapPacket
+from pycraft.service.const import ContainerWindowID
+from pycraft.service.composite.chunk import Chunk
+from pycraft.service.part.item import ItemID, new_item
+from pycraft.service.primitive.geometry import ChunkPosition, Position
+from pycraft.service.primitive.values import Motion
+from pycraft.service.whole.handler import protocol as service_protocol
+from pycraft.service.whole.handler.packet import ID as ServiceID
+from pycraft.service.whole.handler.packet import both, recv, send
+from .benchmark import BenchmarkServer, summary_line
+
+
+_SERVER_ADDR = ('127.0.0.1', 19132)
+_NUM_OF_BOTS = 20
+_DURATION = 60  # sec (全ての Bot がログインを始めてから計測する時間)
+_LOGIN_INTERVAL = 0.05  # sec (Bot がログインを始める間隔)
+_CONNECT_INTERVAL = 1.0  # sec (接続要求に応答がなければ再送する間隔)
+_TICK = 0.1  # sec (Bot が移動する間隔)
+_WALK_SPEED = 4.3  # blocks/sec
+_WALK_RANGE = 64  # blocks (スポーン地点から歩き回る範囲)
+_ACTION_INTERVAL = 2.0  # sec (ブロックを操作する平均間隔)
+_PING_INTERVAL = 1.0  # sec
+_MTU_SIZE = 1464  # bytes
+_RECV_BUFFER_SIZE = 65536  # bytes
+_CLIENT_ID_BASE = 0x426f7400000000  # Bot の client_id は番号を加える
+
+_MAGIC = b'\x00\xff\xff\x00\xfe\xfe\xfe\xfe\xfd\xfd\xfd\xfd\x12\x34\x56\x78'
+_RELIABLE_ORDERED = 3
+_FACE_TOP = 1
+_FEET_TO_EYE = 1.62
+_HEIGHT_MAP = slice(
+    Chunk.OFFSET_HEIGHT_MAP, Chunk.OFFSET_HEIGHT_MAP + Chunk.LEN_HEIGHT_MAP)
+
+# 順に繰り返すブロックの操作
+_ACTIONS = ('place', 'break', 'place_chest', 'open_chest', 'break_chest')
+
+
+class SwarmStats:
+    """Bot が計測した値"""
+
+    def __init__(self):
+        self.duration = 0
+        self.sent = [0, 0]  # [datagram 数, バイト数]
+        self.received = [0, 0]  # [datagram 数, バイト数]
+        # 接続要求から PLAYER_SPAWN を受信するまでの時間 (sec)
+        self.spawn_times = []
+        # Ping を送信してから Pong を受信するまでの時間 (sec)
+        self.rtts = []
+        # Chunk が必要になってから FullChunkData を受信するまでの時間 (sec)
+        self.chunk_delays = []
+        # 必要になったが受信していない Chunk の数 (終了時)
+        self.pending_chunks = 0
+        # 送信した操作と受信したパケットの数
+        self.actions = Counter()
+
+    def report(self, num_of_bots):
+        """計測結果を表示する行を返す"""
+        duration = max(self.duration, 1e-9)
+        yield 'duration: {0:.2f} sec bots: {1} spawned: {2}'.format(
+            self.duration, num_of_bots, len(self.spawn_times))
+        for name, (n, size) in (
+                ('sent', self.sent), ('received', self.received)):
+            yield '{0:<10}{1:>10} datagrams {2:>10.1f} /s {3:>10.1f} KB/s' \
+                .format(name, n, n / duration, size / duration / 1024)
+        yield summary_line('spawn', self.spawn_times)
+        yield summary_line('rtt', self.rtts)
+        yield summary_line('chunk', self.chunk_delays)
+        yield '{0:<10}{1:>10} chunks'.format('pending', self.pending_chunks)
+        for name, n in sorted(self.actions.items()):
+            yield '{0:<20}{1:>10} times'.format(name, n)
+
+
+class Bot:
+    """ログインして歩き回り、ブロックとチェストを操作する軽量なクライアント
+
+    スポーン地点の周辺を無作為に選んだ地点へ歩き (Chunk の境界を越える)、
+    一定の間隔で _ACTIONS の操作を順に行う。
+    地面の高さは受信した Chunk の height map から求め、
+    Chunk が届いていない場所には進まない。
+    """
+
+    def __init__(self, server_addr, n, start_time, stats):
+        self._server_addr = server_addr
+        self._client_id = _CLIENT_ID_BASE + n
+        self._name = 'bot{0}'.format(n)
+        self._stats = stats
+        self._random = random.Random(n)
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind(('127.0.0.1', 0))
+        self._sock.setblocking(False)
+        self._seq_num = 0
+        self._message_index = 0
+        self._order_index = 0
+        # ACK を待っている DataPacket (seq_num -> bytes)
+        self._unacked = {}
+        self._split_packets = SplitPacketContainer()
+        self._start_time = start_time
+        self._is_connected = False
+        self._next_connect_time = start_time
+        self._eid = None
+        self._pos = None
+        self._spawn_pos = None
+        self._is_spawned = False
+        self._target = None
+        # ChunkPosition -> height map (受信した Chunk)
+        self._heights = {}
+        # ChunkPosition -> 必要になった時刻 (受信していない Chunk)
+        self._pending_chunks = {}
+        self._next_ping_time = 0
+        # ping_id -> 送信した時刻
+        self._pings = {}
+        self._next_ping_id = 0
+        self._next_action_time = 0
+        self._action_index = 0
+        self._held_item = new_item(ItemID.AIR, 0)
+        # 最後に設置したブロックの位置
+        self._placed_pos = None
+
+    sock = property(attrgetter('_sock'))
+    pending_chunks = property(lambda self: len(self._pending_chunks))
+
+    def update(self, now):
+        if now < self._start_time:
+            return
+        if not self._is_connected:
+            if now >= self._next_connect_time:
+                self._next_connect_time = now + _CONNECT_INTERVAL
+                self._send_connection_request()
+            return
+        if not self._is_spawned:
+            return
+        if now >= self._next_ping_time:
+            self._next_ping_time = now + _PING_INTERVAL
+            self._ping(now)
+        self._walk(now)
+        if now >= self._next_action_time:
+            self._next_action_time = now + self._random.uniform(
+                0.5 * _ACTION_INTERVAL, 1.5 * _ACTION_INTERVAL)
+            self._act()
+
+    def close(self):
+        self._sock.close()
+
+    # 送信
+
+    def _sendto(self, buffer):
+        self._sock.sendto(buffer, self._server_addr)
+        self._stats.sent[0] += 1
+        self._stats.sent[1] += len(buffer)
+
+    def _send_connection_request(self):
+        # OpenConnectionRequest1 (datagram の大きさで MTU を伝える)
+        self._sendto(
+            bytes([ID.OPEN_CONNECTION_REQUEST_1]) + _MAGIC + b'\x06'
+            + bytes(_MTU_SIZE - 18 - len(_MAGIC)))
+
+    def _send_connection_request2(self):
+        buf = ByteBuffer()
+        buf.put_byte(ID.OPEN_CONNECTION_REQUEST_2)
+        buf.put(_MAGIC)
+        buf.put_addr(self._server_addr)
+        buf.put_short(_MTU_SIZE)
+        buf.put_long(self._client_id)
+        self._sendto(buf.bytes())
+
+    def _send_application(self, buffer):
+        pk = DataPacket4()
+        pk.seq_num = self._seq_num
+        pk.packets = [EncapPacket(
+            _RELIABLE_ORDERED, buffer,
+            message=EncapPacket.Message(self._message_index),
+            order=EncapPacket.Order(self._order_index, 0))]
+        pk.encode()
+        self._unacked[self._seq_num] = pk.buffer()
+        self._seq_num += 1
+        self._message_index += 1
+        self._order_index += 1
+        self._sendto(pk.buffer())
+
+    def _send_packet(self, packet):
+        packet.encode()
+        self._send_application(packet.buffer())
+
+    def _send_login(self):
+        buf = ByteBuffer()
+        buf.put_byte(ID.CLIENT_HANDSHAKE)
+        buf.put_addr(self._server_addr)
+        for _ in range(10):
+            buf.put_addr(('0.0.0.0', 0))
+        buf.put_long(0)
+        buf.put_long(0)
+        self._send_application(buf.bytes())
+        pk = recv.Login()
+        pk.user_name = self._name
+        pk.protocol1 = service_protocol.default.protocol_version
+        pk.protocol2 = service_protocol.default.protocol_version
+        pk.client_id = self._client_id
+        pk.public_id = self._client_id.to_bytes(16, 'big')
+        pk.server = '{0}:{1}'.format(*self._server_addr)
+        pk.unknown = b''
+        pk.skin_name = 'Standard_Steve'
+        pk.skin = b''
+        self._send_packet(pk)
+
+    def _ping(self, now):
+        pk = appl.Ping()
+        pk.ping_id = self._next_ping_id
+        self._pings[pk.ping_id] = now
+        self._next_ping_id += 1
+        self._send_packet(pk)
+
+    # 行動
+
+    def _ground(self, x, z):
+        """x, z の地面の上の高さを返す (Chunk を受信していなければ None)"""
+        x, z = int(x), int(z)
+        heights = self._heights.get(ChunkPosition(x >> 4, z >> 4))
+        if heights == None:
+            return None
+        return heights[((z & 0x0F) << 4) | (x & 0x0F)] + 1
+
+    def _walk(self, now):
+        pos = self._pos
+        if self._target == None \
+                or math.hypot(self._target.x - pos.x, self._target.z - pos.z) < 1:
+            self._target = self._spawn_pos + (
+                self._random.uniform(-_WALK_RANGE, _WALK_RANGE),
+                self._random.uniform(-_WALK_RANGE, _WALK_RANGE), 0)
+        dx, dz = self._target.x - pos.x, self._target.z - pos.z
+        d = math.hypot(dx, dz)
+        step = min(d, _WALK_SPEED * _TICK)
+        x, z = pos.x + dx / d * step, pos.z + dz / d * step
+        y = self._ground(x, z)
+        if y == None:
+            self._stats.actions['stall'] += 1
+            return
+        pk = both.MovePlayer()
+        pk.motion = Motion(
+            self._eid, Position(x, z, y + _FEET_TO_EYE),
+            math.degrees(math.atan2(-dx, dz)) % 360, 0.0, 0.0)
+        pk.mode = pk.MODE_NORMAL
+        pk.on_ground = True
+        self._send_packet(pk)
+        self._move(pk.motion.pos, now)
+
+    def _move(self, pos, now):
+        prev = self._pos
+        self._pos = pos
+        if prev != None and prev.chunk_pos == pos.chunk_pos:
+            return
+        # Chunk を移動したら、サーバーと同じように必要な Chunk を求める
+        required = set(p.chunk_pos for p in pos.surrounding_chunk())
+        for chunk_pos in list(self._heights):
+            if chunk_pos not in required:
+                del self._heights[chunk_pos]
+        for chunk_pos in list(self._pending_chunks):
+            if chunk_pos not in required:
+                del self._pending_chunks[chunk_pos]
+        for chunk_pos in required:
+            if chunk_pos not in self._heights:
+                self._pending_chunks.setdefault(chunk_pos, now)
+
+    def _act(self):
+        action = _ACTIONS[self._action_index % len(_ACTIONS)]
+        self._action_index += 1
+        if action in ('place', 'place_chest'):
+            x, z = int(self._pos.x) + 1, int(self._pos.z)
+            y = self._ground(x, z)
+            if y == None or y >= Position.Y_RANGE - 1:
+                return
+            item_id = ItemID.DIRT if action == 'place' else ItemID.CHEST
+            self._equip(new_item(item_id, 64))
+            self._use_item(Position(x, z, y - 1))
+            self._placed_pos = Position(x, z, y)
+        elif self._placed_pos == None:
+            return
+        elif action == 'open_chest':
+            self._use_item(self._placed_pos)
+        else:
+            pk = recv.RemoveBlock()
+            pk.eid = self._eid
+            pk.pos = self._placed_pos
+            self._send_packet(pk)
+            self._placed_pos = None
+        self._stats.actions[action] += 1
+
+    def _equip(self, item):
+        """インベントリの先頭に item を入れて手に持つ"""
+        pk = both.ContainerSetSlot()
+        pk.window_id = ContainerWindowID.INVENTORY
+        pk.slot = 0
+        pk.item = item
+        self._send_packet(pk)
+        pk = both.PlayerEquipment()
+        pk.eid = self._eid
+        pk.item = item
+        pk.slot = 9  # NUM_OF_HOTBAR + inventory slots の index
+        pk.held_hotbar = 0
+        self._send_packet(pk)
+        self._held_item = item
+
+    def _use_item(self, bpos):
+        """bpos のブロックの上面に手に持っているアイテムを使う"""
+        pk = recv.UseItem()
+        pk.bpos = bpos
+        pk.face = _FACE_TOP
+        pk.f = Position(0.5, 0.5, 1.0)
+        pk.pos = self._pos
+        pk.item = self._held_item
+        self._send_packet(pk)
+
+    # 受信
+
+    def receive(self, now):
+        """受信した datagram を処理し、DataPacket には ACK を返す"""
+        seq_nums = []
+        while True:
+            try:
+                buffer = self._sock.recv(_RECV_BUFFER_SIZE)
+            except (BlockingIOError, InterruptedError):
+                break
+            self._stats.received[0] += 1
+            self._stats.received[1] += len(buffer)
+            packet = protocol.net.packet(buffer)
+            if packet.id == ID.OPEN_CONNECTION_REPLY_1:
+                self._send_connection_request2()
+            elif packet.id == ID.OPEN_CONNECTION_REPLY_2:
+                self._is_connected = True
+                buf = ByteBuffer()
+                buf.put_byte(ID.CLIENT_CONNECT)
+                buf.put_long(self._client_id)
+                buf.put_long(0)
+                buf.put_byte(0)
+                self._send_application(buf.bytes())
+            elif packet.id == ID.ACK:
+                packet.decode()
+                for seq_num in packet.seq_nums:
+                    self._unacked.pop(seq_num, None)
+            elif packet.id == ID.NACK:
+                packet.decode()
+                for seq_num in packet.seq_nums:
+                    if seq_num in self._unacked:
+                        self._sendto(self._unacked[seq_num])
+            elif ID.DATA_PACKET_0 <= packet.id <= ID.DATA_PACKET_F:
+                packet.decode()
+                seq_nums.append(packet.seq_num)
+                for pk in packet.packets:
+                    if pk.split:
+                        pk = self._split_packets.concat(pk)
+                        if pk == None:
+                            continue
+                    self._handle_application(pk.buffer, now)
+        if len(seq_nums) > 0:
+            ack = ctrl.Ack()
+            ack.seq_nums = seq_nums
+            ack.encode()
+            self._sendto(ack.buffer())
+
+    def _handle_application(self, buffer, now):
+        packet_id = buffer[0]
+        if packet_id == ID.SERVER_HANDSHAKE:
+            self._send_login()
+        elif packet_id == ID.PING:
+            pk = appl.Ping(buffer)
+            pk.decode()
+            pong = appl.Pong()
+            pong.recv_ping_id = pk.ping_id
+            pong.send_ping_id = pk.ping_id
+            self._send_packet(pong)
+        elif packet_id == ID.PONG:
+            pk = appl.Pong(buffer)
+            pk.decode()
+            t = self._pings.pop(pk.recv_ping_id, None)
+            if t != None:
+                self._stats.rtts.append(now - t)
+        elif packet_id == ServiceID.BATCH:
+            pk = both.Batch(buffer)
+            pk.decode()
+            for payload in pk.payloads:
+                self._handle_application(payload, now)
+        else:
+            self._handle_service(packet_id, buffer, now)
+
+    def _handle_service(self, packet_id, buffer, now):
+        if packet_id == ServiceID.START_GAME:
+            pk = send.StartGame(buffer)
+            pk.decode()
+            self._eid = pk.eid
+            self._spawn_pos = pk.pos
+            self._move(pk.pos, self._start_time)
+        elif packet_id == ServiceID.PLAY_STATUS:
+            pk = send.PlayStatus(buffer)
+            pk.decode()
+            if pk.status == pk.PLAYER_SPAWN and not self._is_spawned:
+                self._is_spawned = True
+                self._stats.spawn_times.append(now - self._start_time)
+        elif packet_id == ServiceID.MOVE_PLAYER:
+            pk = both.MovePlayer(buffer)
+            pk.decode()
+            if pk.motion.eid == self._eid:
+                self._target = None
+                self._move(pk.motion.pos, now)
+        elif packet_id == ServiceID.FULL_CHUNK_DATA:
+            pk = send.FullChunkData(buffer)
+            pk.decode()
+            self._heights[pk.pos] = pk.chunk_data[_HEIGHT_MAP]
+            t = self._pending_chunks.pop(pk.pos, None)
+            if t != None:
+                self._stats.chunk_delays.append(now - t)
+        elif packet_id == ServiceID.CONTAINER_OPEN:
+            pk = send.ContainerOpen(buffer)
+            pk.decode()
+            self._stats.actions['container_open'] += 1
+            close = both.ContainerClose()
+            close.window_id = pk.window_id
+            self._send_packet(close)
+
+
+class BotSwarm:
+    """num_of_bots 個の Bot を1つのプロセスで動かす
+
+    i 番目の Bot は i * _LOGIN_INTERVAL 秒後にログインを始め、
+    全ての Bot がログインを始めてから duration 秒後に終了する。
+    """
+
+    def __init__(
+            self, server_addr=_SERVER_ADDR, num_of_bots=_NUM_OF_BOTS,
+            duration=_DURATION):
+        self._server_addr = server_addr
+        self._num_of_bots = num_of_bots
+        self._duration = duration
+
+    def run(self):
+        stats = SwarmStats()
+        selector = selectors.DefaultSelector()
+        start = time.monotonic()
+        bots = [
+            Bot(self._server_addr, i, start + i * _LOGIN_INTERVAL, stats)
+                for i in range(self._num_of_bots)]
+        for bot in bots:
+            selector.register(bot.sock, selectors.EVENT_READ, bot)
+        end = start + self._num_of_bots * _LOGIN_INTERVAL + self._duration
+        next_tick = start
+        try:
+            while True:
+                now = time.monotonic()
+                if now >= end:
+                    break
+                if now >= next_tick:
+                    next_tick = max(next_tick + _TICK, now)
+                    for bot in bots:
+                        bot.update(now)
+                for key, _ in selector.select(max(0, next_tick - now)):
+                    key.data.receive(time.monotonic())
+        finally:
+            for bot in bots:
+                stats.pending_chunks += bot.pending_chunks
+                selector.unregister(bot.sock)
+                bot.close()
+        stats.duration = time.monotonic() - start
+        return stats
+
+
+if __name__ == '__main__':
+    import sys
+    num_of_bots = int(sys.argv[1]) if len(sys.argv) > 1 else _NUM_OF_BOTS
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else _DURATION
+    port = int(sys.argv[3]) if len(sys.argv) > 3 else _SERVER_ADDR[1]
+    server_addr = (_SERVER_ADDR[0], port)
+    with BenchmarkServer(server_addr) as server:
+        stats = BotSwarm(server_addr, num_of_bots, duration).run()
+    for line in stats.report(num_of_bots):
+        print(line)
+    for line in server.report():
+        print(line)